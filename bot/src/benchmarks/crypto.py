@@ -0,0 +1,65 @@
+"""Event loop stall while deciphering a batch of tokens (as on token storage reload): inline vs `decipher_many`.
+The stall is the max gap between ticks of a task scheduled every millisecond.
+
+# Use-case
+```
+    cd bot/src && python -m benchmarks.crypto --tokens 1000
+```
+"""
+import argparse
+import asyncio
+import time
+
+from fernet import Fernet
+
+from utils.crypto import Crypto
+
+
+async def _measure_max_stall(coro) -> tuple[float, float]:
+    """:return: duration of the coro and max event loop stall during it."""
+    max_stall = 0.0
+    is_done = False
+
+    async def _tick():
+        nonlocal max_stall
+        last_tick_at = time.perf_counter()
+        while not is_done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            max_stall = max(max_stall, now - last_tick_at - 0.001)
+            last_tick_at = now
+
+    ticker = asyncio.create_task(_tick())
+    await asyncio.sleep(0.01)
+    started_at = time.perf_counter()
+    await coro
+    duration = time.perf_counter() - started_at
+    is_done = True
+    await ticker
+    return duration, max_stall
+
+
+async def run(n: int):
+    fernet = Fernet(Fernet.generate_key())
+    ciphered = [Crypto(fernet).cipher_to_str(f'sk-{i:048d}') for i in range(n)]
+
+    async def _inline():
+        crypto = Crypto(fernet)
+        return [crypto.decipher_to_str(value) for value in ciphered]
+
+    crypto = Crypto(fernet)
+    for name, coro in (
+            ('inline', _inline()),
+            ('decipher_many', crypto.decipher_many(ciphered)),
+            ('decipher_many (cached)', crypto.decipher_many(ciphered)),
+    ):
+        duration, max_stall = await _measure_max_stall(coro)
+        print(f'- {name}: {duration * 1e3:.1f}ms, max event loop stall: {max_stall * 1e3:.1f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=1000)
+    args = parser.parse_args()
+    print(f'Decipher {args.tokens} tokens:')
+    asyncio.run(run(args.tokens))
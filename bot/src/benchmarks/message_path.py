@@ -0,0 +1,317 @@
+"""Message hot path: synthetic messages are fed through the real dispatcher (filters, middlewares, handlers,
+message cache), with fakeredis (or a local Redis) and a local stub of Telegram Bot API and AI providers.
+
+Reported per update: throughput, handler latency, Redis commands (and round trips), Telegram and provider calls,
+memory blocks retained and peak traced memory (a separate pass under tracemalloc, since it slows down the rest).
+CPython has no counter of allocations, thus retained blocks (leaks, caches growth) and peak are reported instead.
+Results could be saved as a baseline and compared with it, the run fails if a metric regressed over the threshold.
+
+Note, logging is not configured, thus INFO records are dropped (as with LOG_LEVEL=WARNING),
+unless --with-logging is passed (then redirect stderr, e.g. `2>/dev/null`).
+
+fakeredis is a development requirement, see requirements-dev.txt.
+
+# Use-case
+```
+    cd bot/src && pip install -r requirements-dev.txt
+    cd bot/src && python -m benchmarks.message_path --updates 5000 --save-baseline /tmp/message_path.json
+    # After a change.
+    cd bot/src && python -m benchmarks.message_path --updates 5000 --baseline /tmp/message_path.json
+```
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+from aiohttp import web
+
+_STUB_HOST = '127.0.0.1'
+_STUB_PORT = 8768
+_BOT_USERNAME = 'phd_benchmark_bot'
+_PRIORITY_CHATS = [-1000000000001 - i for i in range(10)]
+_OTHER_CHATS = [-1000000001001 - i for i in range(100)]
+_USERS = [1000000001 + i for i in range(1000)]
+
+# Higher is better for these, lower for the rest.
+_HIGHER_IS_BETTER = {'updates_per_second'}
+# Too noisy (e.g. GC timing) to fail the run, only reported.
+_NOT_GATED = {'retained_blocks_per_update'}
+
+
+class _Counters:
+    redis_commands = 0
+    redis_round_trips = 0
+    telegram_calls = 0
+    provider_calls = 0
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        return {
+            'redis_commands': cls.redis_commands,
+            'redis_round_trips': cls.redis_round_trips,
+            'telegram_calls': cls.telegram_calls,
+            'provider_calls': cls.provider_calls,
+        }
+
+
+def _install_redis(redis_url: Optional[str]):
+    """Redis commands are counted on the client, without redis_url the bot gets fakeredis."""
+    import redis.asyncio
+    from redis.asyncio.client import Pipeline, Redis
+
+    execute_command = Redis.execute_command
+    execute = Pipeline.execute
+
+    async def _execute_command(self, *args, **options):
+        _Counters.redis_commands += 1
+        _Counters.redis_round_trips += 1
+        return await execute_command(self, *args, **options)
+
+    async def _execute(self, *args, **kwargs):
+        _Counters.redis_commands += len(self.command_stack)
+        _Counters.redis_round_trips += 1
+        return await execute(self, *args, **kwargs)
+
+    Redis.execute_command = _execute_command
+    Pipeline.execute = _execute
+
+    if redis_url:
+        url = redis.asyncio.connection.parse_url(redis_url)
+        os.environ['REDIS_HOST'] = url.get('host', 'localhost')
+        os.environ['REDIS_PORT'] = str(url.get('port', 6379))
+        return
+
+    from fakeredis import FakeServer
+    from fakeredis.aioredis import FakeRedis
+
+    server = FakeServer()
+
+    class _FakeRedis(FakeRedis):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop('host', None)
+            kwargs.pop('port', None)
+            super().__init__(*args, server=server, **kwargs)
+
+    # bot.misc creates the client on import as `redis.Redis(...)`.
+    redis.asyncio.Redis = _FakeRedis
+
+
+def _configure_bot_env():
+    os.environ.setdefault('TG_BOT_TOKEN', '123456:benchmark')
+    os.environ['TG_BOT_USERNAME'] = _BOT_USERNAME
+    os.environ['PRIORITY_CHATS'] = json.dumps(_PRIORITY_CHATS)
+    os.environ['TG_SUPERADMIN_IDS'] = '[1]'
+    os.environ.setdefault('OPENAI_TOKEN', 'sk-benchmark')
+    os.environ.setdefault('PERPLEXITY_TOKEN', 'pplx-benchmark')
+
+
+async def _handle_telegram(request: web.Request) -> web.Response:
+    _Counters.telegram_calls += 1
+    method = request.match_info['method'].lower()
+    data = await request.post()
+    if method == 'getme':
+        result = {'id': 123456, 'is_bot': True, 'first_name': 'PhD', 'username': _BOT_USERNAME}
+    elif method in ('sendmessage', 'editmessagetext', 'forwardmessage', 'sendsticker'):
+        result = {
+            'message_id': next(request.app['message_ids']),
+            'date': int(time.time()),
+            'chat': {'id': int(data.get('chat_id', 0)), 'type': 'supergroup', 'title': 'Benchmark'},
+            'from': {'id': 123456, 'is_bot': True, 'first_name': 'PhD', 'username': _BOT_USERNAME},
+            'text': data.get('text', ''),
+        }
+    else:
+        result = True
+    return web.json_response({'ok': True, 'result': result})
+
+
+async def _handle_provider(request: web.Request) -> web.StreamResponse:
+    """OpenAI and Perplexity like response (all fields of completions, chat completions and chunks at once)."""
+    _Counters.provider_calls += 1
+    data = await request.json()
+    await asyncio.sleep(request.app['provider_latency'])
+    text = 'A PhD is a doctoral degree. ' * 5
+    if not data.get('stream'):
+        return web.json_response({
+            'choices': [{'text': text, 'message': {'role': 'assistant', 'content': text}}],
+            'citations': [],
+        })
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+    await response.prepare(request)
+    for word in text.split(' '):
+        chunk = {'choices': [{'text': word + ' ', 'delta': {'content': word + ' '}}], 'citations': []}
+        await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+    await response.write(b'data: [DONE]\n\n')
+    return response
+
+
+async def _start_stub(provider_latency: float) -> web.AppRunner:
+    app = web.Application()
+    app['message_ids'] = itertools.count(10 ** 6)
+    app['provider_latency'] = provider_latency
+    app.router.add_post('/bot{token}/{method}', _handle_telegram)
+    app.router.add_post('/openai/{tail:.*}', _handle_provider)
+    app.router.add_post('/perplexity/{tail:.*}', _handle_provider)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, _STUB_HOST, _STUB_PORT).start()
+    return runner
+
+
+def _make_updates(n: int, ai_share: float, echo_share: float, seed: int, start_id: int = 1) -> list[dict]:
+    """Mostly chatter in ordinary chats, echo triggers, and questions (some are replies) in priority chats."""
+    rnd = random.Random(seed)
+    last_message_by_chat: dict[int, dict] = {}
+    updates = []
+    for update_id in range(start_id, start_id + n):
+        kind = rnd.random()
+        if kind < ai_share:
+            chat_id = rnd.choice(_PRIORITY_CHATS)
+            text = f'What is the {update_id}th step of a PhD?'
+        else:
+            chat_id = rnd.choice(_OTHER_CHATS)
+            text = f'phd message {update_id}' if kind < ai_share + echo_share else f'Message {update_id}'
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Benchmark'},
+            'from': {'id': rnd.choice(_USERS), 'is_bot': False, 'first_name': 'Student'},
+            'text': text,
+        }
+        previous = last_message_by_chat.get(chat_id)
+        if previous is not None and rnd.random() < 0.5:
+            # A dialog, thus its context is read from the message cache.
+            message['reply_to_message'] = previous
+        last_message_by_chat[chat_id] = {k: v for k, v in message.items() if k != 'reply_to_message'}
+        updates.append({'update_id': update_id, 'message': message})
+    return updates
+
+
+async def _feed(dp, bot, updates: list[dict], concurrency: int) -> list[float]:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _feed_one(update: dict):
+        async with semaphore:
+            started_at = time.perf_counter()
+            await dp.feed_raw_update(bot, update)
+            latencies.append(time.perf_counter() - started_at)
+
+    await asyncio.gather(*[_feed_one(update) for update in updates])
+    return latencies
+
+
+async def run(args) -> dict:
+    from aiogram.client.telegram import TelegramAPIServer
+
+    # Settings and singletons are created on import, thus the bot is imported after the environment is prepared.
+    from bot import middlewares, filters, handlers  # noqa
+    from bot.misc import dp, bot, http_session_pool, openai_client_priority, perplexity_client_priority
+    from clients.openai.client import OpenAIClient
+    from utils.tokenizer import load_tokenizers
+
+    # As on the bot start, not to measure the load on the first AI request.
+    await load_tokenizers([OpenAIClient.COMPLETIONS_MODEL, OpenAIClient.CHAT_COMPLETIONS_MODEL])
+
+    stub = await _start_stub(args.provider_latency)
+    stub_url = f'http://{_STUB_HOST}:{_STUB_PORT}'
+    bot.session.api = TelegramAPIServer.from_base(stub_url)
+    openai_client_priority.endpoint = f'{stub_url}/openai/v1/'
+    perplexity_client_priority.endpoint = f'{stub_url}/perplexity/'
+    try:
+        await _feed(dp, bot, _make_updates(args.warmup, args.ai_share, args.echo_share, seed=0), args.concurrency)
+
+        updates = _make_updates(args.updates, args.ai_share, args.echo_share, seed=1, start_id=10 ** 6)
+        before = _Counters.snapshot()
+        started_at = time.perf_counter()
+        latencies = await _feed(dp, bot, updates, args.concurrency)
+        duration = time.perf_counter() - started_at
+        after = _Counters.snapshot()
+
+        alloc_updates = _make_updates(args.alloc_updates, args.ai_share, args.echo_share, seed=2, start_id=10 ** 7)
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        await _feed(dp, bot, alloc_updates, args.concurrency)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        gc.collect()
+        blocks_after = sys.getallocatedblocks()
+    finally:
+        await stub.cleanup()
+        await http_session_pool.close()
+        await bot.session.close()
+
+    latencies.sort()
+    return {
+        'updates_per_second': len(updates) / duration,
+        'p50_latency_ms': latencies[len(latencies) // 2] * 1e3,
+        'p99_latency_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1e3,
+        **{f'{name}_per_update': (after[name] - before[name]) / len(updates) for name in after},
+        'retained_blocks_per_update': (blocks_after - blocks_before) / max(len(alloc_updates), 1),
+        'traced_peak_kib': traced_peak / 1024,
+    }
+
+
+def _compare(result: dict, baseline: dict, max_regression: float) -> list[str]:
+    """:return: regressed metrics."""
+    regressed = []
+    for name, value in result.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'- {name}: {value:.2f}')
+            continue
+        change = (value - base) / base if base else 0.0
+        is_regressed = (
+            name not in _NOT_GATED and (-change if name in _HIGHER_IS_BETTER else change) > max_regression
+        )
+        if is_regressed:
+            regressed.append(name)
+        print(f'- {name}: {base:.2f} -> {value:.2f} ({change:+.1%}){" REGRESSED" if is_regressed else ""}')
+    return regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--alloc-updates', type=int, default=500, help='Updates of the pass under tracemalloc.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Updates handled at once (as polling tasks).')
+    parser.add_argument('--ai-share', type=float, default=0.1, help='Share of questions to AI in priority chats.')
+    parser.add_argument('--echo-share', type=float, default=0.1, help='Share of messages triggering the echo.')
+    parser.add_argument('--provider-latency', type=float, default=0.0, help='Seconds of stub provider responses.')
+    parser.add_argument('--with-logging', action='store_true', help='Configure logging as the bot does.')
+    parser.add_argument('--redis-url', help='Local Redis, e.g. redis://localhost:6379, None - fakeredis.')
+    parser.add_argument('--baseline', help='Json of a previous run to compare with.')
+    parser.add_argument('--save-baseline', help='Path to save results as json.')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='Relative, to fail the run.')
+    args = parser.parse_args()
+
+    _configure_bot_env()
+    _install_redis(args.redis_url)
+    if args.with_logging:
+        from config.log import setup_logging
+        setup_logging()
+    print(f'Feed {args.updates} updates with concurrency {args.concurrency}:')
+    result = asyncio.run(run(args))
+
+    regressed = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = _compare(result, json.load(f), args.max_regression)
+    else:
+        for name, value in result.items():
+            print(f'- {name}: {value:.2f}')
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+    if regressed:
+        sys.exit(f'Regressed over {args.max_regression:.0%}: {", ".join(regressed)}')
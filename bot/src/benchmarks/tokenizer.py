@@ -0,0 +1,63 @@
+"""Throughput of the tokenizer on long (up to Telegram max length) messages.
+
+# Use-case
+```
+    cd bot/src && python -m benchmarks.tokenizer --messages 1000 --length 4096
+```
+"""
+import argparse
+import random
+import time
+
+from utils.tokenizer import get_tokenizer
+
+_WORDS = (
+    'PhD', 'thesis', 'supervisor', 'deadline', 'SUSY', 'experiment', 'результат', 'диссертация', 'научный',
+    'руководитель', 'статья', 'physics', '...', '?', 'https://arxiv.org/abs/1234.56789', '42', '😅',
+)
+
+
+def _generate_messages(n: int, length: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        words = []
+        size = 0
+        while size < length:
+            word = rnd.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        messages.append(' '.join(words)[:length])
+    return messages
+
+
+def run(n: int, length: int, model: str):
+    tokenizer = get_tokenizer(model)
+    started_at = time.perf_counter()
+    is_exact = tokenizer.is_exact
+    print(f'Tokenizer {tokenizer.encoding_name} (exact: {is_exact}) loaded in {time.perf_counter() - started_at:.3f}s.')
+
+    messages = _generate_messages(n, length)
+    total_bytes = sum(len(message.encode()) for message in messages)
+
+    started_at = time.perf_counter()
+    total_tokens = sum(tokenizer.count(message) for message in messages)
+    count_time = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    for message in messages:
+        tokenizer.truncate(message, 512)
+    truncate_time = time.perf_counter() - started_at
+
+    print(f'{n} messages of {length} chars, {total_bytes / 1e6:.2f} MB, {total_tokens} tokens:')
+    print(f'- count: {count_time:.3f}s, {n / count_time:.0f} messages/s, {total_bytes / 1e6 / count_time:.2f} MB/s')
+    print(f'- truncate to 512 tokens: {truncate_time:.3f}s, {n / truncate_time:.0f} messages/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--length', type=int, default=4096, help='Message length in chars.')
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    args = parser.parse_args()
+    run(args.messages, args.length, args.model)
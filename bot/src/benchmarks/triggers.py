@@ -0,0 +1,103 @@
+"""AI trigger evaluation on long (up to Telegram max length) messages: separate checks (as the filter did before,
+i.e. question mark search, endings, mention search over a lowercased copy, then chat keywords) vs 1 pass of
+`TriggerEngine`.
+
+The length trigger is off here (otherwise long messages are not scanned at all), thus it is the cost for texts
+the bot reads up to the end: without triggers (the worst case) and with a trigger in the end.
+
+# Use-case
+```
+    cd bot/src && python -m benchmarks.triggers --messages 1000 --length 4096 --keywords 10
+```
+"""
+import argparse
+import random
+import re
+import time
+from typing import Callable, Optional
+
+from utils.trigger_engine import TriggerEngine, endings_rule, keywords_rule, mention_rule, question_rule
+
+_BOT_USERNAME = 'phd_benchmark_bot'
+_ENDINGS = ('...', '..', ':')
+# Without triggers (no '?', '@', chat keywords), endings are added only in the end.
+_WORDS = (
+    'PhD', 'thesis', 'supervisor', 'deadline', 'SUSY', 'experiment', 'результат', 'диссертация', 'научный',
+    'руководитель', 'статья', 'physics', 'https://arxiv.org/abs/1234.56789', '42', '😅', 'e-mail', 'a.b',
+)
+
+
+def _generate_messages(n: int, length: int, suffix: str = '', seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        words = []
+        size = 0
+        while size < length:
+            word = rnd.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        messages.append(' '.join(words)[:length - len(suffix)] + suffix)
+    return messages
+
+
+def _get_separate_checks(keywords: list[str]) -> Callable[[str], Optional[str]]:
+    re_question_mark = re.compile(r'\?')
+    re_bot_mentioned = re.compile('@' + _BOT_USERNAME.lower())
+    re_keywords = [re.compile(re.escape(keyword)) for keyword in keywords]
+
+    def check(text: str) -> Optional[str]:
+        if re_question_mark.search(text):
+            return 'question'
+        if text.endswith(_ENDINGS):
+            return 'ending'
+        lowered = text.lower()
+        if re_bot_mentioned.search(lowered):
+            return 'mention'
+        for re_keyword in re_keywords:
+            if re_keyword.search(lowered):
+                return 'keyword'
+        return None
+    return check
+
+
+def _measure(check: Callable[[str], Optional[str]], messages: list[str]) -> tuple[float, set]:
+    started_at = time.perf_counter()
+    triggers = {check(message) for message in messages}
+    return time.perf_counter() - started_at, triggers
+
+
+def run(n: int, length: int, keywords_number: int):
+    keywords = [f'keyword{i}' for i in range(keywords_number)]
+    engine = TriggerEngine([
+        question_rule(), endings_rule(_ENDINGS), mention_rule(_BOT_USERNAME), keywords_rule(keywords),
+    ])
+    separate_checks = _get_separate_checks(keywords)
+
+    cases = {
+        'no trigger': '',
+        'question in the end': ' why?',
+        'mention in the end': f' @{_BOT_USERNAME.upper()}',
+    }
+    if keywords:
+        cases['keyword in the end'] = f' {keywords[-1]}'
+    print(f'{n} messages of {length} chars, {keywords_number} chat keywords:')
+    for case, suffix in cases.items():
+        messages = _generate_messages(n, length, suffix)
+        separate_time, separate_triggers = _measure(separate_checks, messages)
+        engine_time, engine_triggers = _measure(engine.match, messages)
+        assert separate_triggers == engine_triggers, (separate_triggers, engine_triggers)
+        print(
+            f'- {case} ({", ".join(map(str, engine_triggers))}): '
+            f'separate checks {n / separate_time:.0f} messages/s, '
+            f'engine {n / engine_time:.0f} messages/s ({separate_time / engine_time:.2f}x)'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--length', type=int, default=4096, help='Message length in chars.')
+    parser.add_argument('--keywords', type=int, default=10, help='Number of chat keywords.')
+    args = parser.parse_args()
+    run(args.messages, args.length, args.keywords)
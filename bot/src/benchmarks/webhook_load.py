@@ -0,0 +1,108 @@
+"""Webhook throughput: POSTs synthetic message updates with the secret token and reports updates/second.
+Without --url a local webhook app with a no-op message handler is started, to measure the ingress itself;
+with --url the running bot is loaded (e.g. with several TG_BOT_WEBHOOK_WORKERS), note its handlers really run.
+
+# Use-case
+```
+    cd bot/src && python -m benchmarks.webhook_load --updates 10000 --concurrency 100
+    cd bot/src && python -m benchmarks.webhook_load --url http://127.0.0.1:8080/webhook --secret "$SECRET"
+```
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from typing import Optional
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiohttp import web
+
+from bot.webhook import create_webhook_app
+
+_LOCAL_HOST = '127.0.0.1'
+_LOCAL_PORT = 8769
+_LOCAL_PATH = '/webhook'
+_LOCAL_SECRET = 'benchmark'
+
+
+def _make_update(update_id: int, chats: int) -> dict:
+    chat_id = -1000000000000 - update_id % chats
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Benchmark'},
+            'from': {'id': update_id % chats + 1, 'is_bot': False, 'first_name': 'Benchmark'},
+            'text': f'Synthetic message {update_id}',
+        },
+    }
+
+
+async def _start_local_app() -> web.AppRunner:
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def _noop(*args, **kwargs):
+        pass
+
+    dp.include_router(router)
+    runner = web.AppRunner(create_webhook_app(dp, Bot('123456:benchmark'), _LOCAL_PATH, _LOCAL_SECRET))
+    await runner.setup()
+    await web.TCPSite(runner, _LOCAL_HOST, _LOCAL_PORT).start()
+    return runner
+
+
+async def run(url: Optional[str], secret: str, updates: int, concurrency: int, chats: int):
+    runner = None
+    if url is None:
+        runner = await _start_local_app()
+        url, secret = f'http://{_LOCAL_HOST}:{_LOCAL_PORT}{_LOCAL_PATH}', _LOCAL_SECRET
+
+    update_ids = itertools.count(1)
+    latencies = []
+    errors = 0
+
+    async def _worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        for update_id in update_ids:
+            if update_id > updates:
+                return
+            started_at = time.perf_counter()
+            async with session.post(
+                    url, json=_make_update(update_id, chats), headers={'X-Telegram-Bot-Api-Secret-Token': secret},
+            ) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started_at)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started_at = time.perf_counter()
+            await asyncio.gather(*[_worker(session) for _ in range(concurrency)])
+            duration = time.perf_counter() - started_at
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    latencies.sort()
+    print(f'- {updates / duration:.0f} updates/s ({updates} in {duration:.2f}s), errors: {errors}')
+    for percentile in (50, 95, 99):
+        latency = latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)]
+        print(f'- p{percentile} latency: {latency * 1e3:.1f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='Webhook url of the running bot, None - start a local app.')
+    parser.add_argument('--secret', default='', help='TG_BOT_WEBHOOK_SECRET of the running bot (or the one derived from its token).')
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--chats', type=int, default=100, help='Updates are spread over that many chats.')
+    args = parser.parse_args()
+    print(f'POST {args.updates} updates with concurrency {args.concurrency}:')
+    asyncio.run(run(args.url, args.secret, args.updates, args.concurrency, args.chats))
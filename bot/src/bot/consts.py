@@ -2,13 +2,15 @@
 from enum import IntEnum
 
 TEXT_LENGTH_TRIGGER = 350
+AI_TRIGGER_ENDINGS = ('...', '..', ':')
 
 OPENAI_GENERAL_TRIGGERS = f"""It triggered automatically for ChatGPT feature when one of the condition is fulfilled:
 - text length > {TEXT_LENGTH_TRIGGER} symbols,
-- ends with ('...', '..', ':'),
+- ends with {AI_TRIGGER_ENDINGS},
 - with bot mentioned via @,
 - replied on a bot message,
-- text consists of question mark (?)
+- text consists of question mark (?),
+- text consists of one of keywords of the chat (set via /set_ai_bot_triggers)
 """
 
 class AIDiscussionMode(IntEnum):
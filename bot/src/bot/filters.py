@@ -1,29 +1,39 @@
 import logging
 import typing
-from re import compile
+from functools import lru_cache
+from typing import Optional, Union
 
 from aiogram.filters import Filter
 from aiogram import types, F
 
-from bot.consts import OPENAI_GENERAL_TRIGGERS, TEXT_LENGTH_TRIGGER
-from bot.misc import bot_ai_contributor_chat_storage, bot_chat_discussion_mode_storage
+from bot.consts import AI_TRIGGER_ENDINGS, OPENAI_GENERAL_TRIGGERS, TEXT_LENGTH_TRIGGER
+from bot.middlewares import UpdateContext
+from bot.misc import metrics
 from config.settings import settings
-
-re_question_mark = compile(r'\?')
-# TODO: to arg of a filter.
-# TODO: deprecate use of the bot username
-re_bot_mentioned = compile(r'@' + settings.TG_BOT_USERNAME.lower())
+from utils.trigger_engine import TriggerEngine, endings_rule, keywords_rule, mention_rule, question_rule
 
 logger = logging.getLogger(__name__)
 
 from_superadmin_filter = F.from_user.id.in_(settings.TG_SUPERADMIN_IDS)
 from_prioritised_chats_filter = F.chat.func(lambda chat: chat.id in settings.PRIORITY_CHATS)
 
+# Reported when the message is a reply on a bot message (it is not in the text, thus not a rule of engines).
+REPLY_TRIGGER = 'reply'
 
-def _is_bot_mentioned(text):
-    if not text:
-        return False
-    return re_bot_mentioned.search(text.lower())
+# TODO: to arg of a filter.
+# TODO: deprecate use of the bot username
+_mention_trigger_engine = TriggerEngine([mention_rule(settings.TG_BOT_USERNAME)])
+
+
+@lru_cache(maxsize=1024)
+def get_ai_trigger_engine(
+        keywords: tuple[str, ...] = (),
+        min_length: Optional[int] = TEXT_LENGTH_TRIGGER,
+        endings: tuple[str, ...] = AI_TRIGGER_ENDINGS,
+) -> TriggerEngine:
+    """Engines are compiled once per set of chat keywords (and are shared by chats with the same ones)."""
+    rules = [question_rule(), endings_rule(endings), mention_rule(settings.TG_BOT_USERNAME), keywords_rule(keywords)]
+    return TriggerEngine(rules, min_length=min_length)
 
 
 def _is_replied_to_bot(message: types.Message):
@@ -34,8 +44,19 @@ def _is_replied_to_bot(message: types.Message):
     return username == settings.TG_BOT_USERNAME
 
 
-def _is_interacted_with_bot(message: types.Message) -> bool:
-    return _is_bot_mentioned(message.text) or _is_replied_to_bot(message)
+def _get_interaction_trigger(message: types.Message) -> Optional[str]:
+    trigger = _mention_trigger_engine.match(message.text)
+    if trigger is None and _is_replied_to_bot(message):
+        trigger = REPLY_TRIGGER
+    return trigger
+
+
+def _to_filter_result(trigger: Optional[str]) -> Union[dict, bool]:
+    """The trigger is passed to handlers as `trigger` kwarg."""
+    if trigger is None:
+        return False
+    metrics.ai_triggers.labels(trigger).inc()
+    return {'trigger': trigger}
 
 
 class IsForSuperadminIteractedWithBotFilter(Filter):
@@ -44,13 +65,13 @@ class IsForSuperadminIteractedWithBotFilter(Filter):
     def __init__(self, is_superadmin_request_with_trigger: typing.Iterable):
         self.superadmin_ids = is_superadmin_request_with_trigger
 
-    async def __call__(self, message: types.Message) -> bool:
+    async def __call__(self, message: types.Message) -> Union[dict, bool]:
         # Check for user id.
         if message.from_user and message.from_user.id not in self.superadmin_ids:
             return False
 
         # Check if bot mentioned or replied to bot.
-        return _is_interacted_with_bot(message)
+        return _to_filter_result(_get_interaction_trigger(message))
 
 
 class IsChatGptTriggerABCFilter(Filter):
@@ -58,27 +79,22 @@ class IsChatGptTriggerABCFilter(Filter):
     text_length_trigger = TEXT_LENGTH_TRIGGER
 
     def __init__(self, *args, **kwargs):
-        self.on_endswith = ('...', '..', ':')
-
-    async def __call__(self, message: types.Message):
-        # Check if text exists.
-        if not message.text:
-            return False
-
-        # Check for length.
-        if len(message.text) > self.text_length_trigger:
-            return True
+        self.on_endswith = AI_TRIGGER_ENDINGS
 
-        # Check for if on question_mark.
-        text = message.text
-        if re_question_mark.search(text):
-            return True
+    def get_trigger(self, message: types.Message, keywords: tuple[str, ...] = ()) -> Optional[str]:
+        """All triggers of the text are checked in 1 pass.
 
-        # Check if endswith.
-        if self.on_endswith and text.endswith(self.on_endswith):
-            return True
+        :param keywords: of the chat.
+        :return: name of the trigger that fired, None if none.
+        """
+        engine = get_ai_trigger_engine(keywords, self.text_length_trigger, self.on_endswith)
+        trigger = engine.match(message.text)
+        if trigger is None and _is_replied_to_bot(message):
+            trigger = REPLY_TRIGGER
+        return trigger
 
-        return False
+    async def __call__(self, message: types.Message):
+        return _to_filter_result(self.get_trigger(message))
 
 
 class IsChatGptTriggerInPriorityChatFilter(IsChatGptTriggerABCFilter):
@@ -98,25 +114,25 @@ class IsChatGptTriggerInPriorityChatFilter(IsChatGptTriggerABCFilter):
         self.chat_id = is_for_openai_response_chats
         super().__init__(*args, **kwargs)
 
-    async def __call__(self, message: types.Message):
+    async def __call__(self, message: types.Message, update_context: Optional[UpdateContext] = None):
         # Check for chat id.
         if int(message.chat.id) not in self.chat_id:
             return False
-        
-        is_mention_only_mode = await bot_chat_discussion_mode_storage.get_is_mention_only_mode(message.chat.id)
+
+        update_context = update_context or UpdateContext.from_message(message)
+        is_mention_only_mode = await update_context.get_is_mention_only_mode()
         if is_mention_only_mode:
-            return _is_interacted_with_bot(message)
-        
-        return await super().__call__(message) or _is_interacted_with_bot(message)
+            return _to_filter_result(_get_interaction_trigger(message))
+
+        return _to_filter_result(self.get_trigger(message, await update_context.get_trigger_keywords()))
 
 
-async def _is_chat_stored_by_contributor(message: types.Message) -> bool:
+async def _is_chat_stored_by_contributor(message: types.Message, update_context: Optional[UpdateContext]) -> bool:
     if not message.from_user or not message.from_user.id:
         return False
 
-    tokens = await bot_ai_contributor_chat_storage.get(
-        message.from_user.id, message.chat.id,
-    )
+    update_context = update_context or UpdateContext.from_message(message)
+    tokens = await update_context.get_contributor_tokens()
     if not tokens.openai_token and not tokens.perplexity_token:
         return False
     return True
@@ -132,25 +148,25 @@ class IsChatGPTTriggerInContributorChatFilter(IsChatGptTriggerABCFilter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    async def __call__(self, message: types.Message):
-        if not await _is_chat_stored_by_contributor(message):
+    async def __call__(self, message: types.Message, update_context: Optional[UpdateContext] = None):
+        update_context = update_context or UpdateContext.from_message(message)
+        if not await _is_chat_stored_by_contributor(message, update_context):
             return False
-        
-        is_mention_only_mode = await bot_chat_discussion_mode_storage.get_is_mention_only_mode_by_contributor(message.chat.id, message.from_user.id)
+
+        is_mention_only_mode = await update_context.get_is_mention_only_mode_by_contributor()
         if is_mention_only_mode:
-            return _is_interacted_with_bot(message)
-        return await super().__call__(message) or _is_interacted_with_bot(message)
+            return _to_filter_result(_get_interaction_trigger(message))
+        return _to_filter_result(self.get_trigger(message, await update_context.get_trigger_keywords()))
 
 
 class IsFromOpenAIContributorInAllowedChatFilter(Filter):
     """This particular filter should be combined with other filters. It should check only openai token."""
-    async def __call__(self, message: types.Message):
+    async def __call__(self, message: types.Message, update_context: Optional[UpdateContext] = None):
         if not message.from_user or not message.from_user.id:
             return False
 
-        tokens = await bot_ai_contributor_chat_storage.get(
-            message.from_user.id, message.chat.id,
-        )
+        update_context = update_context or UpdateContext.from_message(message)
+        tokens = await update_context.get_contributor_tokens()
         if not tokens.openai_token:
             return False
         return True
@@ -158,8 +174,8 @@ class IsFromOpenAIContributorInAllowedChatFilter(Filter):
 
 class IsFromContributorInAllowedChatFilter(Filter):
     """Check if message from contributor and in allowed chat (by himself so)."""
-    async def __call__(self, message: types.Message):
-        return (await _is_chat_stored_by_contributor(message))
+    async def __call__(self, message: types.Message, update_context: Optional[UpdateContext] = None):
+        return (await _is_chat_stored_by_contributor(message, update_context))
 
 
 private_chat_filter = F.chat.func(lambda chat: chat.type == 'private')
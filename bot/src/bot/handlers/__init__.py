@@ -7,8 +7,11 @@ from .commands.ai import perplexity_contributor_token  # noqa
 from .commands.ai import switch_discussion_mode  # noqa
 from .commands.superadmin import broadcast_message  # noqa
 from .commands.superadmin import stats  # noqa
+from .commands.superadmin import ai_clients  # noqa
 from .commands.ai import openai_create_image  # noqa
 from .commands.ai import switch_mention_only_mode  # noqa
+from .commands.ai import switch_completion_cache  # noqa
+from .commands.ai import set_ai_bot_triggers  # noqa
 from .completion_responses import completion_responses  # noqa
 from . import new_chat_member  # noqa
 from . import left_chat_member  # noqa
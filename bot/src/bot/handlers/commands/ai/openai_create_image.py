@@ -1,13 +1,14 @@
 import logging
 
 from bot.filters import IsFromOpenAIContributorInAllowedChatFilter, from_superadmin_filter, from_prioritised_chats_filter
-from bot.utils import remember_chat_handler_decorator, cache_message_decorator
+from bot.utils import remember_chat_handler_decorator, cache_message_decorator, busy_reply_decorator
 from config.settings import settings
 
 from aiogram import types
 from aiogram.filters import Command
 from bot.handlers.commands.commands import CommandEnum
-from bot.misc import dp, openai_client_priority, bot_ai_contributor_chat_storage
+from bot.middlewares import UpdateContext
+from bot.misc import dp, openai_client_priority, create_openai_client, metrics
 from clients.openai.client import OpenAIClient
 
 logger = logging.getLogger(__name__)
@@ -64,13 +65,14 @@ async def _impl_replay_with_generated_image(
         message_with_prompt: types.Message,
         openai_client: OpenAIClient,
 ) -> types.Message:
-    openai_response = await openai_client.get_generated_image(text)
+    openai_response = await openai_client.get_generated_image(text, fairness_key=message_with_prompt.chat.id)
     # Check if response composed, otherwise try 1 more time
     if openai_response.error:
         logger.warning('OpenAI response is None, try to get 1 more time with secure phrase from bot...')
         few_strings = text[:99] if len(text) > 100 else text
         openai_response = await openai_client.get_generated_image(
-            'interpreter the following text for the scientific MIPT PhD student article work: ' + few_strings
+            'interpreter the following text for the scientific MIPT PhD student article work: ' + few_strings,
+            fairness_key=message_with_prompt.chat.id,
         )
         if openai_response.error:
             return await message_with_prompt.reply(
@@ -85,8 +87,10 @@ async def _impl_replay_with_generated_image(
 @dp.message(_generate_image_command, from_prioritised_chats_filter)
 @dp.channel_post(_generate_image_command, from_prioritised_chats_filter)
 @dp.message(_generate_image_command, from_superadmin_filter)
+@metrics.timed_handler('send_generated_image')
 @remember_chat_handler_decorator
 @cache_message_decorator
+@busy_reply_decorator
 async def send_generated_image(message: types.Message, *args, **kwargs):
     logger.info(
         f'User {message.from_user.username if message.from_user else "UNKNOWN"} request image '
@@ -99,13 +103,15 @@ async def send_generated_image(message: types.Message, *args, **kwargs):
 
 @dp.message(_generate_image_command, _is_from_contributor_and_his_chat_filter)
 @dp.channel_post(_generate_image_command, _is_from_contributor_and_his_chat_filter)
+@metrics.timed_handler('send_generated_image_for_contributor')
 @remember_chat_handler_decorator
 @cache_message_decorator
-async def send_generated_image_for_contributor(message: types.Message, *args, **kwargs):
-    tokens = await bot_ai_contributor_chat_storage.get(message.from_user.id, message.chat.id)
+@busy_reply_decorator
+async def send_generated_image_for_contributor(message: types.Message, update_context: UpdateContext, *args, **kwargs):
+    tokens = await update_context.get_contributor_tokens()
     logger.info(
         f'User {message.from_user.username} request image generation as for contributor {message = } '
         f'with replayed message text {message.reply_to_message.text if message.reply_to_message else ""}...'
     )
     (text, message_with_prompt) = _serialize_prompt(message)
-    return await _impl_replay_with_generated_image(text, message_with_prompt, OpenAIClient(tokens.openai_token))
+    return await _impl_replay_with_generated_image(text, message_with_prompt, create_openai_client(tokens.openai_token))
@@ -0,0 +1,48 @@
+import logging
+
+from aiogram import types, html
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+
+from bot.filters import IsFromContributorInAllowedChatFilter, from_prioritised_chats_filter
+from bot.handlers.commands.commands import CommandEnum
+from bot.misc import dp, bot_chat_discussion_mode_storage
+from bot.utils import cache_message_decorator, remember_chat_handler_decorator
+
+logger = logging.getLogger(__name__)
+
+_command_filter = Command(CommandEnum.set_ai_bot_triggers.name)
+
+is_from_contributor_in_allowed_chat_filter = IsFromContributorInAllowedChatFilter()
+
+MAX_KEYWORDS = 20
+MAX_KEYWORD_LENGTH = 64
+
+
+def _parse_keywords(args: str) -> list[str]:
+    """Comma separated, case insensitive (thus lowercased), duplicates are dropped."""
+    keywords = []
+    for keyword in args.split(','):
+        keyword = keyword.strip().lower()
+        if keyword and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords
+
+
+@dp.message(_command_filter, from_prioritised_chats_filter)
+@dp.message(_command_filter, is_from_contributor_in_allowed_chat_filter)
+@remember_chat_handler_decorator
+@cache_message_decorator
+async def set_ai_bot_triggers(message: types.Message, state: FSMContext, command: CommandObject, *args, **kwargs):
+    logger.info('[set_ai_bot_triggers] User %s used command %s...', message.from_user.username, CommandEnum.set_ai_bot_triggers.name)
+    keywords = _parse_keywords(command.args or '')
+    if len(keywords) > MAX_KEYWORDS or any(len(keyword) > MAX_KEYWORD_LENGTH for keyword in keywords):
+        return await message.reply(
+            f'Up to {MAX_KEYWORDS} keywords up to {MAX_KEYWORD_LENGTH} symbols each, e.g. '
+            f'{html.quote(f"/{CommandEnum.set_ai_bot_triggers.name} thesis, grant, deadline")}'
+        )
+
+    await bot_chat_discussion_mode_storage.set_trigger_keywords(message.chat.id, keywords)
+    if not keywords:
+        return await message.reply('AI trigger keywords of this chat: ' + html.bold('none'))
+    return await message.reply('AI trigger keywords of this chat: ' + html.bold(html.quote(', '.join(keywords))))
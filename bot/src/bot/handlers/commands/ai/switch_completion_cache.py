@@ -0,0 +1,30 @@
+import logging
+
+from aiogram import types, html
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+
+from bot.filters import IsFromContributorInAllowedChatFilter, from_prioritised_chats_filter
+from bot.handlers.commands.commands import CommandEnum
+from bot.misc import dp, bot_chat_discussion_mode_storage
+from bot.utils import cache_message_decorator, remember_chat_handler_decorator
+
+logger = logging.getLogger(__name__)
+
+_command_filter = Command(CommandEnum.switch_completion_cache.name)
+
+is_from_contributor_in_allowed_chat_filter = IsFromContributorInAllowedChatFilter()
+
+
+@dp.message(_command_filter, from_prioritised_chats_filter)
+@dp.message(_command_filter, is_from_contributor_in_allowed_chat_filter)
+@remember_chat_handler_decorator
+@cache_message_decorator
+async def switch_completion_cache(message: types.Message, state: FSMContext, *args, **kwargs):
+    logger.info('[switch_completion_cache] User %s used command %s...', message.from_user.username, CommandEnum.switch_completion_cache.name)
+    is_completion_cache_disabled = await bot_chat_discussion_mode_storage.get_is_completion_cache_disabled(message.chat.id)
+    new_value = not is_completion_cache_disabled
+    await bot_chat_discussion_mode_storage.set_is_completion_cache_disabled(message.chat.id, new_value)
+
+    status = 'disabled' if new_value else 'enabled'
+    return await message.reply(f'Reuse of AI answers in this chat: {html.bold(status)}')
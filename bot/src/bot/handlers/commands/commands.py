@@ -48,6 +48,14 @@ class CommandEnum(CommandABC):
     )
     switch_discussion_mode = f'Switch discussion mode: {AIDiscussionMode.PERPLEXITY.get_mode_name()} vs {AIDiscussionMode.OPENAI.get_mode_name()} [everyone].'
     switch_mention_only_mode = f'Switch mention only mode (bot triggers on mention or on bot reply vs triggers from /show_ai_bot_triggers), default=disabled [everyone].'
+    switch_completion_cache = (
+        'Switch reuse of AI answers to the same questions asked before (in any chat), default=enabled '
+        '[priority chats, contributors].'
+    )
+    set_ai_bot_triggers = (
+        'Set comma separated keywords of the chat that trigger the bot as ones from /show_ai_bot_triggers, '
+        'without keywords - remove them [priority chats, contributors].'
+    )
 
 
 class CommandAdminEnum(CommandABC):
@@ -56,3 +64,6 @@ class CommandAdminEnum(CommandABC):
     broadcast_message = (
         'It broadcasts mentioned message to all chats, where bot is, excluding TG_PHD_WORK_EXCLUDE_CHATS.'
     )
+    show_circuit_breakers = 'Show state of circuit breakers of AI API endpoints (of this bot process).'
+    show_ai_queues = 'Show concurrency and queues of AI requests per provider (of this bot process).'
+    show_completion_cache = 'Show hits and misses of the AI completion cache (of this bot process).'
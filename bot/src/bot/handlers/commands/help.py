@@ -1,12 +1,12 @@
 import logging
 from random import choice
 
-from aiogram import types
+from aiogram import types, html
 from aiogram.filters import Command
 
 from bot.consts import OPENAI_GENERAL_TRIGGERS
 from bot.handlers.commands.commands import CommandEnum
-from bot.misc import dp
+from bot.misc import dp, bot_chat_discussion_mode_storage
 from bot.utils import cache_message_decorator, remember_chat_handler_decorator
 
 logger = logging.getLogger(__name__)
@@ -69,4 +69,10 @@ async def handle_help(message: types.Message, *args, **kwargs):
 @remember_chat_handler_decorator
 @cache_message_decorator
 async def handle_openai_triggers(message: types.Message, *args, **kwargs):
-    return await message.reply(OPENAI_GENERAL_TRIGGERS)
+    keywords = await bot_chat_discussion_mode_storage.get_trigger_keywords(message.chat.id)
+    if not keywords:
+        return await message.reply(OPENAI_GENERAL_TRIGGERS)
+    return await message.reply(
+        html.quote(OPENAI_GENERAL_TRIGGERS) + '\nKeywords of this chat: ' + html.bold(html.quote(', '.join(keywords))),
+        parse_mode='HTML',
+    )
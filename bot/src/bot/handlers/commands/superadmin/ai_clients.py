@@ -0,0 +1,42 @@
+import logging
+
+from aiogram import types
+from aiogram.filters import Command
+
+from bot.filters import from_superadmin_filter
+from bot.handlers.commands.commands import CommandAdminEnum
+from bot.misc import (
+    dp, circuit_breaker_registry, openai_admission_controller, perplexity_admission_controller, ai_singleflight,
+    completion_cache,
+)
+from bot.utils import cache_message_decorator
+
+logger = logging.getLogger(__name__)
+
+
+@dp.message(Command(CommandAdminEnum.show_circuit_breakers.name), from_superadmin_filter)
+@cache_message_decorator
+async def handle_show_circuit_breakers(message: types.Message, *args, **kwargs):
+    logger.info('[handle_show_circuit_breakers] Send circuit breakers state to admin...')
+    return await message.reply(f'Circuit breakers:\n{circuit_breaker_registry.to_text()}')
+
+
+@dp.message(Command(CommandAdminEnum.show_ai_queues.name), from_superadmin_filter)
+@cache_message_decorator
+async def handle_show_ai_queues(message: types.Message, *args, **kwargs):
+    logger.info('[handle_show_ai_queues] Send AI requests queues state to admin...')
+    return await message.reply(
+        f'AI requests queues:\n'
+        f'- {openai_admission_controller.to_text()}\n'
+        f'- {perplexity_admission_controller.to_text()}\n'
+        f'Identical requests: {ai_singleflight.to_text()}'
+    )
+
+
+@dp.message(Command(CommandAdminEnum.show_completion_cache.name), from_superadmin_filter)
+@cache_message_decorator
+async def handle_show_completion_cache(message: types.Message, *args, **kwargs):
+    logger.info('[handle_show_completion_cache] Send completion cache stats to admin...')
+    if completion_cache is None:
+        return await message.reply('Completion cache is disabled, see AI_COMPLETION_CACHE_ENABLED.')
+    return await message.reply(f'Completion cache:\n{completion_cache.to_text()}')
@@ -4,12 +4,17 @@ from aiogram import Bot, types, html
 
 from bot.handlers.completion_responses.openai import send_openai_response
 from bot.handlers.completion_responses.perplexity import send_perplexity_response
-from bot.misc import dp, openai_client_priority, bot_ai_contributor_chat_storage, perplexity_client_priority, bot_chat_discussion_mode_storage
+from bot.misc import (
+    dp, openai_client_priority, bot_ai_contributor_chat_storage, perplexity_client_priority,
+    bot_chat_discussion_mode_storage, create_openai_client, create_perplexity_client, metrics,
+)
 from bot.consts import AIDiscussionMode
+from bot.middlewares import UpdateContext
 from bot.handlers.commands.commands import CommandEnum
-from clients.perplexity.client import PerplexityClient
-from bot.utils import remember_chat_handler_decorator, cache_message_decorator
-from clients.openai.client import OpenAIClient, OpenAIInvalidRequestError
+from bot.utils import remember_chat_handler_decorator, cache_message_decorator, busy_reply_decorator
+from clients.openai.client import OpenAIInvalidRequestError
+from utils.admission_controller import AdmissionRejectedError
+from utils.circuit_breaker import CircuitBreakerOpenError
 from bot.filters import (
     IsForSuperadminIteractedWithBotFilter, IsChatGptTriggerInPriorityChatFilter,
     IsChatGPTTriggerInContributorChatFilter,
@@ -27,29 +32,55 @@ is_trigger_in_contributor_chat_filter = IsChatGPTTriggerInContributorChatFilter(
 @dp.message(superadmin_iteracted_with_bot_filter)
 @dp.channel_post(is_trigger_in_priority_chat_filter)
 @dp.channel_post(superadmin_iteracted_with_bot_filter)
+@metrics.timed_handler('send_completion_response')
 @remember_chat_handler_decorator
 @cache_message_decorator
-async def send_completion_response(message: types.Message, *args, **kwargs):
+@busy_reply_decorator
+async def send_completion_response(message: types.Message, update_context: UpdateContext, *args, **kwargs):
     logger.info('[send_completion_response] Use priority completion client...')
-    discussion_mode = await bot_chat_discussion_mode_storage.get_discussion_mode(message.chat.id)
+    discussion_mode = await update_context.get_discussion_mode()
+    use_completion_cache = not await update_context.get_is_completion_cache_disabled()
     if discussion_mode and discussion_mode == AIDiscussionMode.PERPLEXITY:
-        return await send_perplexity_response(message, perplexity_client=perplexity_client_priority)
+        try:
+            return await send_perplexity_response(message, perplexity_client_priority, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            logger.warning('[send_completion_response] %s Fallback to OpenAI...', e)
+        try:
+            return await send_openai_response(message, openai_client_priority, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            return await _reply_unavailable(message, e, AIDiscussionMode.OPENAI.get_mode_name())
     else:
         # In case if not specified: use default OpenAI.
-        return await send_openai_response(message, openai_client=openai_client_priority)
+        try:
+            return await send_openai_response(message, openai_client_priority, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            logger.warning('[send_completion_response] %s Fallback to Perplexity...', e)
+        try:
+            return await send_perplexity_response(message, perplexity_client_priority, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            return await _reply_unavailable(message, e, AIDiscussionMode.PERPLEXITY.get_mode_name())
+
+
+async def _reply_unavailable(message: types.Message, e: CircuitBreakerOpenError, mode_name: str):
+    """If there is no fallback left (it is failing as well or there is no token for it)."""
+    logger.warning('[send_completion_response] %s No fallback left.', e)
+    return await message.reply(f'{mode_name} is temporarily unavailable, try again in {int(e.retry_in) + 1} seconds.')
 
 
 @dp.message(is_trigger_in_contributor_chat_filter)
 @dp.channel_post(is_trigger_in_contributor_chat_filter)
+@metrics.timed_handler('send_completion_response_for_contributor')
 @remember_chat_handler_decorator
 @cache_message_decorator
-async def send_completion_response_for_contributor(message: types.Message, bot: Bot, *args, **kwargs):
+@busy_reply_decorator
+async def send_completion_response_for_contributor(
+        message: types.Message, bot: Bot, update_context: UpdateContext, *args, **kwargs,
+):
     logger.info('[send_completion_response_for_contributor] Use contributor completion client...')
-    tokens = await bot_ai_contributor_chat_storage.get(message.from_user.id, message.chat.id)
-    discussion_mode = await bot_chat_discussion_mode_storage.get_discussion_mode_by_contributor(
-        message.chat.id, message.from_user.id,
-    )
+    tokens = await update_context.get_contributor_tokens()
+    discussion_mode = await update_context.get_discussion_mode_by_contributor()
     logger.info(f'[send_completion_response] Current discussion mode: {discussion_mode}')
+    use_completion_cache = not await update_context.get_is_completion_cache_disabled()
 
     # Determine current and fallback modes.
     is_perplexity = discussion_mode == AIDiscussionMode.PERPLEXITY
@@ -61,7 +92,17 @@ async def send_completion_response_for_contributor(message: types.Message, bot:
     # Try to handle with current mode or fallback.
     if current_token:
         handler = _handle_perplexity_contributor_message if is_perplexity else _handle_openai_contributor_message
-        return await handler(message, current_token)
+        try:
+            return await handler(message, current_token, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            if not fallback_token:
+                return await _reply_unavailable(message, e, current_mode.get_mode_name())
+            logger.warning('[send_completion_response_for_contributor] %s Fallback to %s...', e, fallback_mode)
+        handler = _handle_perplexity_contributor_message if not is_perplexity else _handle_openai_contributor_message
+        try:
+            return await handler(message, fallback_token, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            return await _reply_unavailable(message, e, fallback_mode.get_mode_name())
     elif fallback_token:
         # Switch to fallback mode since it has a valid token.
         await bot_chat_discussion_mode_storage.set_discussion_mode_by_contributor(
@@ -80,7 +121,10 @@ async def send_completion_response_for_contributor(message: types.Message, bot:
             f'Use {_get_token_command(current_mode)} to add {current_mode.get_mode_name()} token if needed.'
         )
         handler = _handle_perplexity_contributor_message if not is_perplexity else _handle_openai_contributor_message
-        return await handler(message, fallback_token)
+        try:
+            return await handler(message, fallback_token, use_completion_cache)
+        except CircuitBreakerOpenError as e:
+            return await _reply_unavailable(message, e, fallback_mode.get_mode_name())
     
     # No tokens available
     return await message.reply(
@@ -98,9 +142,13 @@ def _get_token_command(mode: AIDiscussionMode) -> str:
             else CommandEnum.add_openai_token.tg_command)
 
 
-async def _handle_openai_contributor_message(message: types.Message, user_token: str):
+async def _handle_openai_contributor_message(
+        message: types.Message, user_token: str, use_completion_cache: bool = True,
+):
     try:
-        return await send_openai_response(message, OpenAIClient(user_token))
+        return await send_openai_response(message, create_openai_client(user_token), use_completion_cache)
+    except (CircuitBreakerOpenError, AdmissionRejectedError):
+        raise
     except OpenAIInvalidRequestError as e:
         logger.warning('[send_openai_response_for_contributor] Could not compose response, got %s...', e)
         # Delete token since it is invalid.
@@ -123,9 +171,13 @@ async def _handle_openai_contributor_message(message: types.Message, user_token:
         )
     
 
-async def _handle_perplexity_contributor_message(message: types.Message, user_token: str):
+async def _handle_perplexity_contributor_message(
+        message: types.Message, user_token: str, use_completion_cache: bool = True,
+):
     try:
-        return await send_perplexity_response(message, PerplexityClient(token=user_token, openai_model=settings.PERPLEXITY_OPENAI_MODEL))
+        return await send_perplexity_response(message, create_perplexity_client(user_token), use_completion_cache)
+    except (CircuitBreakerOpenError, AdmissionRejectedError):
+        raise
     except Exception as e:
         logger.warning('[send_perplexity_response_for_contributor] Could not compose response, got %s...', e)
         return await message.reply(
@@ -1,22 +1,30 @@
 import logging
+from typing import AsyncIterator, Hashable
 
 from aiogram import types
 
 from bot.misc import openai_client_priority, bot_chat_messages_cache
 from bot.handlers.completion_responses.utils import get_raw_dialog_messages
 from utils.redis.redis_storage import BotChatMessagesCache
-from bot.utils import remember_chat_handler_decorator, cache_message_decorator, safety_replay_with_long_text
-from clients.openai.client import OpenAIMaxTokenExceededError, OpenAIClient, OpenAIInvalidRequestError
+from bot.utils import (
+    remember_chat_handler_decorator, cache_message_decorator, safety_replay_with_long_text,
+    stream_replay_with_long_text,
+)
+from clients.openai.client import OpenAIClient, OpenAIInvalidRequestError
 from clients.openai.scheme import ChatMessage
 from config.settings import settings
+from utils.generators import aclosing
+from utils.tokenizer import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
-# TODO: how openai compute token number?
-_OPENAI_COMPLETION_LENGTH_ROBUST = int(
-    openai_client_priority.COMPLETION_MAX_LENGTH - openai_client_priority.COMPLETION_MAX_LENGTH // 1e3
-)
-
+_completions_tokenizer = get_tokenizer(OpenAIClient.COMPLETIONS_MODEL)
+_chat_tokenizer = get_tokenizer(OpenAIClient.CHAT_COMPLETIONS_MODEL)
+# Completion tokens to leave at least, otherwise the prompt (or the oldest dialog context) is trimmed.
+_MIN_COMPLETION_TOKENS = 512
+# Not to budget exactly to the context length, since counts could differ from the ones of OpenAI a bit
+# (e.g. chat message overhead of newer model versions).
+_SAFETY_MARGIN_TOKENS = 64
 
 
 def _convert_to_chat_messages(raw_messages: list[BotChatMessagesCache.MessageData]) -> list[ChatMessage]:
@@ -30,6 +38,7 @@ def _convert_to_chat_messages(raw_messages: list[BotChatMessagesCache.MessageDat
         for msg in raw_messages
     ]
 
+
 async def _get_dialog_messages_context(message_obj: types.Message, depth: int = 2) -> list[ChatMessage]:
     """According to https://docs.aiogram.dev it could not handle depth more than 1.
     thus, message should be cached for depth more than 1.
@@ -38,28 +47,64 @@ async def _get_dialog_messages_context(message_obj: types.Message, depth: int =
     return _convert_to_chat_messages(raw_messages)
 
 
-async def _compose_openapi_completion(message: str, openai_client: OpenAIClient):
-    message = f'{message}'
-
-    # OpenAI could not return more than COMPLETION_MAX_LENGTH.
+def _reduce_completion_message(message: str) -> tuple[str, int]:
+    """:return: message (reduced if too long) and max completion tokens for it."""
+    # OpenAI could not return more than COMPLETION_MAX_LENGTH (prompt + completion tokens).
     # Otherwise, you will receive
     # 'error': {'message': "This model's maximum context length is 4097 tokens,
     # however you requested 4121 tokens (121 in your prompt; 4000 for the completion).
     # Please reduce your prompt; or completion length.",
     # 'type': 'invalid_request_error', 'param': None, 'code': None}
-    message_length = len(message)
-    completion_length = _OPENAI_COMPLETION_LENGTH_ROBUST - message_length
-    if completion_length <= 0:
-        # Hard text reduce.
-        message = message[:message_length // 3]
-
+    message = f'{message}'
+    max_prompt_tokens = OpenAIClient.COMPLETION_MAX_LENGTH - _MIN_COMPLETION_TOKENS - _SAFETY_MARGIN_TOKENS
+    prompt_tokens = _completions_tokenizer.count(message)
+    if prompt_tokens > max_prompt_tokens:
+        logger.info('[_reduce_completion_message] Truncate prompt of %s tokens to %s...', prompt_tokens, max_prompt_tokens)
+        message = _completions_tokenizer.truncate(message, max_prompt_tokens)
+        # Decoded text is counted again, since tokens at the cut could be merged differently.
+        prompt_tokens = _completions_tokenizer.count(message)
+    return message, OpenAIClient.COMPLETION_MAX_LENGTH - prompt_tokens - _SAFETY_MARGIN_TOKENS
+
+
+def _reduce_chat_messages(
+        context_messages: list[ChatMessage], message: str, chat_bot_goal: str,
+) -> list[ChatMessage]:
+    """The oldest context messages are dropped (and the new message is truncated as the last resort)
+    to fit the chat model context length (leaving tokens for the completion, which is not capped).
+    :return: context messages + new message.
+    """
+    context_messages_tokens = [_chat_tokenizer.count_chat_message(msg.role, msg.content) for msg in context_messages]
+    prompt_tokens = (
+        _chat_tokenizer.count_chat_message('system', chat_bot_goal)
+        + sum(context_messages_tokens)
+        + _chat_tokenizer.count_chat_message('user', message)
+        + _chat_tokenizer.TOKENS_PER_CHAT_REPLY
+    )
+    max_prompt_tokens = OpenAIClient.CHAT_COMPLETIONS_MAX_LENGTH - _MIN_COMPLETION_TOKENS - _SAFETY_MARGIN_TOKENS
+    dropped = 0
+    while prompt_tokens > max_prompt_tokens and dropped < len(context_messages):
+        prompt_tokens -= context_messages_tokens[dropped]
+        dropped += 1
+    if dropped:
+        logger.info('[_reduce_chat_messages] Drop %s oldest context messages to fit the budget...', dropped)
+
+    if prompt_tokens > max_prompt_tokens:
+        message_tokens = _chat_tokenizer.count(message)
+        logger.info('[_reduce_chat_messages] Truncate message of %s tokens...', message_tokens)
+        message = _chat_tokenizer.truncate(message, message_tokens - (prompt_tokens - max_prompt_tokens))
+        prompt_tokens += _chat_tokenizer.count(message) - message_tokens
+
+    return context_messages[dropped:] + [ChatMessage(role='user', content=message)]
+
+
+async def _compose_openapi_completion(
+        message: str, openai_client: OpenAIClient, fairness_key: Hashable = None, use_cache: bool = True,
+):
+    message, completion_length = _reduce_completion_message(message)
     try:
-        openai_completion = await openai_client.get_completions(message, completion_length)
-    except OpenAIMaxTokenExceededError:
-        # According to https://help.openai.com/en/articles/4936856-what-are-tokens-and-how-to-count-them#
-        # :~:text=Token%20Limits,shared%20between%20prompt%20and%20completion.
-        logger.info('Lets try with 2/3 of completion_length = %s', completion_length)
-        openai_completion = await openai_client.get_completions(message, int(completion_length * 2 / 3))
+        openai_completion = await openai_client.get_completions(
+            message, completion_length, fairness_key=fairness_key, use_cache=use_cache,
+        )
     except OpenAIInvalidRequestError as e:
         logger.info(f'Invalid request were made, got {e}...')
         raise e
@@ -67,28 +112,69 @@ async def _compose_openapi_completion(message: str, openai_client: OpenAIClient)
     return openai_completion
 
 
-async def send_openai_response(message: types.Message, openai_client: OpenAIClient):
+async def _stream_openapi_completion(
+        message: str, openai_client: OpenAIClient, fairness_key: Hashable = None, use_cache: bool = True,
+) -> AsyncIterator[str]:
+    """Same as `_compose_openapi_completion`, but streamed (errors are raised before the first delta)."""
+    message, completion_length = _reduce_completion_message(message)
+    async with aclosing(openai_client.stream_completions(
+            message, completion_length, fairness_key=fairness_key, use_cache=use_cache,
+    )) as deltas:
+        async for delta in deltas:
+            yield delta
+
+
+async def send_openai_response(
+        message: types.Message, openai_client: OpenAIClient, use_completion_cache: bool = True,
+):
     """Rather use completion model or dialog.
         It is based on context existence.
     """
     context_messages = await _get_dialog_messages_context(message, settings.OPENAI_DIALOG_CONTEXT_MAX_DEPTH)
+    if settings.TG_BOT_STREAM_COMPLETIONS:
+        return await _send_openai_stream_response(message, openai_client, context_messages, use_completion_cache)
+
     # If context exists send it as a dialog.
     if not context_messages or len(context_messages) == 0:
         logger.info('[send_openai_response] Request completion for message %s...', message)
-        response = await _compose_openapi_completion(message.text, openai_client)
+        response = await _compose_openapi_completion(
+            message.text, openai_client, fairness_key=message.chat.id, use_cache=use_completion_cache,
+        )
     else:
         logger.info(
             '[send_openai_response] Request chatGPT for context: %s and message %s...', context_messages, message)
-        context_messages.append(
-            ChatMessage(
-                role='user',
-                content=message.text,
-            )
+        messages = _reduce_chat_messages(context_messages, message.text, settings.OPENAI_CHAT_BOT_GOAL)
+        response = await openai_client.get_chat_completions(
+            messages, settings.OPENAI_CHAT_BOT_GOAL, fairness_key=message.chat.id,
+            use_cache=use_completion_cache,
         )
-        response = await openai_client.get_chat_completions(context_messages, settings.OPENAI_CHAT_BOT_GOAL)
 
     # Sometimes openai do not know what to say.
     if not response:
         response = '.'
     # Response could be bigger than expected - use safety method.
     return await safety_replay_with_long_text(message, response, cache_previous_batches=True)
+
+
+async def _send_openai_stream_response(
+        message: types.Message, openai_client: OpenAIClient, context_messages: list[ChatMessage],
+        use_completion_cache: bool = True,
+):
+    if not context_messages:
+        logger.info('[send_openai_response] Stream completion for message %s...', message)
+        deltas = _stream_openapi_completion(
+            message.text, openai_client, fairness_key=message.chat.id, use_cache=use_completion_cache,
+        )
+    else:
+        logger.info(
+            '[send_openai_response] Stream chatGPT for context: %s and message %s...', context_messages, message)
+        messages = _reduce_chat_messages(context_messages, message.text, settings.OPENAI_CHAT_BOT_GOAL)
+        deltas = openai_client.stream_chat_completions(
+            messages, settings.OPENAI_CHAT_BOT_GOAL, fairness_key=message.chat.id,
+            use_cache=use_completion_cache,
+        )
+
+    # Sometimes openai do not know what to say.
+    return await stream_replay_with_long_text(
+        message, deltas, format_final=lambda text: text or '.', cache_previous_batches=True,
+    )
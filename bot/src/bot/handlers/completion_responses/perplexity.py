@@ -5,10 +5,11 @@ from aiogram import types
 
 from bot.handlers.completion_responses.utils import get_raw_dialog_messages
 from bot.misc import bot_chat_messages_cache, perplexity_client_priority
-from bot.utils import safety_replay_with_long_text
+from bot.utils import safety_replay_with_long_text, stream_replay_with_long_text
 from clients.perplexity.client import PerplexityClient
 from clients.perplexity.scheme import PerplexityChatMessageIn, PerplexityRole
 from config.settings import settings
+from utils.generators import aclosing
 from utils.redis.redis_storage import BotChatMessagesCache
 
 logger = logging.getLogger(__name__)
@@ -58,7 +59,9 @@ def _convert_bold_to_html(text: str) -> str:
     return re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
 
 
-async def send_perplexity_response(message: types.Message, perplexity_client: PerplexityClient):
+async def send_perplexity_response(
+        message: types.Message, perplexity_client: PerplexityClient, use_completion_cache: bool = True,
+):
     """Prepare a special perplexity styled response with citations for the provided context.
     It is based on context existence.
     """
@@ -71,7 +74,20 @@ async def send_perplexity_response(message: types.Message, perplexity_client: Pe
             content=message.text,
         )
     )
-    response_text, citations = await perplexity_client.get_chat_completions(context_messages, settings.PERPLEXITY_CHAT_BOT_GOAL)
+    if settings.TG_BOT_STREAM_COMPLETIONS:
+        return await _send_perplexity_stream_response(
+            message, perplexity_client, context_messages, use_completion_cache,
+        )
+
+    response_text, citations = await perplexity_client.get_chat_completions(
+        context_messages, settings.PERPLEXITY_CHAT_BOT_GOAL, fairness_key=message.chat.id,
+        use_cache=use_completion_cache,
+    )
+    response = _compose_perplexity_response(message, response_text, citations)
+    return await safety_replay_with_long_text(message, response, parse_mode='HTML', cache_previous_batches=True)
+
+
+def _compose_perplexity_response(message: types.Message, response_text: str, citations: list[str]) -> str:
     citations = '\n'.join([f'{i+1}. {citation}' for i, citation in enumerate(citations)]) if citations else ''
 
     response = f'{response_text}\n\nUsed sources:\n{citations}'
@@ -80,5 +96,30 @@ async def send_perplexity_response(message: types.Message, perplexity_client: Pe
         response = '.'
 
     response = _format_to_perplexity_response(message, response)
-    response = _convert_bold_to_html(response)
-    return await safety_replay_with_long_text(message, response, parse_mode='HTML', cache_previous_batches=True)
+    return _convert_bold_to_html(response)
+
+
+async def _send_perplexity_stream_response(
+        message: types.Message, perplexity_client: PerplexityClient, context_messages: list[PerplexityChatMessageIn],
+        use_completion_cache: bool = True,
+):
+    """Streamed text is sent as is, perplexity style and citations are applied on the final edit."""
+    citations = []
+
+    async def _iter_deltas():
+        async with aclosing(perplexity_client.stream_chat_completions(
+                context_messages, settings.PERPLEXITY_CHAT_BOT_GOAL, fairness_key=message.chat.id,
+                use_cache=use_completion_cache,
+        )) as chunks:
+            async for delta, chunk_citations in chunks:
+                if chunk_citations:
+                    citations[:] = chunk_citations
+                yield delta
+
+    return await stream_replay_with_long_text(
+        message,
+        _iter_deltas(),
+        format_final=lambda text: _compose_perplexity_response(message, text, citations),
+        parse_mode='HTML',
+        cache_previous_batches=True,
+    )
@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 async def get_raw_dialog_messages(
         bot_chat_messages_cache: BotChatMessagesCache, message_obj: types.Message, depth: int = 2) -> list[BotChatMessagesCache.MessageData]:
     """Fetches raw dialog messages from cache.
-    Returns list of cached message objects.
+    Returns list of cached message objects (from the oldest to the replied one).
     """
     logger.info('[get_raw_dialog_messages] Try to fetch previous messages...')
     chat_id = message_obj.chat.id
@@ -17,14 +17,12 @@ async def get_raw_dialog_messages(
 
     logger.info(f'replay_to_id: {replay_to_id}')
 
-    messages = []
-    while replay_to_id and depth > 0:
-        previous_message = await bot_chat_messages_cache.get_message(chat_id, replay_to_id)
-        logger.info(f'[get_raw_dialog_messages] Found previous_message: {previous_message}')
-        if previous_message:
-            messages.append(previous_message)
-            replay_to_id = previous_message.replay_to
-        depth -= 1
+    if not replay_to_id or depth <= 0:
+        return []
+
+    # The whole reply chain is fetched in 1 round-trip.
+    messages = await bot_chat_messages_cache.get_dialog_chain(chat_id, replay_to_id, depth)
+    logger.info(f'[get_raw_dialog_messages] Found previous messages: {messages}')
 
     # Reorder messages to be from last to first.
-    return messages[::-1]
\ No newline at end of file
+    return messages[::-1]
@@ -5,10 +5,15 @@ from aiogram import F
 
 from bot.misc import dp
 from bot.utils import remember_chat_handler_decorator, cache_message_decorator
+from utils.trigger_engine import TriggerEngine, keywords_rule
 
 logger = logging.getLogger(__name__)
 
-_filter = F.text.regexp(r'(phd|doctor|dog|аспирант|собака)')
+# Case sensitive and at the start of the text only (as it was with `F.text.regexp`).
+_echo_trigger_engine = TriggerEngine([
+    keywords_rule(('phd', 'doctor', 'dog', 'аспирант', 'собака'), ignore_case=False, at_start=True),
+])
+_filter = F.text.func(_echo_trigger_engine.match)
 
 
 @dp.message(_filter)
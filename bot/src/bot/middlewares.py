@@ -0,0 +1,134 @@
+"""Per update state shared by filters and handlers (injected as `update_context` argument)."""
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, types
+
+from bot.consts import AIDiscussionMode
+from bot.misc import dp, bot_ai_contributor_chat_storage, bot_chat_discussion_mode_storage
+from utils.redis.redis_storage import BotAIContributorChatStorage
+from utils.ttl_cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateContext:
+    """Lazily loads contributor tokens and discussion modes (and completion cache opt-out, trigger keywords)
+    of the message chat & sender once per update.
+    Values missed in the storage caches are fetched in 1 MGET, the rest is memoized for the update.
+    """
+
+    def __init__(self, chat_id: int, user_id: Optional[int]):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self._is_loaded = False
+        self._contributor_tokens: Optional[BotAIContributorChatStorage.ContributorTokensOut] = None
+        self._mode_values: dict[str, Optional[str]] = {}
+
+    @classmethod
+    def from_message(cls, message: types.Message) -> 'UpdateContext':
+        return cls(message.chat.id, message.from_user.id if message.from_user else None)
+
+    async def _load(self):
+        if self._is_loaded:
+            return
+
+        keys_to_fetch = []
+        contributor_keys = []
+        if self.user_id is None:
+            self._contributor_tokens = BotAIContributorChatStorage.ContributorTokensOut(None, None)
+        else:
+            tokens = bot_ai_contributor_chat_storage.get_cached(self.user_id, self.chat_id)
+            if tokens is LRUTTLCache.MISSING:
+                contributor_keys = bot_ai_contributor_chat_storage.get_keys(self.user_id, self.chat_id)
+                keys_to_fetch += contributor_keys
+            else:
+                self._contributor_tokens = tokens
+
+        mode_keys_to_fetch = []
+        mode_keys = [
+            *bot_chat_discussion_mode_storage.get_keys(self.chat_id, self.user_id),
+            bot_chat_discussion_mode_storage.get_key_is_completion_cache_disabled(self.chat_id),
+            bot_chat_discussion_mode_storage.get_key_trigger_keywords(self.chat_id),
+        ]
+        for key in mode_keys:
+            value = bot_chat_discussion_mode_storage.get_cached_raw(key)
+            if value is LRUTTLCache.MISSING:
+                mode_keys_to_fetch.append(key)
+            else:
+                self._mode_values[key] = value
+        keys_to_fetch += mode_keys_to_fetch
+
+        if keys_to_fetch:
+            logger.debug('[UpdateContext] Fetch %s...', keys_to_fetch)
+            generation = bot_chat_discussion_mode_storage.get_generation()
+            contributor_generation = bot_ai_contributor_chat_storage.get_generation()
+            values = await bot_chat_discussion_mode_storage.redis_engine.mget(keys_to_fetch)
+            if contributor_keys:
+                self._contributor_tokens = await bot_ai_contributor_chat_storage.cache_from_raw(
+                    self.user_id, self.chat_id, *values[:len(contributor_keys)], contributor_generation,
+                )
+            for key, value in zip(mode_keys_to_fetch, values[len(contributor_keys):]):
+                bot_chat_discussion_mode_storage.cache_raw(key, value, generation)
+                self._mode_values[key] = value
+        self._is_loaded = True
+
+    def _get_mode_value(self, key: str) -> Optional[str]:
+        return self._mode_values.get(key)
+
+    async def get_contributor_tokens(self) -> BotAIContributorChatStorage.ContributorTokensOut:
+        await self._load()
+        return self._contributor_tokens
+
+    async def get_discussion_mode(self) -> Optional[AIDiscussionMode]:
+        await self._load()
+        discussion_mode_key, _ = bot_chat_discussion_mode_storage.get_keys(self.chat_id)
+        return bot_chat_discussion_mode_storage.to_discussion_mode(self._get_mode_value(discussion_mode_key))
+
+    async def get_is_mention_only_mode(self) -> bool:
+        await self._load()
+        _, is_mention_only_mode_key = bot_chat_discussion_mode_storage.get_keys(self.chat_id)
+        return bot_chat_discussion_mode_storage.to_is_mention_only_mode(self._get_mode_value(is_mention_only_mode_key))
+
+    async def get_discussion_mode_by_contributor(self) -> Optional[AIDiscussionMode]:
+        await self._load()
+        if self.user_id is None:
+            return None
+        _, _, discussion_mode_key, _ = bot_chat_discussion_mode_storage.get_keys(self.chat_id, self.user_id)
+        return bot_chat_discussion_mode_storage.to_discussion_mode(self._get_mode_value(discussion_mode_key))
+
+    async def get_is_mention_only_mode_by_contributor(self) -> bool:
+        await self._load()
+        if self.user_id is None:
+            return False
+        _, _, _, is_mention_only_mode_key = bot_chat_discussion_mode_storage.get_keys(self.chat_id, self.user_id)
+        return bot_chat_discussion_mode_storage.to_is_mention_only_mode(self._get_mode_value(is_mention_only_mode_key))
+
+    async def get_is_completion_cache_disabled(self) -> bool:
+        await self._load()
+        key = bot_chat_discussion_mode_storage.get_key_is_completion_cache_disabled(self.chat_id)
+        return bot_chat_discussion_mode_storage.to_is_completion_cache_disabled(self._get_mode_value(key))
+
+    async def get_trigger_keywords(self) -> tuple[str, ...]:
+        await self._load()
+        key = bot_chat_discussion_mode_storage.get_key_trigger_keywords(self.chat_id)
+        return bot_chat_discussion_mode_storage.to_trigger_keywords(self._get_mode_value(key))
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """Outer middleware, thus the context is available for filters as well as for handlers."""
+
+    async def __call__(
+            self,
+            handler: Callable[[types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: types.TelegramObject,
+            data: dict[str, Any],
+    ) -> Any:
+        if isinstance(event, types.Message):
+            data['update_context'] = UpdateContext.from_message(event)
+        return await handler(event, data)
+
+
+update_context_middleware = UpdateContextMiddleware()
+dp.message.outer_middleware(update_context_middleware)
+dp.channel_post.outer_middleware(update_context_middleware)
@@ -10,13 +10,25 @@ from fernet import Fernet
 
 from clients.perplexity.client import PerplexityClient
 from utils.crypto import Crypto
+from utils.broadcaster import Broadcaster
+from utils.http_session_pool import HttpSessionPool
+from utils.retry_policy import RetryPolicy
+from utils.circuit_breaker import CircuitBreakerRegistry
+from utils.admission_controller import AdmissionController
+from utils.singleflight import SingleFlight
+from utils.metrics import Metrics
 from clients.openai.client import OpenAIClient
 from config.settings import settings
 
 # In code below it uses asyncio lock inside when creates connection pool
+from utils.redis.completion_cache import CompletionCache
 from utils.redis.redis_storage import BotChatsStorage, BotChatMessagesCache, BotAIContributorChatStorage
+from utils.redis.update_stream import UpdateStream
 from utils.token_api_request_manager import TokenApiRequestManager
 
+# Disabled metrics are no-ops (and instrumentation below changes nothing).
+metrics = Metrics(enabled=settings.METRICS_ENABLED)
+
 fernet_engine = Fernet(settings.FERNET_KEY)
 crypto = Crypto(fernet_engine)
 
@@ -27,23 +39,137 @@ loop = asyncio.get_event_loop()
 bot = Bot(token=settings.TG_BOT_TOKEN, parse_mode='HTML')
 dp = Dispatcher(storage=storage)
 
+# Queue of updates between the ingress process and workers (TG_BOT_UPDATE_QUEUE_ENABLED).
+update_stream = UpdateStream(
+    bot.id, redis, partitions=settings.TG_BOT_UPDATE_QUEUE_PARTITIONS, max_len=settings.TG_BOT_UPDATE_QUEUE_MAX_LEN,
+)
+
 # To store all chats ever used by the bot.
 bot_chats_storage = BotChatsStorage(bot.id, redis)
 # To store messages and ACTIVE chats.
 bot_chat_messages_cache = BotChatMessagesCache(bot.id, redis, settings.TG_BOT_CACHE_TTL)
-bot_ai_contributor_chat_storage = BotAIContributorChatStorage(bot.id, redis, crypto)
+bot_ai_contributor_chat_storage = BotAIContributorChatStorage(
+    bot.id,
+    redis,
+    crypto,
+    cache_ttl=settings.TG_BOT_CONTRIBUTOR_TOKENS_CACHE_TTL,
+    cache_maxsize=settings.TG_BOT_CONTRIBUTOR_TOKENS_CACHE_MAX_SIZE,
+)
+
+bot_chat_discussion_mode_storage = BotChatAIDiscussionModeStorage(
+    bot.id, redis, cache_ttl=settings.TG_BOT_MODE_CACHE_TTL, cache_maxsize=settings.TG_BOT_MODE_CACHE_MAX_SIZE,
+)
+for _storage in (
+        bot_chats_storage, bot_chat_messages_cache, bot_ai_contributor_chat_storage, bot_chat_discussion_mode_storage,
+):
+    metrics.instrument_storage(_storage)
 
-bot_chat_discussion_mode_storage = BotChatAIDiscussionModeStorage(bot.id, redis)
+# To send to many chats within Telegram limits (it prunes dead chats from bot_chats_storage).
+broadcaster = Broadcaster(
+    bot,
+    redis,
+    bot_chats_storage,
+    rate_per_second=settings.TG_BROADCAST_RATE_PER_SECOND,
+    per_chat_rate_per_second=settings.TG_BROADCAST_PER_CHAT_RATE_PER_SECOND,
+    concurrency=settings.TG_BROADCAST_CONCURRENCY,
+)
+
+# Shared by all AI clients (priority and contributor ones) to reuse connections. Closed on shutdown.
+http_session_pool = HttpSessionPool(
+    limit=settings.HTTP_POOL_LIMIT,
+    limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+    ttl_dns_cache=settings.HTTP_POOL_DNS_CACHE_TTL,
+    keepalive_timeout=settings.HTTP_POOL_KEEPALIVE_TIMEOUT,
+)
+
+ai_retry_policy = RetryPolicy(
+    max_attempts=settings.AI_RETRY_MAX_ATTEMPTS,
+    deadline=settings.AI_RETRY_DEADLINE,
+    base_delay=settings.AI_RETRY_BASE_DELAY,
+    max_delay=settings.AI_RETRY_MAX_DELAY,
+)
+
+# Shared by all AI clients, thus an outage of an endpoint is detected by any of them.
+circuit_breaker_registry = CircuitBreakerRegistry(
+    failure_threshold=settings.AI_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    recovery_timeout=settings.AI_CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+)
+
+# Per provider, shared by its priority and contributor clients.
+openai_admission_controller = AdmissionController(
+    'OpenAI',
+    max_concurrency=settings.AI_MAX_CONCURRENCY_PER_PROVIDER,
+    max_queue_size=settings.AI_MAX_QUEUE_SIZE_PER_PROVIDER,
+    max_wait=settings.AI_MAX_QUEUE_WAIT,
+)
+perplexity_admission_controller = AdmissionController(
+    'Perplexity',
+    max_concurrency=settings.AI_MAX_CONCURRENCY_PER_PROVIDER,
+    max_queue_size=settings.AI_MAX_QUEUE_SIZE_PER_PROVIDER,
+    max_wait=settings.AI_MAX_QUEUE_WAIT,
+)
+metrics.observe_admission_controller(openai_admission_controller)
+metrics.observe_admission_controller(perplexity_admission_controller)
+
+# Shared by all AI clients, the key includes the token, thus contributors do not share calls with others.
+ai_singleflight = SingleFlight()
+
+# Shared by all AI clients, the key does not include the token, thus contributors reuse completions of others.
+completion_cache = CompletionCache(
+    bot.id,
+    redis,
+    ttl=settings.AI_COMPLETION_CACHE_TTL,
+    max_size=settings.AI_COMPLETION_CACHE_MAX_SIZE,
+    memory_max_size=settings.AI_COMPLETION_CACHE_MEMORY_MAX_SIZE,
+) if settings.AI_COMPLETION_CACHE_ENABLED else None
+if completion_cache is not None:
+    metrics.instrument_storage(completion_cache)
 
 openai_token_api_request_manager = TokenApiRequestManager(
-    settings.OPENAI_TOKEN, redis, crypto, 'OpenAI',
+    settings.OPENAI_TOKEN, redis, crypto, 'OpenAI', http_session_pool=http_session_pool,
+    cooldown_on_429=settings.AI_TOKEN_COOLDOWN_ON_429,
+    health_persist_interval=settings.AI_TOKEN_HEALTH_PERSIST_INTERVAL,
+    metrics=metrics,
+)
+openai_client_priority = OpenAIClient(
+    token_api_request_manager=openai_token_api_request_manager, retry_policy=ai_retry_policy,
+    circuit_breaker_registry=circuit_breaker_registry, admission_controller=openai_admission_controller,
+    singleflight=ai_singleflight, completion_cache=completion_cache,
 )
-openai_client_priority = OpenAIClient(token_api_request_manager=openai_token_api_request_manager)
 
 perplexity_token_api_request_manager = TokenApiRequestManager(
-    settings.PERPLEXITY_TOKEN, redis, crypto, 'Perplexity',
+    settings.PERPLEXITY_TOKEN, redis, crypto, 'Perplexity', http_session_pool=http_session_pool,
+    cooldown_on_429=settings.AI_TOKEN_COOLDOWN_ON_429,
+    health_persist_interval=settings.AI_TOKEN_HEALTH_PERSIST_INTERVAL,
+    metrics=metrics,
 )
 perplexity_client_priority = PerplexityClient(
     token_api_request_manager=perplexity_token_api_request_manager,
     openai_model=settings.PERPLEXITY_OPENAI_MODEL,
+    retry_policy=ai_retry_policy,
+    circuit_breaker_registry=circuit_breaker_registry,
+    admission_controller=perplexity_admission_controller,
+    singleflight=ai_singleflight,
+    completion_cache=completion_cache,
+    completion_cache_max_age=settings.AI_COMPLETION_CACHE_PERPLEXITY_FRESHNESS,
 )
+
+
+def create_openai_client(token: str) -> OpenAIClient:
+    """To compose client for a contributor token with shared resources."""
+    return OpenAIClient(
+        token, http_session_pool=http_session_pool, retry_policy=ai_retry_policy,
+        circuit_breaker_registry=circuit_breaker_registry, admission_controller=openai_admission_controller,
+        singleflight=ai_singleflight, completion_cache=completion_cache,
+    )
+
+
+def create_perplexity_client(token: str) -> PerplexityClient:
+    """To compose client for a contributor token with shared resources."""
+    return PerplexityClient(
+        token=token, openai_model=settings.PERPLEXITY_OPENAI_MODEL, http_session_pool=http_session_pool,
+        retry_policy=ai_retry_policy, circuit_breaker_registry=circuit_breaker_registry,
+        admission_controller=perplexity_admission_controller, singleflight=ai_singleflight,
+        completion_cache=completion_cache,
+        completion_cache_max_age=settings.AI_COMPLETION_CACHE_PERPLEXITY_FRESHNESS,
+    )
@@ -0,0 +1,47 @@
+"""Queue mode: the ingress process polls Telegram and pushes updates to UpdateStream, worker processes handle them."""
+import logging
+
+from aiogram import Bot
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from redis.exceptions import RedisError
+
+from utils.redis.update_stream import UpdateStream
+
+logger = logging.getLogger(__name__)
+
+_BACKOFF_CONFIG = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+
+async def run_ingress(bot: Bot, update_stream: UpdateStream, allowed_updates: list[str], polling_timeout: int = 30):
+    """Long living loop. The offset is confirmed to Telegram only after updates are pushed to the stream,
+    thus updates are not lost if Redis is not available (they are fetched again).
+    If a partition is over its max length (workers are behind or dead), polling waits (Telegram keeps updates),
+    not handled updates are never trimmed.
+    """
+    offset = None
+    backoff = Backoff(config=_BACKOFF_CONFIG)
+    logger.info('[run_ingress] Poll updates to the update stream...')
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=polling_timeout, allowed_updates=allowed_updates)
+            is_full = False
+            for update in updates:
+                # by_alias: as Telegram sends it (e.g. "from", not "from_user"), to be parsed by workers.
+                length = await update_stream.add(update.model_dump(mode='json', exclude_unset=True, by_alias=True))
+                offset = update.update_id + 1
+                if update_stream.is_full(length):
+                    is_full = True
+                    break
+            if is_full:
+                logger.warning('[run_ingress] Update stream is full (%s updates in a partition), wait...', length)
+                await backoff.asleep()
+                continue
+        except RedisError as e:
+            logger.warning('[run_ingress] Could not push updates: %s. Retry...', e)
+            await backoff.asleep()
+            continue
+        except Exception as e:
+            logger.warning('[run_ingress] Could not get updates: %s. Retry...', e)
+            await backoff.asleep()
+            continue
+        backoff.reset()
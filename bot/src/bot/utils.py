@@ -1,11 +1,16 @@
+import asyncio
 import logging
+import time
+from typing import AsyncGenerator, Callable, Optional
 
 from aiogram import types
 from aiogram.enums import ChatType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 from bot.misc import bot_chats_storage, bot_chat_messages_cache
 from config.settings import settings
-from utils.generators import batch
+from utils.admission_controller import AdmissionRejectedError
+from utils.generators import aclosing, batch
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +35,19 @@ def remember_chat_handler_decorator(func):
     return wrapper
 
 
+def busy_reply_decorator(func):
+    """Reply that the bot is busy instead of the response, if AI provider queue is full."""
+    async def wrapper(message: types.Message, *args, **kwargs):
+        try:
+            return await func(message, *args, **kwargs)
+        except AdmissionRejectedError as e:
+            logger.warning('[busy_reply_decorator] Could not compose response, got %s...', e)
+            return await message.reply(
+                'Too many PhD students are asking the bot at the moment. Please, try again a bit later.'
+            )
+    return wrapper
+
+
 async def cache_messages_text(messages: list[types.Message]) -> None:
     """Cache multiple messages efficiently using Redis pipeline.
     
@@ -128,3 +146,92 @@ async def safety_replay_with_long_text(
         await cache_messages_text(messages_to_cache)
         
     return last_message
+
+
+class _StreamReplyChain:
+    """Chain of replies (each part replies to the previous one) kept in sync with a growing text."""
+
+    def __init__(self, message_reply_to: types.Message):
+        self.message_reply_to = message_reply_to
+        self.messages: list[types.Message] = []
+        self.texts: list[str] = []
+
+    async def sync(self, text: str, parse_mode: Optional[str] = None, force_edit: bool = False):
+        """Sends new parts and edits changed ones (or all if force_edit, e.g. to apply parse_mode)."""
+        parts = list(batch(text, settings.TG_BOT_MAX_TEXT_SYMBOLS - 1)) or ['.']
+        for idx, part in enumerate(parts):
+            if idx >= len(self.messages):
+                reply_to = self.messages[-1] if self.messages else self.message_reply_to
+                self.messages.append(await reply_to.reply(part, parse_mode=parse_mode))
+                self.texts.append(part)
+            elif force_edit or self.texts[idx] != part:
+                try:
+                    edited = await self.messages[idx].edit_text(part, parse_mode=parse_mode)
+                except TelegramBadRequest as e:
+                    if 'message is not modified' not in str(e):
+                        raise
+                    edited = None
+                if isinstance(edited, types.Message):
+                    self.messages[idx] = edited
+                self.texts[idx] = part
+
+        # Final text could be shorter than streamed one (e.g. after formatting).
+        for message in self.messages[len(parts):]:
+            await message.delete()
+        del self.messages[len(parts):]
+        del self.texts[len(parts):]
+
+
+async def stream_replay_with_long_text(
+        message_reply_to: types.Message,
+        deltas: AsyncGenerator[str, None],
+        format_final: Optional[Callable[[str], str]] = None,
+        cache_previous_batches=False,
+        parse_mode: str = None,
+        edit_interval: Optional[float] = None,
+) -> types.Message:
+    """Send the reply as soon as the first deltas of the text arrive and edit it while the text grows.
+    Edits are throttled (Telegram limits edits as well as messages), when the text exceeds TG_BOT_MAX_TEXT_SYMBOLS
+    the next part is sent as a reply to the previous one, like in `safety_replay_with_long_text`.
+
+    Args:
+        message_reply_to: Original message to reply to
+        deltas: Parts of the text as they are generated (e.g. streamed completion), closed when the reply fails
+        format_final: Optional formatting of the whole text, applied on the final edit only
+        cache_previous_batches: Whether to cache the sent messages
+        parse_mode: Optional parse mode for the final message formatting (intermediate edits are plain)
+        edit_interval: Min seconds between edits, TG_BOT_STREAM_EDIT_INTERVAL by default
+
+    Returns:
+        The last sent message in the chain (already cached)
+    """
+    edit_interval = settings.TG_BOT_STREAM_EDIT_INTERVAL if edit_interval is None else edit_interval
+    chain = _StreamReplyChain(message_reply_to)
+    text = ''
+    next_edit_at = 0.0
+
+    # Closed right away if sending fails, thus the stream (and the admission slot of the client) is released.
+    async with aclosing(deltas):
+        async for delta in deltas:
+            text += delta
+            if not text.strip() or time.monotonic() < next_edit_at:
+                continue
+            try:
+                await chain.sync(text)
+            except TelegramRetryAfter as e:
+                logger.info('[stream_replay_with_long_text] Edits are limited, wait %s seconds...', e.retry_after)
+                next_edit_at = time.monotonic() + e.retry_after
+                continue
+            next_edit_at = time.monotonic() + edit_interval
+
+    final_text = format_final(text) if format_final else text
+    try:
+        await chain.sync(final_text, parse_mode=parse_mode, force_edit=parse_mode is not None)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        await chain.sync(final_text, parse_mode=parse_mode, force_edit=parse_mode is not None)
+
+    if cache_previous_batches and chain.messages:
+        await cache_messages_text(chain.messages)
+
+    return chain.messages[-1]
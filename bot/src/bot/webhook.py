@@ -0,0 +1,52 @@
+"""Webhook mode: Telegram pushes updates to the aiohttp app (could be run in several processes behind 1 port)."""
+import hashlib
+import logging
+import os
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+def get_secret_token(bot_token: str) -> str:
+    """Secret derived from the bot token, thus it is the same on every start and host (e.g. behind a load balancer)
+    and could be computed by whoever sets the webhook outside.
+    """
+    return hashlib.sha256(f'{bot_token}:webhook'.encode()).hexdigest()
+
+
+async def _handle_healthz(request: web.Request) -> web.Response:
+    return web.json_response({
+        'status': 'ok',
+        'pid': os.getpid(),
+        'uptime': round(time.monotonic() - request.app['started_at'], 3),
+    })
+
+
+def create_webhook_app(
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str,
+        secret_token: str,
+        health_path: str = '/healthz',
+) -> web.Application:
+    """Updates are validated by the secret token (X-Telegram-Bot-Api-Secret-Token header), answered immediately
+    and handled in background tasks. Dispatcher startup/shutdown handlers are run with the app.
+    """
+    app = web.Application()
+    app['started_at'] = time.monotonic()
+    app.router.add_get(health_path, _handle_healthz)
+    SimpleRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, url: str, secret_token: str, allowed_updates: list[str]):
+    logger.info('[set_webhook] Set webhook to %s...', url)
+    try:
+        await bot.set_webhook(url, secret_token=secret_token, allowed_updates=allowed_updates)
+    finally:
+        await bot.session.close()
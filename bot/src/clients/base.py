@@ -0,0 +1,184 @@
+import logging
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Any, AsyncIterator, Hashable, Optional
+
+from utils.admission_controller import AdmissionController
+from utils.circuit_breaker import CircuitBreakerRegistry
+from utils.generators import aclosing
+from utils.http_session_pool import HttpSessionPool
+from utils.redis.completion_cache import CompletionCache
+from utils.retry_policy import RetryPolicy
+from utils.singleflight import SingleFlight, make_request_key
+from utils.sse import iter_sse_data
+from utils.token_health import get_token_fingerprint
+from utils.token_api_request_manager import TokenApiManagerABC, TokenApiRequestPureManager, TokenRequestResponse
+
+logger = logging.getLogger(__name__)
+
+
+class AIClientABC:
+    """Requests to an AI provider (OpenAI like API) through the circuit breaker, admission controller, singleflight
+    and completion cache, if they are provided. Clients of providers compose request data and parse responses.
+    """
+    DEFAULT_NO_COMPLETION_CHOICE_RESPONSE = 'A?'
+    DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES = {401}
+    DEFAULT_FORCE_MAIN_TOKEN_STATUSES = {400}
+    # 429 and 5xx are retried with backoff (429 token cools down, thus other stored token is likely used).
+    DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=2)
+    # Responses (after retries) counted as upstream failures by the circuit breaker, as well as exceptions.
+    # Not 429, since it is rather about a token (e.g. of a contributor) than about the upstream.
+    DEFAULT_CIRCUIT_BREAKER_FAILURE_STATUSES = {500, 502, 503, 504}
+    # Raised if a stream request got not streamed response (e.g. an error).
+    STREAM_ERROR = Exception
+
+    def __init__(
+        self,
+        token: Optional[str],
+        token_api_request_manager: Optional[TokenApiManagerABC],
+        endpoint: str,
+        http_session_pool: Optional[HttpSessionPool] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker_registry: Optional[CircuitBreakerRegistry] = None,
+        admission_controller: Optional[AdmissionController] = None,
+        singleflight: Optional[SingleFlight] = None,
+        completion_cache: Optional[CompletionCache] = None,
+        completion_cache_max_age: Optional[float] = None,
+    ):
+        """
+        :param circuit_breaker_registry: to fail fast (CircuitBreakerOpenError) when endpoint method is down,
+         shared by clients of the same provider, if not provided - requests always go.
+        :param admission_controller: to bound concurrent requests to the provider (shared by its clients) and queue
+         the rest fairly by `fairness_key` of requests (e.g. chat id), if not provided - requests are not bounded.
+        :param singleflight: to share 1 upstream call by concurrent identical requests (the same token, method, model,
+         chat bot goal and messages), if not provided - every request goes.
+        :param completion_cache: to reuse completions of the same normalized requests (e.g. FAQ in many chats)
+         unless `use_cache=False` is passed, if not provided - completions are not cached.
+        :param completion_cache_max_age: seconds, cached completions older than that are not used.
+        """
+        if not token and not token_api_request_manager:
+            raise Exception(
+                f'[{self.__class__.__name__}] Rather token or token_api_request_manager should be defined.'
+            )
+        if not token_api_request_manager:
+            self.token_api_request_manager = TokenApiRequestPureManager(
+                token, http_session_pool=http_session_pool,
+            )
+        else:
+            self.token_api_request_manager = token_api_request_manager
+
+        self.endpoint = endpoint
+        self.retry_policy = retry_policy or self.DEFAULT_RETRY_POLICY
+        self.circuit_breaker_registry = circuit_breaker_registry
+        self.admission_controller = admission_controller
+        self.singleflight = singleflight
+        self.completion_cache = completion_cache
+        self.completion_cache_max_age = completion_cache_max_age
+
+    async def close(self):
+        """To close own sessions of the manager, if http_session_pool was not provided (see TokenApiManagerABC)."""
+        await self.token_api_request_manager.close()
+
+    @asynccontextmanager
+    async def _admission_slot(self, fairness_key: Hashable = None) -> AsyncIterator[None]:
+        """:raises AdmissionRejectedError: if the provider is busy."""
+        if not self.admission_controller:
+            yield
+            return
+        async with self.admission_controller.slot(fairness_key):
+            yield
+
+    async def _make_manager_request(self, url: str, data: dict, stream: bool = False) -> TokenRequestResponse:
+        """Goes through the circuit breaker of the url, if the registry is provided."""
+        async def _request():
+            return await self.token_api_request_manager.make_request(
+                url=url, data=data, rotate_statuses=self.DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES,
+                force_main_token_statuses=self.DEFAULT_FORCE_MAIN_TOKEN_STATUSES, retry_policy=self.retry_policy,
+                stream=stream,
+            )
+
+        if not self.circuit_breaker_registry:
+            return await _request()
+        return await self.circuit_breaker_registry.get(url).call(
+            _request,
+            is_failure=lambda response: response.status in self.DEFAULT_CIRCUIT_BREAKER_FAILURE_STATUSES,
+        )
+
+    def _get_singleflight_key(self, url: str, data: dict) -> str:
+        token_fingerprint = get_token_fingerprint(self.token_api_request_manager.main_token or '')
+        return make_request_key(self.__class__.__name__, url, token_fingerprint, data)
+
+    async def _get_cached_completion(self, method: Enum, data: dict, use_cache: bool) -> tuple[Optional[str], Any]:
+        """:return: cache key (None if the cache is not used) and cached completion (None on miss)."""
+        if not use_cache or not self.completion_cache:
+            return None, None
+        key = self.completion_cache.get_key(self.__class__.__name__, method.value, data)
+        return key, await self.completion_cache.get(key, max_age=self.completion_cache_max_age)
+
+    @staticmethod
+    def _get_completion_text(completion: Any) -> str:
+        """Text of the completion to be cached (e.g. without citations)."""
+        return completion
+
+    async def _cache_completion(self, key: Optional[str], completion: Any):
+        text = self._get_completion_text(completion)
+        if key is not None and text and text != self.DEFAULT_NO_COMPLETION_CHOICE_RESPONSE:
+            await self.completion_cache.set(key, completion)
+
+    def _check_response(self, status: int, response: Any):
+        """To raise errors of the provider by the response."""
+
+    async def _make_request(self, method: Enum, data: dict, fairness_key: Hashable = None):
+        url = self.endpoint + method.value
+
+        async def _request() -> TokenRequestResponse:
+            async with self._admission_slot(fairness_key):
+                return await self._make_manager_request(url, data)
+
+        if self.singleflight:
+            # The admission slot is taken once (by fairness key of the first request) for the shared call.
+            api_manager_response = await self.singleflight.do(self._get_singleflight_key(url, data), _request)
+        else:
+            api_manager_response = await _request()
+        response = api_manager_response.json
+        status = api_manager_response.status
+        logger.debug('[%s] Got response %s with status %s', self.__class__.__name__, response, status)
+        self._check_response(status, response)
+        return response
+
+    async def _make_stream_request(
+            self, method: Enum, data: dict, fairness_key: Hashable = None,
+    ) -> AsyncIterator[dict]:
+        """Yields chunks of server sent events, the admission slot is held till the end of the stream,
+        thus close the iterator (see `aclosing`) if it is not consumed to the end.
+        """
+        url = self.endpoint + method.value
+        if not self.singleflight:
+            async with aclosing(self._iter_stream(url, data, fairness_key)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+
+        # Chunks of the shared stream are replayed to requests joined after it started.
+        key = self._get_singleflight_key(url, {**data, 'stream': True})
+        async with aclosing(
+                self.singleflight.stream(key, lambda: self._iter_stream(url, data, fairness_key)),
+        ) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def _iter_stream(self, url: str, data: dict, fairness_key: Hashable = None) -> AsyncIterator[dict]:
+        async with self._admission_slot(fairness_key):
+            api_manager_response = await self._make_manager_request(url, {**data, 'stream': True}, stream=True)
+            if api_manager_response.stream is None:
+                response = api_manager_response.json
+                status = api_manager_response.status
+                logger.debug(
+                    '[%s] Got response %s with status %s on stream request', self.__class__.__name__, response, status,
+                )
+                self._check_response(status, response)
+                raise self.STREAM_ERROR(f'[{self.__class__.__name__}] Got response with status {status}: {response}')
+
+            async with aclosing(iter_sse_data(api_manager_response.stream)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
@@ -2,10 +2,12 @@ import json
 import logging
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import AsyncIterator, Hashable, Optional
 
-from utils.token_api_request_manager import TokenApiManagerABC, TokenApiRequestPureManager
-from clients.openai.scheme import OpenAICompletion, ChatMessage, ChatMessages, OpenAIChatChoices
+from utils.generators import aclosing
+from utils.token_api_request_manager import TokenApiManagerABC
+from clients.base import AIClientABC
+from clients.openai.scheme import OpenAICompletion, ChatMessage, ChatMessages, OpenAIChatChoices, OpenAIChatChunk
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,10 @@ class OpenAIInvalidRequestError(Exception):
     pass
 
 
+class OpenAIStreamError(Exception):
+    pass
+
+
 @dataclass
 class DallEResponse:
     url: str
@@ -25,13 +31,14 @@ class DallEResponse:
     error: Optional[str] = None
 
 
-class OpenAIClient:
+class OpenAIClient(AIClientABC):
+    # Context length (prompt + completion tokens) of the models.
     COMPLETION_MAX_LENGTH = 4097
+    CHAT_COMPLETIONS_MAX_LENGTH = 16385
+    COMPLETIONS_MODEL = 'gpt-3.5-turbo-instruct'
+    CHAT_COMPLETIONS_MODEL = 'gpt-3.5-turbo'
     ERROR_MAX_TOKEN_MESSAGE = 'This model\'s maximum context'
-    DEFAULT_NO_COMPLETION_CHOICE_RESPONSE = 'A?'
-    DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES = {401}
-    DEFAULT_FORCE_MAIN_TOKEN_STATUSES = {400}
-    DEFAULT_RETRY_ON_429 = 1  # Thus, totally 2 times.
+    STREAM_ERROR = OpenAIStreamError
 
     DEFAULT_CHAT_BOT_ROLE = 'assistant'
     DEFAULT_IMAGE_PROMT_PREFIX = (
@@ -49,38 +56,19 @@ class OpenAIClient:
         token: Optional[str] = None,
         token_api_request_manager: Optional[TokenApiManagerABC] = None,
         endpoint: str = 'https://api.openai.com/v1/',
+        **kwargs,
     ):
-        if not token and not token_api_request_manager:
-            raise Exception('Rather token or token_api_request_manager should be defined.')
-        if not token_api_request_manager:
-            self.token_api_request_manager = TokenApiRequestPureManager(token)
-        else:
-            self.token_api_request_manager = token_api_request_manager
-
-        self.endpoint = endpoint
-
-    async def _make_request(self, method: Method, data: dict, try_count: int = 0):
-        url = self.endpoint + method.value
-        api_manager_response = await self.token_api_request_manager.make_request(
-            url=url, data=data, rotate_statuses=self.DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES,
-            force_main_token_statuses=self.DEFAULT_FORCE_MAIN_TOKEN_STATUSES,
-        )
-        response = api_manager_response.json
-        status = api_manager_response.status
-        logger.debug('[OpenAIClient] Got response %s with status %s', response, status)
+        """:param kwargs: shared resources of requests, see AIClientABC."""
+        super().__init__(token, token_api_request_manager, endpoint, **kwargs)
 
+    def _check_response(self, status: int, response: dict):
         if status == 400 and response.get('error', {}).get('message', '').startswith(
                 self.ERROR_MAX_TOKEN_MESSAGE):
             logger.warning('[OpenAIClient] Got invalid_request_error from openai, raise related exception.')
             raise OpenAIMaxTokenExceededError
 
-        if status == 429 and try_count <= self.DEFAULT_RETRY_ON_429:
-            logger.warning(f'[OpenAIClient] Got 429 status, {try_count = }, retry 1 more time if possible...')
-            return await self._make_request(method, data, try_count + 1)
-
         if status == 401:
             raise OpenAIInvalidRequestError(f'[OpenAIClient] Got response from OpenAI: {response}')
-        return response
 
     async def _parse_completion_choices(self, response: OpenAICompletion) -> str:
         choices = response.choices
@@ -91,15 +79,49 @@ class OpenAIClient:
         logger.debug('[OpenAIClient] Choose first completion in %s & send.', response)
         return choices[0].text
 
-    async def get_completions(self, text: str, max_tokens: int = 4000, temperature: float = 1.0) -> str:
-        data = {
-            'model': 'gpt-3.5-turbo-instruct',
+    @staticmethod
+    def _get_completions_data(text: str, max_tokens: int, temperature: float) -> dict:
+        return {
+            'model': OpenAIClient.COMPLETIONS_MODEL,
             'prompt': text,
             'max_tokens': max_tokens,
             'temperature': temperature,
         }
-        response = await self._make_request(self.Method.COMPLETIONS, data)
-        return await self._parse_completion_choices(OpenAICompletion(**response))
+
+    async def get_completions(
+            self, text: str, max_tokens: int = 4000, temperature: float = 1.0, fairness_key: Hashable = None,
+            use_cache: bool = True,
+    ) -> str:
+        data = self._get_completions_data(text, max_tokens, temperature)
+        cache_key, completion = await self._get_cached_completion(self.Method.COMPLETIONS, data, use_cache)
+        if completion is not None:
+            return completion
+
+        response = await self._make_request(self.Method.COMPLETIONS, data, fairness_key)
+        completion = await self._parse_completion_choices(OpenAICompletion(**response))
+        await self._cache_completion(cache_key, completion)
+        return completion
+
+    async def stream_completions(
+            self, text: str, max_tokens: int = 4000, temperature: float = 1.0, fairness_key: Hashable = None,
+            use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """Yields text deltas of the completion as soon as they are generated (cached completion as 1 delta)."""
+        data = self._get_completions_data(text, max_tokens, temperature)
+        cache_key, completion = await self._get_cached_completion(self.Method.COMPLETIONS, data, use_cache)
+        if completion is not None:
+            yield completion
+            return
+
+        deltas = []
+        async with aclosing(self._make_stream_request(self.Method.COMPLETIONS, data, fairness_key)) as chunks:
+            async for chunk in chunks:
+                choices = OpenAICompletion(**chunk).choices
+                if choices and choices[0].text:
+                    deltas.append(choices[0].text)
+                    yield choices[0].text
+        # Only fully received completions are cached.
+        await self._cache_completion(cache_key, ''.join(deltas))
 
     async def parse_chat_choices(self, response: OpenAIChatChoices) -> str:
         choices = response.choices
@@ -110,25 +132,67 @@ class OpenAIClient:
         logger.debug('[OpenAIClient] Choose first completion in %s & send.', response)
         return choices[0].message.content
 
-    async def get_chat_completions(self, messages: [ChatMessage], chat_bot_goal: str) -> str:
-        """
-        :param messages: previous messages + new message from a user.
-        :param chat_bot_goal: e.g. You are a helpful assistant.
-        """
+    @staticmethod
+    def _get_chat_completions_data(messages: [ChatMessage], chat_bot_goal: str) -> dict:
         chat_bot_goal = ChatMessage(
             role='system',
             content=chat_bot_goal,
         )
         messages = ChatMessages(root=[chat_bot_goal] + messages)
-        data = {
-            'model': 'gpt-3.5-turbo',
+        return {
+            'model': OpenAIClient.CHAT_COMPLETIONS_MODEL,
             'messages': json.loads(messages.json()),
             'n': 1,
         }
-        response = await self._make_request(self.Method.CHAT_COMPLETIONS, data)
-        return await self.parse_chat_choices(OpenAIChatChoices(**response))
 
-    async def get_generated_image(self, text: str, model: str = 'dall-e-3') -> DallEResponse:
+    async def get_chat_completions(
+            self, messages: [ChatMessage], chat_bot_goal: str, fairness_key: Hashable = None, use_cache: bool = True,
+    ) -> str:
+        """
+        :param messages: previous messages + new message from a user.
+        :param chat_bot_goal: e.g. You are a helpful assistant.
+        :param fairness_key: e.g. chat id, to queue requests fairly when the provider is busy.
+        :param use_cache: False - to skip the completion cache (e.g. the chat opted out).
+        """
+        data = self._get_chat_completions_data(messages, chat_bot_goal)
+        cache_key, completion = await self._get_cached_completion(self.Method.CHAT_COMPLETIONS, data, use_cache)
+        if completion is not None:
+            return completion
+
+        response = await self._make_request(self.Method.CHAT_COMPLETIONS, data, fairness_key)
+        completion = await self.parse_chat_choices(OpenAIChatChoices(**response))
+        await self._cache_completion(cache_key, completion)
+        return completion
+
+    async def stream_chat_completions(
+            self, messages: [ChatMessage], chat_bot_goal: str, fairness_key: Hashable = None, use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """Yields text deltas of the chat completion as soon as they are generated (cached completion as 1 delta).
+
+        :param messages: previous messages + new message from a user.
+        :param chat_bot_goal: e.g. You are a helpful assistant.
+        :param fairness_key: e.g. chat id, to queue requests fairly when the provider is busy.
+        :param use_cache: False - to skip the completion cache (e.g. the chat opted out).
+        """
+        data = self._get_chat_completions_data(messages, chat_bot_goal)
+        cache_key, completion = await self._get_cached_completion(self.Method.CHAT_COMPLETIONS, data, use_cache)
+        if completion is not None:
+            yield completion
+            return
+
+        deltas = []
+        async with aclosing(self._make_stream_request(self.Method.CHAT_COMPLETIONS, data, fairness_key)) as chunks:
+            async for chunk in chunks:
+                choices = OpenAIChatChunk(**chunk).choices
+                if choices and choices[0].delta.content:
+                    deltas.append(choices[0].delta.content)
+                    yield choices[0].delta.content
+        # Only fully received completions are cached.
+        await self._cache_completion(cache_key, ''.join(deltas))
+
+    async def get_generated_image(
+            self, text: str, model: str = 'dall-e-3', fairness_key: Hashable = None,
+    ) -> DallEResponse:
         assert model in ['dall-e-3', 'dall-e-2'], f'Model {model} is not supported.'
         data = {
             'model': model,
@@ -138,7 +202,7 @@ class OpenAIClient:
             'size': '1024x1024',
         }
 
-        response = await self._make_request(self.Method.IMAGE_GENERATION, data)
+        response = await self._make_request(self.Method.IMAGE_GENERATION, data, fairness_key)
         try:
             url = response['data'][0]['url']
             revised_prompt = response['data'][0]['revised_prompt']
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, RootModel
 
@@ -24,6 +24,18 @@ class OpenAIChatChoices(BaseModel):
     choices: list[OpenAIChatChoice]
 
 
+class OpenAIChatDelta(BaseModel):
+    content: Optional[str] = None
+
+
+class OpenAIChatChunkChoice(BaseModel):
+    delta: OpenAIChatDelta
+
+
+class OpenAIChatChunk(BaseModel):
+    choices: list[OpenAIChatChunkChoice]
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -1,10 +1,14 @@
 import json
 import logging
 from enum import Enum
-from typing import Optional
+from typing import AsyncIterator, Hashable, Optional
 
-from utils.token_api_request_manager import TokenApiManagerABC, TokenApiRequestPureManager
-from clients.perplexity.scheme import PerplexityChatChoicesOut, PerplexityChatMessageIn, PerplexityChatMessagesIn, PerplexityRole
+from utils.generators import aclosing
+from utils.token_api_request_manager import TokenApiManagerABC
+from clients.base import AIClientABC
+from clients.perplexity.scheme import (
+    PerplexityChatChoicesOut, PerplexityChatChunkOut, PerplexityChatMessageIn, PerplexityChatMessagesIn, PerplexityRole,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -14,12 +18,13 @@ logger = logging.getLogger(__name__)
 # - 'sonar-pro'
 
 
-class PerplexityClient:
-    DEFAULT_NO_COMPLETION_CHOICE_RESPONSE = 'A?'
-    # TODO: should be based on experience with Perplexity API.
-    DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES = {401}
-    DEFAULT_FORCE_MAIN_TOKEN_STATUSES = {400}
-    DEFAULT_RETRY_ON_429 = 1  # Thus, totally 2 times.
+class PerplexityStreamError(Exception):
+    pass
+
+
+class PerplexityClient(AIClientABC):
+    # TODO: rotated, retried and failure statuses should be based on experience with Perplexity API.
+    STREAM_ERROR = PerplexityStreamError
 
     DEFAULT_CHAT_BOT_ROLE = PerplexityRole.ASSISTANT.value
 
@@ -32,30 +37,16 @@ class PerplexityClient:
         token_api_request_manager: Optional[TokenApiManagerABC] = None,
         openai_model: str = 'llama-3.1-sonar-small-128k-online',
         endpoint: str = 'https://api.perplexity.ai/',
+        **kwargs,
     ):
-        if not token and not token_api_request_manager:
-            raise Exception('[PerplexityClient] Rather token or openai_token_api_request_manager should be defined.')
-        if not token_api_request_manager:
-            self.token_api_request_manager = TokenApiRequestPureManager(token)
-        else:
-            self.token_api_request_manager = token_api_request_manager
-
-        self.endpoint = endpoint
+        """:param kwargs: shared resources of requests, see AIClientABC."""
+        super().__init__(token, token_api_request_manager, endpoint, **kwargs)
         self.openai_model = openai_model
 
-    async def _make_request(self, method: Method, data: dict, try_count: int = 0):
-        url = self.endpoint + method.value
-        api_manager_response = await self.token_api_request_manager.make_request(
-            url=url, data=data, rotate_statuses=self.DEFAULT_TOKEN_TO_BE_ROTATED_STATUSES,
-            force_main_token_statuses=self.DEFAULT_FORCE_MAIN_TOKEN_STATUSES,
-        )
-        response = api_manager_response.json
-        status = api_manager_response.status
-        logger.debug('[%s] Got response %s with status %s', self.__class__.__name__, response, status)
-
-        # TODO: Handle different statuses and raise errors or make retries (should be based on experience).
-
-        return response
+    @staticmethod
+    def _get_completion_text(completion: tuple[str, list[str]]) -> str:
+        """:param completion: response text and citations."""
+        return completion[0]
 
     async def _parse_chat_choices(self, response: PerplexityChatChoicesOut) -> str:
         choices = response.choices
@@ -66,19 +57,13 @@ class PerplexityClient:
         logger.debug('[%s] Choose first completion in %s & send.', self.__class__.__name__, response)
         return choices[0].message.content
 
-    async def get_chat_completions(self, messages: list[PerplexityChatMessageIn], chat_bot_goal: str) -> tuple[str, list[str]]:
-        """
-        Returns response text and citations list.
-
-        :param messages: previous messages + new message from a user.
-        :param chat_bot_goal: e.g. You are a helpful assistant.
-        """
+    def _get_chat_completions_data(self, messages: list[PerplexityChatMessageIn], chat_bot_goal: str) -> dict:
         chat_bot_goal = PerplexityChatMessageIn(
             role=PerplexityRole.SYSTEM.value,
             content=chat_bot_goal,
         )
         messages = PerplexityChatMessagesIn(root=[chat_bot_goal] + messages)
-        data = {
+        return {
             'model': self.openai_model,
             'messages': json.loads(messages.json()),
             
@@ -96,12 +81,64 @@ class PerplexityClient:
             "presence_penalty": 0,
             "frequency_penalty": 1
         }
-        response = await self._make_request(self.Method.CHAT_COMPLETIONS, data)
+
+    async def get_chat_completions(
+            self, messages: list[PerplexityChatMessageIn], chat_bot_goal: str, fairness_key: Hashable = None,
+            use_cache: bool = True,
+    ) -> tuple[str, list[str]]:
+        """
+        Returns response text and citations list.
+
+        :param messages: previous messages + new message from a user.
+        :param chat_bot_goal: e.g. You are a helpful assistant.
+        :param fairness_key: e.g. chat id, to queue requests fairly when the provider is busy.
+        :param use_cache: False - to skip the completion cache (e.g. the chat opted out).
+        """
+        data = self._get_chat_completions_data(messages, chat_bot_goal)
+        cache_key, completion = await self._get_cached_completion(self.Method.CHAT_COMPLETIONS, data, use_cache)
+        if completion is not None:
+            response_text, citations = completion
+            return response_text, citations
+
+        response = await self._make_request(self.Method.CHAT_COMPLETIONS, data, fairness_key)
         try:
             perplexity_response = PerplexityChatChoicesOut(**response)
         except Exception as e:
             logger.error('[%s] Error parsing response %s', self.__class__.__name__, response)
             raise e
         response_text = await self._parse_chat_choices(perplexity_response)
+        await self._cache_completion(cache_key, (response_text, perplexity_response.citations))
         return response_text, perplexity_response.citations
 
+    async def stream_chat_completions(
+            self, messages: list[PerplexityChatMessageIn], chat_bot_goal: str, fairness_key: Hashable = None,
+            use_cache: bool = True,
+    ) -> AsyncIterator[tuple[str, list[str]]]:
+        """
+        Yields response text deltas as soon as they are generated with citations list known so far
+        (cached response as 1 delta).
+
+        :param messages: previous messages + new message from a user.
+        :param chat_bot_goal: e.g. You are a helpful assistant.
+        :param fairness_key: e.g. chat id, to queue requests fairly when the provider is busy.
+        :param use_cache: False - to skip the completion cache (e.g. the chat opted out).
+        """
+        data = self._get_chat_completions_data(messages, chat_bot_goal)
+        cache_key, completion = await self._get_cached_completion(self.Method.CHAT_COMPLETIONS, data, use_cache)
+        if completion is not None:
+            response_text, citations = completion
+            yield response_text, citations
+            return
+
+        deltas = []
+        citations = []
+        async with aclosing(self._make_stream_request(self.Method.CHAT_COMPLETIONS, data, fairness_key)) as chunks:
+            async for chunk in chunks:
+                perplexity_chunk = PerplexityChatChunkOut(**chunk)
+                choices = perplexity_chunk.choices
+                delta = choices[0].delta.content if choices and choices[0].delta.content else ''
+                deltas.append(delta)
+                citations = perplexity_chunk.citations or citations
+                yield delta, perplexity_chunk.citations
+        # Only fully received responses are cached.
+        await self._cache_completion(cache_key, (''.join(deltas), citations))
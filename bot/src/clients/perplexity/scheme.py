@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, RootModel
 
@@ -24,6 +24,19 @@ class PerplexityChatChoicesOut(BaseModel):
     citations: list[str]
 
 
+class PerplexityChatDeltaOut(BaseModel):
+    content: Optional[str] = None
+
+
+class PerplexityChatChunkChoiceOut(BaseModel):
+    delta: PerplexityChatDeltaOut
+
+
+class PerplexityChatChunkOut(BaseModel):
+    choices: list[PerplexityChatChunkChoiceOut]
+    citations: list[str] = []
+
+
 class PerplexityChatMessageIn(BaseModel):
     role: str
     content: str
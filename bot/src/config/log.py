@@ -1,28 +1,286 @@
+import atexit
+import html
+import json
 import logging
-from typing import List, Optional
-
-from python_telegram_logging import AsyncTelegramHandler, ParseMode
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
 from config.settings import settings
 
-class TelegramHTMLFormatter(logging.Formatter):
+# Writes records of the queue to the console in a thread, stopped at exit.
+_queue_listener: Optional[QueueListener] = None
+_queue_handler: Optional['LazyQueueHandler'] = None
+
+
+def _truncate(text: str, max_length: Optional[int]) -> str:
+    if max_length is None or len(text) <= max_length:
+        return text
+    return f'{text[:max_length]}... [+{len(text) - max_length} chars]'
+
+
+def _stop_queue_listener():
+    global _queue_listener
+    if _queue_listener is None:
+        return
+    if _queue_handler is not None:
+        # The rest of dropped records, written by the listener before it stops.
+        with _queue_handler.lock:
+            _queue_handler.report_dropped()
+    try:
+        _queue_listener.stop()
+    except queue.Full:
+        logging.getLogger(__name__).warning('Logging queue is full, records are lost...')
+    _queue_listener = None
+
+
+class TruncatingFormatter(logging.Formatter):
+    """Messages (e.g. full requests, responses and telegram messages) are cut to max_length, tracebacks are not."""
+
+    def __init__(self, *args, max_length: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_length = max_length
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _truncate(record.message, self.max_length)
+        return super().formatMessage(record)
+
+
+class JsonFormatter(TruncatingFormatter):
+    """1 json object per line, e.g. for log collectors."""
 
     def format(self, record: logging.LogRecord) -> str:
-        """Format the log record as HTML with custom emojis."""
-        level_colors = {"DEBUG": "⚪️", "INFO": "🔵", "WARNING": "🟡", "ERROR": "🔴", "CRITICAL": "⛔️"}
-        level_emoji = level_colors.get(record.levelname, "⚪️")
-        timestamp = self.formatTime(record, datefmt=self.datefmt)
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': _truncate(record.getMessage(), self.max_length),
+            'file': f'{record.filename}:{record.lineno}',
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only a share of records below WARNING of the loggers (and their children), e.g. {'bot.handlers': 0.1}."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        # Logger name to its rate (of the closest configured parent), None - not sampled.
+        self._logger_rates: dict[str, Optional[float]] = {}
+
+    def _get_rate(self, logger_name: str) -> Optional[float]:
+        if logger_name not in self._logger_rates:
+            name = logger_name
+            while name and name not in self.rates:
+                name = name.rpartition('.')[0]
+            self._logger_rates[logger_name] = self.rates.get(name)
+        return self._logger_rates[logger_name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._get_rate(record.name)
+        return rate is None or random.random() < rate
+
+
+class LazyQueueHandler(QueueHandler):
+    """Unlike QueueHandler, records are not formatted on enqueue, but by the listener thread (off the event loop).
+    Thus arguments of records should not be changed after logging (as usual).
+    If the queue is full (e.g. the console is slow), records are dropped instead of blocking,
+    the number of dropped records is reported by a WARNING record once the queue has room
+    (not more often than report_interval) and at exit.
+    """
+
+    def __init__(self, queue_: queue.Queue, report_interval: float = 60):
+        super().__init__(queue_)
+        self.report_interval = report_interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._report_at = 0.0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped > self._reported_dropped and time.monotonic() >= self._report_at:
+            self.report_dropped()
 
-        message = super().format(record)
+    def report_dropped(self):
+        """Puts the record to the queue directly (not via a logger), since it is called under the handler lock."""
+        dropped = self.dropped - self._reported_dropped
+        if not dropped:
+            return
+        record = logging.getLogger(__name__).makeRecord(
+            __name__, logging.WARNING, __file__, 0,
+            '[LazyQueueHandler] Logging queue was full, %s records dropped (%s in total)...',
+            (dropped, self.dropped), None,
+        )
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return
+        self._reported_dropped += dropped
+        self._report_at = time.monotonic() + self.report_interval
+
+
+@dataclass
+class _ErrorGroup:
+    record: logging.LogRecord  # The first one of the group.
+    count: int = 1
+
+
+class TelegramDigestHandler(logging.Handler):
+    """Aggregates records (ERROR by default) and sends 1 digest message per interval to the chat,
+    thus an outage (when every request fails) does not send a message per error (and flood the logging bot).
+
+    Records are grouped by logger and exception type (or message template if there is no exception) with counts.
+    The buffer is bounded by max_groups: under pressure groups of the lowest level (and count) are dropped.
+    Digests are sent from a background thread, the digest is rather truncated than split (1 message per interval).
+
+    # Use-case
+    ```
+        handler = TelegramDigestHandler(token, chat_id, interval=60)
+        logging.getLogger().addHandler(handler)
+    ```
+    """
+    API_URL = 'https://api.telegram.org/bot{token}/sendMessage'
+    MAX_TEXT_LENGTH = 4096
+    MAX_RECORD_MESSAGE_LENGTH = 300
+    MAX_TRACEBACK_LENGTH = 1000
+    LEVEL_EMOJIS = {'DEBUG': '⚪️', 'INFO': '🔵', 'WARNING': '🟡', 'ERROR': '🔴', 'CRITICAL': '⛔️'}
+
+    def __init__(
+            self,
+            token: str,
+            chat_id: int,
+            interval: float = 60,
+            max_groups: int = 100,
+            level: int = logging.ERROR,
+            timeout: float = 10,
+    ):
+        super().__init__(level)
+        self.token = token
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_groups = max_groups
+        self.timeout = timeout
+        self.formatter = logging.Formatter(datefmt='%d-%m-%Y %H:%M:%S %Z')
+        # Guarded by the handler lock.
+        self._groups: dict[tuple[str, str], _ErrorGroup] = {}
+        self._dropped = 0
+        self._window_started_at = time.time()
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _get_group_key(record: logging.LogRecord) -> tuple[str, str]:
+        if record.exc_info and record.exc_info[0] is not None:
+            return record.name, record.exc_info[0].__name__
+        return record.name, str(record.msg)
+
+    def emit(self, record: logging.LogRecord):
+        """Called under the handler lock."""
+        key = self._get_group_key(record)
+        group = self._groups.get(key)
+        if group is not None:
+            group.count += 1
+            return
 
-        html_message = (
-            f"{level_emoji} <b>{record.levelname}</b> <b>Telegram PhD Bot</b>" f"\n[{timestamp}]\n" 
-            f"<code>{record.name}</code>\n" f"{message}"
+        if len(self._groups) >= self.max_groups:
+            lowest_key, lowest = min(self._groups.items(), key=lambda item: (item[1].record.levelno, item[1].count))
+            if lowest.record.levelno >= record.levelno:
+                self._dropped += 1
+                return
+            del self._groups[lowest_key]
+            self._dropped += lowest.count
+        self._groups[key] = _ErrorGroup(record)
+
+    def _format_group(self, group: _ErrorGroup) -> str:
+        record = group.record
+        text = (
+            f'{self.LEVEL_EMOJIS.get(record.levelname, "⚪️")} <b>×{group.count}</b> '
+            f'<code>{html.escape(record.name)}</code> [{self.formatter.formatTime(record, self.formatter.datefmt)}]\n'
+            f'{html.escape(_truncate(record.getMessage(), self.MAX_RECORD_MESSAGE_LENGTH))}'
         )
         if record.exc_info:
-            html_message += f"\n\n<pre>{self.formatException(record.exc_info)}</pre>"
+            # The end of the traceback is the most relevant.
+            traceback = self.formatter.formatException(record.exc_info)[-self.MAX_TRACEBACK_LENGTH:]
+            text += f'\n<pre>{html.escape(traceback)}</pre>'
+        return text
+
+    def _compose_digest(self, groups: list[_ErrorGroup], dropped: int, window_started_at: float) -> str:
+        groups = sorted(groups, key=lambda group: (-group.record.levelno, -group.count))
+        total = sum(group.count for group in groups) + dropped
+        text = (
+            f'<b>Telegram PhD Bot</b>: {total} records in {int(time.time() - window_started_at)}s '
+            f'({len(groups)} kinds{f", {dropped} dropped" if dropped else ""})'
+        )
+        for idx, group in enumerate(groups):
+            group_text = '\n\n' + self._format_group(group)
+            more_text = f'\n\n... and {len(groups) - idx} more kinds'
+            if len(text) + len(group_text) + len(more_text) > self.MAX_TEXT_LENGTH:
+                text += more_text
+                break
+            text += group_text
+        return text
+
+    def _send(self, text: str):
+        request = urllib.request.Request(
+            self.API_URL.format(token=self.token),
+            data=urllib.parse.urlencode({
+                'chat_id': self.chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': 'true',
+            }).encode(),
+        )
+        for attempt in range(2):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    return
+            except urllib.error.HTTPError as e:
+                if e.code != 429 or attempt:
+                    raise
+                retry_after = json.loads(e.read() or b'{}').get('parameters', {}).get('retry_after', 1)
+                time.sleep(min(retry_after, self.interval))
+
+    def send_digest(self):
+        with self.lock:
+            groups, dropped, window_started_at = list(self._groups.values()), self._dropped, self._window_started_at
+            self._groups, self._dropped, self._window_started_at = {}, 0, time.time()
+        if not groups and not dropped:
+            return
+        try:
+            self._send(self._compose_digest(groups, dropped, window_started_at))
+        except Exception as e:
+            # Below ERROR, thus not handled by this handler again.
+            logging.getLogger(__name__).warning('[TelegramDigestHandler] Could not send digest: %r...', e)
 
-        return html_message
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.send_digest()
+
+    def close(self):
+        """The rest is sent at once."""
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+            self._thread.join(timeout=self.timeout)
+            self.send_digest()
+        super().close()
 
 
 def setup_logging(level: Optional[str] = None) -> None:
@@ -32,30 +290,46 @@ def setup_logging(level: Optional[str] = None) -> None:
     Args:
         level: Optional logging level to override the one from settings
     """
+    global _queue_listener, _queue_handler
     root_logger = logging.getLogger()
     root_logger.setLevel(level or settings.LOG_LEVEL)
     root_logger.handlers.clear()
-    
+    _stop_queue_listener()
+
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(
-        logging.Formatter(
-            fmt='%(levelname)-8s | %(asctime)s | %(message)s | %(filename)+13s',
-            datefmt='%Y-%m-%d %H:%M:%S'
+    if settings.LOG_FORMAT == 'json':
+        console_handler.setFormatter(
+            JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S%z', max_length=settings.LOG_MAX_MESSAGE_LENGTH)
         )
-    )
-    root_logger.addHandler(console_handler)
+    else:
+        console_handler.setFormatter(
+            TruncatingFormatter(
+                fmt='%(levelname)-8s | %(asctime)s | %(message)s | %(filename)+13s',
+                datefmt='%Y-%m-%d %H:%M:%S',
+                max_length=settings.LOG_MAX_MESSAGE_LENGTH,
+            )
+        )
+
+    # Records are only put to the queue on the event loop, formatted and written by the listener thread.
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = LazyQueueHandler(log_queue)
+    if settings.LOG_SAMPLING:
+        _queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLING))
+    root_logger.addHandler(_queue_handler)
+    _queue_listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.unregister(_stop_queue_listener)
+    atexit.register(_stop_queue_listener)
     
-    # Telegram handler for error reporting.
+    # Telegram handler for error reporting (1 digest per interval, sent by its own thread).
     if settings.TG_ERROR_LOGGING_BOT_TOKEN and settings.TG_ERROR_LOGGING_CHAT_ID:
-        telegram_handler = AsyncTelegramHandler(
+        telegram_handler = TelegramDigestHandler(
             token=settings.TG_ERROR_LOGGING_BOT_TOKEN,
             chat_id=settings.TG_ERROR_LOGGING_CHAT_ID,
-            parse_mode=ParseMode.HTML,
+            interval=settings.TG_ERROR_LOGGING_INTERVAL,
+            max_groups=settings.TG_ERROR_LOGGING_MAX_GROUPS,
             level=logging.ERROR,
         )
-        
-        formatter = TelegramHTMLFormatter(datefmt='%d-%m-%Y %H:%M:%S %Z')
-        telegram_handler.setFormatter(formatter, )
         root_logger.addHandler(telegram_handler)
 
     # # Set specific levels for some chatty libraries
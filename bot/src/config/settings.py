@@ -5,17 +5,59 @@ from pydantic.v1 import BaseSettings
 
 class Settings(BaseSettings):
     LOG_LEVEL: str = 'INFO'
+    LOG_FORMAT: str = 'text'  # Or 'json'.
+    LOG_MAX_MESSAGE_LENGTH: Optional[int] = 2000  # Longer messages are truncated, None - not truncated.
+    LOG_QUEUE_SIZE: int = 10000  # Records over it are dropped.
+    # Logger (and its children) to share of records below WARNING to keep, e.g. {"bot.handlers.messages": 0.1}.
+    LOG_SAMPLING: dict[str, float] = {}
 
     TG_BOT_TOKEN: str = 'foo'
     # TODO: deprecate, use from bot if needed.
     TG_BOT_USERNAME: str = 'foo'
     TG_BOT_CACHE_TTL: int = 60 * 10
     TG_BOT_MAX_TEXT_SYMBOLS: int = 4095  # Instead of 4096.
+    # Opt-in: send completions as they are generated (streamed) editing the reply, min seconds between edits.
+    TG_BOT_STREAM_COMPLETIONS: bool = False
+    TG_BOT_STREAM_EDIT_INTERVAL: float = 1.5
+    # In process cache of per chat modes (invalidated across processes via Redis pub/sub).
+    TG_BOT_MODE_CACHE_TTL: int = 60
+    TG_BOT_MODE_CACHE_MAX_SIZE: int = 10000
+    # In process cache of deciphered contributor tokens (invalidated across processes via Redis pub/sub).
+    TG_BOT_CONTRIBUTOR_TOKENS_CACHE_TTL: int = 60
+    TG_BOT_CONTRIBUTOR_TOKENS_CACHE_MAX_SIZE: int = 10000
+
+    # Webhook mode (instead of long polling): Telegram pushes updates to TG_BOT_WEBHOOK_URL + TG_BOT_WEBHOOK_PATH.
+    TG_BOT_WEBHOOK_ENABLED: bool = False
+    TG_BOT_WEBHOOK_URL: Optional[str] = None  # Public base url, e.g. https://bot.example.com, None - set outside.
+    TG_BOT_WEBHOOK_PATH: str = '/webhook'
+    TG_BOT_WEBHOOK_HEALTH_PATH: str = '/healthz'
+    TG_BOT_WEBHOOK_SECRET: Optional[str] = None  # None - derived from the bot token.
+    TG_BOT_WEBHOOK_HOST: str = '0.0.0.0'
+    TG_BOT_WEBHOOK_PORT: int = 8080
+    TG_BOT_WEBHOOK_WORKERS: int = 1  # Processes sharing the port.
+
+    # Queue mode (instead of polling in 1 process): the ingress process pushes updates to Redis Streams,
+    # TG_BOT_UPDATE_QUEUE_WORKERS processes handle them (updates of a chat in order).
+    TG_BOT_UPDATE_QUEUE_ENABLED: bool = False
+    TG_BOT_UPDATE_QUEUE_WORKERS: int = 2
+    TG_BOT_UPDATE_QUEUE_PARTITIONS: int = 16  # Should be the same for all processes, >= workers.
+    TG_BOT_UPDATE_QUEUE_MAX_LEN: int = 100000  # Backlog per partition, over it polling waits for workers.
+    TG_BOT_UPDATE_QUEUE_WORKER_CONCURRENCY: int = 100  # Updates handled at once by a worker.
+
+    # Prometheus metrics on METRICS_PORT (+ worker index for worker processes) /metrics.
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = '0.0.0.0'
+    METRICS_PORT: int = 9100
 
     TG_BOT_PHD_WORK_TASK_CRON: str = '0 0 * * *'
+    TG_BOT_PHD_WORK_TASK_RATE_PER_SECOND: float = 20
     TG_PHD_WORK_STICKER_ID: str = 'CAACAgIAAx0CVNcIDQACCuZgL5xCvCo0DEWdMrU7Kh5KGDjLpAACMQAD2GoWEJWGojH6my_MHgQ'
     TG_PHD_WORK_EXCLUDE_CHATS: Optional[List[int]]
     PRIORITY_CHATS: Optional[List[int]]
+    # Broadcast limits: Telegram allows ~30 messages per second for a bot and ~1 message per second in a chat.
+    TG_BROADCAST_RATE_PER_SECOND: float = 25
+    TG_BROADCAST_PER_CHAT_RATE_PER_SECOND: float = 1
+    TG_BROADCAST_CONCURRENCY: int = 10
 
     TG_SUPERADMIN_IDS: List[int]
 
@@ -27,6 +69,33 @@ class Settings(BaseSettings):
     PERPLEXITY_DIALOG_CONTEXT_MAX_DEPTH: int = 2
     PERPLEXITY_OPENAI_MODEL: str = 'llama-3.1-sonar-small-128k-online'
     PERPLEXITY_REFERAL_NOTES: Optional[str]
+    # Shared keep-alive connection pool for AI API requests (per endpoint).
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 0  # 0 means no limit.
+    HTTP_POOL_DNS_CACHE_TTL: int = 300
+    HTTP_POOL_KEEPALIVE_TIMEOUT: float = 30.0
+    # Health based selection of stored AI tokens: a token got 429 is not used for a while.
+    AI_TOKEN_COOLDOWN_ON_429: float = 30
+    AI_TOKEN_HEALTH_PERSIST_INTERVAL: Optional[float] = 60  # Share stats between processes via Redis, None - disable.
+    # Retries of AI API requests on 429/5xx/connection errors: exponential backoff with jitter, Retry-After honoured.
+    AI_RETRY_MAX_ATTEMPTS: int = 2
+    AI_RETRY_DEADLINE: float = 60  # Seconds for all attempts of a request.
+    AI_RETRY_BASE_DELAY: float = 0.5
+    AI_RETRY_MAX_DELAY: float = 10
+    # Fail fast when AI API endpoint is down: open after N consecutive failures, trial request after timeout seconds.
+    AI_CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    AI_CIRCUIT_BREAKER_RECOVERY_TIMEOUT: float = 30
+    # Concurrent requests per AI provider, the rest is queued round-robin by chats ("busy" reply on full queue).
+    AI_MAX_CONCURRENCY_PER_PROVIDER: int = 8
+    AI_MAX_QUEUE_SIZE_PER_PROVIDER: int = 100
+    AI_MAX_QUEUE_WAIT: Optional[float] = 60
+    # Reuse completions of the same normalized requests (in process LRU + Redis), chats could opt out.
+    AI_COMPLETION_CACHE_ENABLED: bool = False
+    AI_COMPLETION_CACHE_TTL: int = 24 * 60 * 60
+    AI_COMPLETION_CACHE_MAX_SIZE: int = 10000  # In Redis, the oldest are evicted.
+    AI_COMPLETION_CACHE_MEMORY_MAX_SIZE: int = 1000
+    AI_COMPLETION_CACHE_PERPLEXITY_FRESHNESS: float = 60 * 60  # Web search based answers get outdated faster.
+
     REDIS_HOST: str = 'localhost'
     REDIS_PORT: int = 6379
 
@@ -35,6 +104,8 @@ class Settings(BaseSettings):
     # To log errors directly to telegram.
     TG_ERROR_LOGGING_CHAT_ID: Optional[int] = None  # Chat ID for error logging
     TG_ERROR_LOGGING_BOT_TOKEN: Optional[str] = None
+    TG_ERROR_LOGGING_INTERVAL: float = 60  # Seconds, errors are sent as 1 digest per interval.
+    TG_ERROR_LOGGING_MAX_GROUPS: int = 100  # Kinds of errors (logger & exception) kept per interval.
 
     @property
     def OPENAI_CHAT_BOT_GOAL(self) -> str:
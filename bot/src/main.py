@@ -1,30 +1,86 @@
 import argparse
 import asyncio
 import logging
+import multiprocessing
 
 from aiogram import Bot
+from aiohttp import web
 
 # Note, that line below is very convenience and meaningful.
-from bot import filters, handlers  # noqa
+from bot import middlewares, filters, handlers  # noqa
 from bot.handlers.commands.commands import CommandEnum
-from bot.misc import dp, bot
+from bot.misc import (
+    dp, bot, http_session_pool, bot_chat_messages_cache, bot_chats_storage, bot_ai_contributor_chat_storage,
+    bot_chat_discussion_mode_storage, openai_token_api_request_manager, perplexity_token_api_request_manager,
+    update_stream, metrics,
+)
+from bot.update_queue import run_ingress
+from bot.webhook import create_webhook_app, get_secret_token, set_webhook
+from clients.openai.client import OpenAIClient
 from config.log import setup_logging
+from config.settings import settings
 from tasks.phd_work_notification import phd_work_notification_task
+from utils.tokenizer import load_tokenizers
 # from bot.handlers.commands.openai_contributor_token import router as openai_contributor_token_router
 
 # Initialize logging with custom configuration.
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Long living tasks started with the bot (strong references to not be garbage collected).
+_background_tasks: list[asyncio.Task] = []
+# Index of the worker process (webhook or update queue), e.g. to serve metrics on its own port.
+_worker_idx = 0
+
 
 async def on_startup(bot: Bot, *args, **kwargs):
     logger.info(f'Starting the bot {(await bot.me()).username}...')
     res = await bot.set_my_commands(CommandEnum.get_all_commands_json())
     logger.info(f'Set bot commands with result: {res}')
 
+    # To sync in process caches between bot processes.
+    _background_tasks.append(asyncio.create_task(bot_chat_discussion_mode_storage.listen_invalidations()))
+    _background_tasks.append(asyncio.create_task(bot_ai_contributor_chat_storage.listen_invalidations()))
+    # To apply tokens added/removed by other bot processes immediately.
+    _background_tasks.append(asyncio.create_task(openai_token_api_request_manager.listen_token_events()))
+    _background_tasks.append(asyncio.create_task(perplexity_token_api_request_manager.listen_token_events()))
+    await metrics.start_server(settings.METRICS_HOST, settings.METRICS_PORT + _worker_idx)
+    # Not to block the event loop on the first AI request.
+    await load_tokenizers([OpenAIClient.COMPLETIONS_MODEL, OpenAIClient.CHAT_COMPLETIONS_MODEL])
+
 
 async def on_shutdown(*args, **kwargs):
     logger.info('Stopping the bot...')
+    for task in _background_tasks:
+        task.cancel()
+    await metrics.stop_server()
+    await http_session_pool.close()
+
+
+async def backfill_chat_indexes():
+    for storage in (bot_chats_storage, bot_chat_messages_cache, bot_ai_contributor_chat_storage):
+        logger.info('Backfill chat index of %s...', storage.__class__.__name__)
+        await storage.backfill_index()
+
+
+ALL_DEFAULT_TG_UPDATES = [
+    'update_id',
+    'message',
+    'edited_message',
+    'channel_post',
+    'edited_channel_post',
+    'inline_query',
+    'chosen_inline_result',
+    'callback_query',
+    'shipping_query',
+    'pre_checkout_query',
+    'poll',
+    'poll_answer',
+    'my_chat_member',
+    'chat_member',
+    'chat_join_request',
+]
+ADDITIONAL_TG_UPDATES = ['chat_member']
 
 
 async def main(args):
@@ -33,37 +89,171 @@ async def main(args):
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     # dp.include_router(openai_contributor_token_router)
-    ALL_DEFAULT_TG_UPDATES = [
-        'update_id',
-        'message',
-        'edited_message',
-        'channel_post',
-        'edited_channel_post',
-        'inline_query',
-        'chosen_inline_result',
-        'callback_query',
-        'shipping_query',
-        'pre_checkout_query',
-        'poll',
-        'poll_answer',
-        'my_chat_member',
-        'chat_member',
-        'chat_join_request',
-    ]
-    ADDITIONAL_TG_UPDATES = ['chat_member']
     await dp.start_polling(bot, allowed_updates=ALL_DEFAULT_TG_UPDATES + ADDITIONAL_TG_UPDATES)
 
 
+async def _register_phd_work_notification_task(*args, **kwargs):
+    phd_work_notification_task.register()
+
+
+def run_webhook_worker(worker_idx: int, secret_token: str):
+    """Workers share the port (SO_REUSEPORT), thus the kernel balances connections of Telegram between them."""
+    global _worker_idx
+    _worker_idx = worker_idx
+    logger.info('Start webhook worker %s...', worker_idx)
+    if worker_idx == 0:
+        # Cron tasks are run only once.
+        dp.startup.register(_register_phd_work_notification_task)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    app = create_webhook_app(
+        dp, bot, settings.TG_BOT_WEBHOOK_PATH, secret_token, health_path=settings.TG_BOT_WEBHOOK_HEALTH_PATH,
+    )
+    web.run_app(
+        app,
+        host=settings.TG_BOT_WEBHOOK_HOST,
+        port=settings.TG_BOT_WEBHOOK_PORT,
+        reuse_port=settings.TG_BOT_WEBHOOK_WORKERS > 1,
+        print=None,
+    )
+
+
+def run_webhook():
+    # Secret is shared by workers (and hosts), Telegram sends it with every update.
+    secret_token = settings.TG_BOT_WEBHOOK_SECRET or get_secret_token(settings.TG_BOT_TOKEN)
+    if settings.TG_BOT_WEBHOOK_URL:
+        asyncio.run(set_webhook(
+            bot,
+            settings.TG_BOT_WEBHOOK_URL + settings.TG_BOT_WEBHOOK_PATH,
+            secret_token,
+            ALL_DEFAULT_TG_UPDATES + ADDITIONAL_TG_UPDATES,
+        ))
+    else:
+        logger.warning(
+            'TG_BOT_WEBHOOK_URL is not set, thus webhook should be set to the bot outside '
+            '(with TG_BOT_WEBHOOK_SECRET or the secret derived from the bot token, see README)...'
+        )
+
+    # Spawned (not forked), since the parent already used the event loop and connections.
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=run_webhook_worker, args=(worker_idx, secret_token), daemon=True)
+        for worker_idx in range(1, settings.TG_BOT_WEBHOOK_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        run_webhook_worker(0, secret_token)
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+
+async def supervise_update_queue_workers(
+        context: multiprocessing.context.SpawnContext, workers: list[multiprocessing.process.BaseProcess], interval: float = 5,
+):
+    """Dead workers are restarted with the same index, thus their partitions (and pending updates) are consumed."""
+    while True:
+        await asyncio.sleep(interval)
+        for worker_idx, worker in enumerate(workers):
+            if worker.is_alive():
+                continue
+            logger.warning('Update queue worker %s exited with code %s. Restart...', worker_idx, worker.exitcode)
+            workers[worker_idx] = start_update_queue_worker(context, worker_idx)
+
+
+async def run_update_queue_ingress(
+        context: multiprocessing.context.SpawnContext, workers: list[multiprocessing.process.BaseProcess],
+):
+    phd_work_notification_task.register()
+    try:
+        await asyncio.gather(
+            run_ingress(bot, update_stream, ALL_DEFAULT_TG_UPDATES + ADDITIONAL_TG_UPDATES),
+            supervise_update_queue_workers(context, workers),
+        )
+    finally:
+        await bot.session.close()
+
+
+async def run_update_queue_worker_async(worker_idx: int):
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    try:
+        await update_stream.consume(
+            update_stream.get_worker_partitions(worker_idx, settings.TG_BOT_UPDATE_QUEUE_WORKERS),
+            lambda update: dp.feed_raw_update(bot, update),
+            max_concurrency=settings.TG_BOT_UPDATE_QUEUE_WORKER_CONCURRENCY,
+        )
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+
+
+def run_update_queue_worker(worker_idx: int):
+    global _worker_idx
+    _worker_idx = worker_idx
+    logger.info('Start update queue worker %s...', worker_idx)
+    asyncio.run(run_update_queue_worker_async(worker_idx))
+
+
+def start_update_queue_worker(
+        context: multiprocessing.context.SpawnContext, worker_idx: int,
+) -> multiprocessing.process.BaseProcess:
+    worker = context.Process(target=run_update_queue_worker, args=(worker_idx,), daemon=True)
+    worker.start()
+    return worker
+
+
+def run_update_queue():
+    """The ingress (polling) is run in this process, workers are spawned (and restarted if they die),
+    each handles its partitions of chats.
+    """
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        start_update_queue_worker(context, worker_idx) for worker_idx in range(settings.TG_BOT_UPDATE_QUEUE_WORKERS)
+    ]
+    try:
+        asyncio.run(run_update_queue_ingress(context, workers))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--phd-work-notification-run-once', action='store_true',
                         help='Define if you want to merely run once PhDWorkNotificationTask.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='With --phd-work-notification-run-once: go through chats without sending stickers.')
+    parser.add_argument('--resume-broadcast',
+                        help='With --phd-work-notification-run-once: broadcast id of an interrupted run '
+                             '(broadcast_id of the last run stats) to skip chats it already sent to.')
+    parser.add_argument('--migrate-messages-cache', action='store_true',
+                        help='Convert legacy cached messages into hash records once and exit.')
+    parser.add_argument('--backfill-chat-indexes', action='store_true',
+                        help='Fill chat indexes of chat storages from already stored keys once and exit.')
+    parser.add_argument('--webhook', action='store_true',
+                        help='Receive updates via webhook instead of long polling (as TG_BOT_WEBHOOK_ENABLED).')
+    parser.add_argument('--update-queue', action='store_true',
+                        help='Poll updates to Redis Streams and handle them in worker processes '
+                             '(as TG_BOT_UPDATE_QUEUE_ENABLED).')
     args, unparsed = parser.parse_known_args()
     if unparsed and len(unparsed) > 0:
         logger.warning('Unparsed arguments %s. Assert...', unparsed)
         assert False
 
     if args.phd_work_notification_run_once:
-        phd_work_notification_task.run_once()
+        phd_work_notification_task.run_once(dry_run=args.dry_run, resume_broadcast_id=args.resume_broadcast)
+    elif args.migrate_messages_cache:
+        asyncio.run(bot_chat_messages_cache.migrate_legacy_messages())
+    elif args.backfill_chat_indexes:
+        asyncio.run(backfill_chat_indexes())
+    elif args.webhook or settings.TG_BOT_WEBHOOK_ENABLED:
+        run_webhook()
+    elif args.update_queue or settings.TG_BOT_UPDATE_QUEUE_ENABLED:
+        run_update_queue()
     else:
         asyncio.run(main(args))
@@ -1,63 +1,109 @@
 import logging
 from typing import Optional
 
-from bot.misc import bot, bot_chat_messages_cache
+from bot.misc import bot, bot_chat_messages_cache, bot_chats_storage, redis, metrics
 from config.settings import settings
+from utils.broadcaster import Broadcaster, BroadcastStats
 from utils.cron import CronTaskBase
-from utils.generators import batch
 from utils.redis.redis_storage import get_unique_chat_ids_from_storage
+from utils.time import now_utc
 
 logger = logging.getLogger(__name__)
 
+# Own broadcaster to send with the task rate.
+phd_work_broadcaster = Broadcaster(
+    bot,
+    redis,
+    bot_chats_storage,
+    rate_per_second=settings.TG_BOT_PHD_WORK_TASK_RATE_PER_SECOND,
+    concurrency=settings.TG_BROADCAST_CONCURRENCY,
+)
+
+
+def _get_key_last_run_stats() -> str:
+    return f'{bot.id}:PhDWorkNotificationTask:last_run'
+
 
-async def send_sticker_to_chats(chat_ids, sticker_id: str, chats_to_exclude: Optional[set[int]] = None):
-    for chat_id in chat_ids:
-        if chats_to_exclude and chat_id in chats_to_exclude:
-            continue
-        logger.info('Send phd sticker to chat %s...', chat_id)
-        try:
-            await bot.send_sticker(chat_id, sticker_id)
-        except Exception as e:
-            logger.warning('Could not send phd sticker to the chat %s, error %s. Pass it...', chat_id, e)
+async def _store_run_stats(stats: BroadcastStats, started_at: str, broadcast_id: str, dry_run: bool):
+    await redis.hset(_get_key_last_run_stats(), mapping={
+        'started_at': started_at,
+        'broadcast_id': broadcast_id,
+        'dry_run': int(dry_run),
+        'total': stats.total,
+        'sent': stats.sent,
+        'failed': stats.failed,
+        'pruned': stats.pruned,
+        'flood_waited': stats.flood_waited,
+        'wall_time': round(stats.wall_time, 3),
+    })
+
+
+async def send_sticker_to_chats(
+        chat_ids: list[int],
+        sticker_id: str,
+        broadcast_id: str,
+        dry_run: bool = False,
+) -> BroadcastStats:
+    return await phd_work_broadcaster.broadcast(
+        broadcast_id=broadcast_id,
+        chat_ids=chat_ids,
+        send=lambda chat_id: bot.send_sticker(chat_id, sticker_id),
+        dry_run=dry_run,
+    )
 
 
 async def _notify_all_chats_with_sticker(
         sticker_id: str,
         chats_to_exclude: Optional[list[int]] = None,
         prioritised_chats: Optional[list[int]] = None,
+        dry_run: bool = False,
+        resume_broadcast_id: Optional[str] = None,
 ):
+    """
+    :param dry_run: go through all chats to send without sending, e.g. to check the run time and chats.
+    :param resume_broadcast_id: id of an interrupted run (see the last run stats) to skip chats it already sent to,
+        None - a new broadcast (every run sends to all chats).
+    """
+    started_at = now_utc()
+    broadcast_id = resume_broadcast_id or f'PhDWorkNotificationTask:{started_at.isoformat()}'
+    logger.info('[_notify_all_chats_with_sticker] Broadcast %s...', broadcast_id)
     _chats_to_exclude = set(chats_to_exclude) if chats_to_exclude else set()
 
     logger.info('[_notify_all_chats_with_sticker] Firstly send to prioritised_chats (if active): %s', prioritised_chats)
+    prioritised_active_chats = []
     if prioritised_chats:
         # Check if chat has recent messages.
-        prioritised_active_chats = []
         # 1 query to Redis.
         prioritised_chats_is_active = await bot_chat_messages_cache.has_any_cached_messages(prioritised_chats)
         for chat_id, is_active in zip(prioritised_chats, prioritised_chats_is_active):
-            if is_active:
+            if is_active and chat_id not in _chats_to_exclude:
                 prioritised_active_chats.append(chat_id)
-        if prioritised_active_chats:
-            await send_sticker_to_chats(prioritised_active_chats, sticker_id, _chats_to_exclude)
 
     prioritised_chats = set(prioritised_chats) if prioritised_chats else set()
     # With bot_chat_messages_cache we use only kinda active chats.
     unique_chat_ids = await get_unique_chat_ids_from_storage(bot_chat_messages_cache)
+    logger.info(f'[_notify_all_chats_with_sticker] Should be excluded: {prioritised_chats} and {_chats_to_exclude}')
+    other_chats = [
+        chat for chat in unique_chat_ids if chat not in prioritised_chats and chat not in _chats_to_exclude
+    ]
+    logger.info('[_notify_all_chats_with_sticker] Fetched other chats: %s', other_chats)
 
-    for batch_chat_ids in batch(list(unique_chat_ids), 5):
-        logger.info('[_notify_all_chats_with_sticker] Fetched other chats: %s', batch_chat_ids)
-        logger.info(f'[_notify_all_chats_with_sticker] Should be excluded: {prioritised_chats} and {_chats_to_exclude}')
-        if not batch_chat_ids:
-            continue
-
-        await send_sticker_to_chats(
-            [chat for chat in batch_chat_ids if chat not in prioritised_chats and chat not in _chats_to_exclude],
-            sticker_id,
-        )
+    # Prioritised chats are first in the queue of the broadcast.
+    stats = await send_sticker_to_chats(
+        prioritised_active_chats + other_chats,
+        sticker_id,
+        broadcast_id=broadcast_id,
+        dry_run=dry_run,
+    )
+    logger.info('[_notify_all_chats_with_sticker] %sRun stats: %s', '[DRY RUN] ' if dry_run else '', stats.to_text())
+    await _store_run_stats(stats, started_at.isoformat(), broadcast_id, dry_run)
+    return stats
 
 
 phd_work_notification_task: CronTaskBase = CronTaskBase(
     cron_expression=settings.TG_BOT_PHD_WORK_TASK_CRON,
     coro=_notify_all_chats_with_sticker,
     args=(settings.TG_PHD_WORK_STICKER_ID, settings.TG_PHD_WORK_EXCLUDE_CHATS, settings.PRIORITY_CHATS),
+    name='phd_work_notification',
+    metrics=metrics,
 )
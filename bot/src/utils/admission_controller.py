@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejectedError(Exception):
+    """The queue is full or the request waited for too long, thus it should not be made (e.g. reply "busy")."""
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    rejected: int = 0
+    queued: int = 0  # Admitted after waiting in the queue.
+    max_queue_size_seen: int = 0
+    total_wait_time: float = 0.0
+
+    @property
+    def avg_wait_time(self) -> float:
+        return self.total_wait_time / self.queued if self.queued else 0.0
+
+
+class AdmissionController:
+    """Bounds concurrent requests (e.g. to an AI provider) and queues the rest fairly:
+    waiting requests are grouped by fairness key (e.g. chat id) and freed slots are given round-robin across keys,
+    thus a spammy chat waits for its own requests, but does not starve other chats.
+    When the queue is full (or a request waited more than max_wait) AdmissionRejectedError is raised.
+
+    A freed slot is handed over to the next waiter in `release` (the in flight count stays the same),
+    thus a new request can not take it between the release and the wake up of the waiter.
+
+    # Use-case
+    ```
+        controller = AdmissionController('openai', max_concurrency=8, max_queue_size=100)
+        async with controller.slot(message.chat.id):
+            response = await make_request()
+    ```
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_concurrency: int = 8,
+            max_queue_size: int = 100,
+            max_wait: Optional[float] = None,
+    ):
+        """
+        :param max_wait: seconds a request may wait in the queue, None - no limit.
+        """
+        assert max_concurrency > 0, 'Max concurrency should be positive.'
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.max_wait = max_wait
+        self.stats = AdmissionStats()
+
+        self.in_flight = 0
+        self.queue_size = 0
+        # Fairness key to its waiters, order of keys is the round-robin order.
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+
+    async def acquire(self, fairness_key: Hashable = None):
+        """:raises AdmissionRejectedError: if the queue is full or waited for longer than max_wait."""
+        if self.in_flight < self.max_concurrency and not self.queue_size:
+            self.in_flight += 1
+            self.stats.admitted += 1
+            return
+
+        if self.queue_size >= self.max_queue_size:
+            self.stats.rejected += 1
+            logger.warning('[AdmissionController] %s queue is full (%s), reject...', self.name, self.queue_size)
+            raise AdmissionRejectedError(f'{self.name} queue is full.')
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(fairness_key, deque()).append(waiter)
+        self.queue_size += 1
+        self.stats.max_queue_size_seen = max(self.stats.max_queue_size_seen, self.queue_size)
+        started_at = time.monotonic()
+        try:
+            if self.max_wait is None:
+                await waiter
+            else:
+                await asyncio.wait_for(waiter, self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over right before the cancellation.
+                self.release()
+            else:
+                self._remove_waiter(fairness_key, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats.rejected += 1
+                logger.warning('[AdmissionController] %s waited for too long, reject...', self.name)
+                raise AdmissionRejectedError(f'{self.name} is busy.') from e
+            raise
+
+        self.stats.admitted += 1
+        self.stats.queued += 1
+        self.stats.total_wait_time += time.monotonic() - started_at
+
+    def release(self):
+        self.in_flight -= 1
+        while self._queues:
+            fairness_key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(fairness_key)
+            else:
+                del self._queues[fairness_key]
+            self.queue_size -= 1
+            if not waiter.done():
+                # The slot is handed over, in flight counter stays the same.
+                self.in_flight += 1
+                waiter.set_result(None)
+                return
+
+    def _remove_waiter(self, fairness_key: Hashable, waiter: asyncio.Future):
+        waiters = self._queues.get(fairness_key)
+        if not waiters or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self.queue_size -= 1
+        if not waiters:
+            del self._queues[fairness_key]
+
+    @asynccontextmanager
+    async def slot(self, fairness_key: Hashable = None) -> AsyncIterator[None]:
+        await self.acquire(fairness_key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def to_text(self) -> str:
+        return (
+            f'{self.name}: in flight: {self.in_flight}/{self.max_concurrency}, '
+            f'queued: {self.queue_size}/{self.max_queue_size} (chats: {len(self._queues)}), '
+            f'admitted: {self.stats.admitted}, admitted after wait: {self.stats.queued}, '
+            f'rejected: {self.stats.rejected}, max queue: {self.stats.max_queue_size_seen}, '
+            f'avg wait: {self.stats.avg_wait_time:.2f}s'
+        )
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Optional
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from redis.asyncio import Redis
+
+from utils.rate_limiter import TokenBucketRateLimiter
+from utils.redis.redis_storage import BotChatsStorage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # Already sent by the previous (interrupted) run with the same broadcast id.
+    skipped: int = 0
+    # Chats removed from BotChatsStorage since the bot could not reach them anymore.
+    pruned: int = 0
+    flood_waited: int = 0
+    wall_time: float = 0.0
+    failed_chat_ids: list[int] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.skipped + self.pruned
+
+    def to_text(self) -> str:
+        return (
+            f'sent: {self.sent}, failed: {self.failed}, skipped (already sent): {self.skipped}, '
+            f'pruned (dead chats): {self.pruned}, flood waits: {self.flood_waited}, '
+            f'processed: {self.processed}/{self.total}, wall time: {self.wall_time:.1f}s'
+        )
+
+
+class Broadcaster:
+    """Sends something to many chats concurrently within Telegram limits.
+
+    - bounded concurrency (workers),
+    - global and per chat token bucket rate limits,
+    - waits on flood control (RetryAfter) for all workers and retries,
+    - removes dead chats (bot kicked, chat not found) from BotChatsStorage,
+    - persists sent chats in Redis per broadcast id, thus rerun with the same id resumes the broadcast,
+    - optionally edits a progress message in place.
+
+    # Use-case
+    ```
+        broadcaster = Broadcaster(bot, redis, bot_chats_storage)
+        stats = await broadcaster.broadcast(
+            'some-id', chat_ids, lambda chat_id: bot.send_sticker(chat_id, sticker_id),
+        )
+    ```
+    """
+    # Lowercase parts of Telegram error descriptions that mean the chat will never be reachable.
+    DEAD_CHAT_ERRORS = (
+        'chat not found',
+        'bot was kicked',
+        'bot was blocked',
+        'user is deactivated',
+        'bot is not a member',
+        'group chat was upgraded',
+        'chat was deleted',
+    )
+    PROGRESS_EDIT_INTERVAL = 5  # Seconds.
+    DONE_TTL = 3600 * 24 * 7  # How long to remember sent chats of a broadcast.
+
+    def __init__(
+            self,
+            bot: Bot,
+            redis_engine: Redis,
+            bot_chats_storage: Optional[BotChatsStorage] = None,
+            rate_per_second: float = 25,
+            per_chat_rate_per_second: float = 1,
+            concurrency: int = 10,
+            max_attempts: int = 3,
+    ):
+        """
+        :param bot_chats_storage: to prune dead chats from, None - do not prune.
+        :param rate_per_second: global rate (Telegram allows ~30 messages per second for a bot).
+        :param per_chat_rate_per_second: rate for 1 chat (Telegram allows ~1 message per second in a chat).
+        :param concurrency: number of simultaneous requests.
+        :param max_attempts: attempts per chat (flood waits are counted as well).
+        """
+        self.bot = bot
+        self.redis_engine = redis_engine
+        self.bot_chats_storage = bot_chats_storage
+        self.per_chat_rate_per_second = per_chat_rate_per_second
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+        self.rate_limiter = TokenBucketRateLimiter(rate_per_second)
+        self._chat_rate_limiters: dict[int, TokenBucketRateLimiter] = {}
+
+    def _get_key_done(self, broadcast_id: str) -> str:
+        return f'{self.bot.id}:Broadcaster:{broadcast_id}:done'
+
+    def _get_chat_rate_limiter(self, chat_id: int) -> TokenBucketRateLimiter:
+        limiter = self._chat_rate_limiters.get(chat_id)
+        if limiter is None:
+            limiter = TokenBucketRateLimiter(self.per_chat_rate_per_second, capacity=1)
+            self._chat_rate_limiters[chat_id] = limiter
+        return limiter
+
+    @classmethod
+    def _is_dead_chat_error(cls, e: Exception) -> bool:
+        if isinstance(e, TelegramForbiddenError):
+            return True
+        if isinstance(e, TelegramBadRequest):
+            description = f'{e.message}'.lower()
+            return any(error in description for error in cls.DEAD_CHAT_ERRORS)
+        return False
+
+    async def _prune_chat(self, chat_id: int):
+        if self.bot_chats_storage is not None:
+            logger.info('[Broadcaster] Prune dead chat %s...', chat_id)
+            await self.bot_chats_storage.rm_chat(chat_id)
+
+    async def _send_to_chat(
+            self,
+            broadcast_id: str,
+            chat_id: int,
+            send: Callable[[int], Awaitable],
+            stats: BroadcastStats,
+            dry_run: bool,
+    ):
+        for attempt in range(1, self.max_attempts + 1):
+            await self._get_chat_rate_limiter(chat_id).acquire()
+            await self.rate_limiter.acquire()
+            try:
+                if not dry_run:
+                    await send(chat_id)
+            except TelegramRetryAfter as e:
+                logger.warning('[Broadcaster] Flood wait %ss on chat %s, attempt %s.', e.retry_after, chat_id, attempt)
+                stats.flood_waited += 1
+                # Flood control is per bot, thus all workers should wait.
+                self.rate_limiter.pause(e.retry_after)
+                continue
+            except Exception as e:
+                if self._is_dead_chat_error(e):
+                    stats.pruned += 1
+                    await self._prune_chat(chat_id)
+                    return
+                logger.warning('[Broadcaster] Could not send to the chat %s, error %s. Pass it...', chat_id, e)
+                break
+
+            stats.sent += 1
+            if not dry_run:
+                async with self.redis_engine.pipeline(transaction=True) as pipe:
+                    pipe = pipe.sadd(self._get_key_done(broadcast_id), chat_id)
+                    pipe = pipe.expire(self._get_key_done(broadcast_id), self.DONE_TTL)
+                    await pipe.execute()
+            return
+
+        stats.failed += 1
+        stats.failed_chat_ids.append(chat_id)
+
+    async def _edit_progress_message(self, progress_message: types.Message, text: str):
+        try:
+            await progress_message.edit_text(text)
+        except Exception as e:
+            logger.debug('[Broadcaster] Could not edit progress message: %s. Pass it...', e)
+
+    async def _report_progress(self, progress_message: types.Message, stats: BroadcastStats):
+        while True:
+            await asyncio.sleep(self.PROGRESS_EDIT_INTERVAL)
+            await self._edit_progress_message(progress_message, f'Broadcasting... {stats.to_text()}')
+
+    async def broadcast(
+            self,
+            broadcast_id: str,
+            chat_ids: Iterable[int],
+            send: Callable[[int], Awaitable],
+            progress_message: Optional[types.Message] = None,
+            dry_run: bool = False,
+    ) -> BroadcastStats:
+        """
+        :param broadcast_id: the same id resumes the broadcast (chats already sent to are skipped).
+        :param send: coroutine function that sends something to the chat id.
+        :param progress_message: message of the bot to edit with the progress.
+        :param dry_run: do not send anything, merely go through the chats with the limits.
+        """
+        started_at = time.monotonic()
+        chat_ids = list(chat_ids)
+        stats = BroadcastStats(total=len(chat_ids))
+        done_chat_ids = {
+            int(chat_id) for chat_id in await self.redis_engine.smembers(self._get_key_done(broadcast_id))
+        } if not dry_run else set()
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            if chat_id in done_chat_ids:
+                stats.skipped += 1
+                continue
+            queue.put_nowait(chat_id)
+        logger.info('[Broadcaster] Start %s broadcast to %s chats (%s skipped)...',
+                    broadcast_id, queue.qsize(), stats.skipped)
+
+        async def _worker():
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                try:
+                    await self._send_to_chat(broadcast_id, chat_id, send, stats, dry_run)
+                except Exception as e:
+                    logger.exception('[Broadcaster] Unexpected error on chat %s: %s', chat_id, e)
+                    stats.failed += 1
+                    stats.failed_chat_ids.append(chat_id)
+
+        progress_task = (
+            asyncio.create_task(self._report_progress(progress_message, stats)) if progress_message else None
+        )
+        try:
+            await asyncio.gather(*[_worker() for _ in range(min(self.concurrency, queue.qsize()))])
+        finally:
+            if progress_task:
+                progress_task.cancel()
+            # Broadcast is short living, per chat limiters are not needed anymore.
+            self._chat_rate_limiters.clear()
+
+        stats.wall_time = time.monotonic() - started_at
+        logger.info('[Broadcaster] Finished %s broadcast: %s', broadcast_id, stats.to_text())
+        if progress_message:
+            await self._edit_progress_message(progress_message, f'Broadcast finished: {stats.to_text()}')
+        return stats
@@ -0,0 +1,151 @@
+import logging
+import time
+from enum import Enum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitBreakerOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f'Circuit breaker {name} is open, retry in {retry_in:.1f}s.')
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreakerState(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Fails fast when an upstream is down instead of piling up requests to it.
+
+    - closed: requests go, `failure_threshold` consecutive failures open the breaker,
+    - open: requests are rejected with CircuitBreakerOpenError for `recovery_timeout` seconds,
+    - half-open: 1 trial request goes (others are rejected), its success closes the breaker, failure opens it again.
+      If the trial does not report back (e.g. cancelled), the next trial is allowed after `recovery_timeout`.
+
+    Transitions (`before_call`, `on_success`, `on_failure`) have no await inside and the half-open trial is claimed
+    in `before_call` before the request is awaited, thus concurrent calls can not let 2 trials go.
+
+    # Use-case
+    ```
+        breaker = CircuitBreaker('openai')
+        # Raises CircuitBreakerOpenError without a request if the breaker is open.
+        response = await breaker.call(make_request, is_failure=lambda response: response.status >= 500)
+    ```
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self.state = CircuitBreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+
+    def _get_retry_in(self, now: float) -> float:
+        started_at = self._trial_started_at if self._trial_started_at is not None else self._opened_at
+        return max(started_at + self.recovery_timeout - now, 0.0)
+
+    def before_call(self):
+        """:raises CircuitBreakerOpenError: if the request should not go to the upstream."""
+        if self.state == CircuitBreakerState.CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state == CircuitBreakerState.OPEN and now >= self._opened_at + self.recovery_timeout:
+            logger.info('[CircuitBreaker] %s is half-open, let a trial request go...', self.name)
+            self.state = CircuitBreakerState.HALF_OPEN
+            self._trial_started_at = None
+
+        if self.state == CircuitBreakerState.HALF_OPEN and (
+                self._trial_started_at is None or now >= self._trial_started_at + self.recovery_timeout
+        ):
+            self._trial_started_at = now
+            return
+
+        self.total_rejected += 1
+        raise CircuitBreakerOpenError(self.name, self._get_retry_in(now))
+
+    def on_success(self):
+        if self.state != CircuitBreakerState.CLOSED:
+            logger.info('[CircuitBreaker] %s is closed again.', self.name)
+        self.state = CircuitBreakerState.CLOSED
+        self.consecutive_failures = 0
+        self._trial_started_at = None
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == CircuitBreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        if self.state != CircuitBreakerState.OPEN:
+            logger.warning(
+                '[CircuitBreaker] %s is open after %s failures, reject requests for %ss...',
+                self.name, self.consecutive_failures, self.recovery_timeout,
+            )
+            self.opened_count += 1
+        self.state = CircuitBreakerState.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_started_at = None
+
+    async def call(self, func: Callable[[], Awaitable[T]], is_failure: Callable[[T], bool] = lambda _: False) -> T:
+        """Calls func through the breaker: exceptions and results matched by is_failure are counted as failures.
+        :raises CircuitBreakerOpenError: if the request should not go to the upstream.
+        """
+        self.before_call()
+        try:
+            result = await func()
+        except Exception:
+            self.on_failure()
+            raise
+        if is_failure(result):
+            self.on_failure()
+        else:
+            self.on_success()
+        return result
+
+    def to_text(self) -> str:
+        text = (
+            f'{self.name}: {self.state.value}, consecutive failures: {self.consecutive_failures}, '
+            f'failures: {self.total_failures}, rejected: {self.total_rejected}, opened: {self.opened_count} times'
+        )
+        if self.state != CircuitBreakerState.CLOSED:
+            text += f', retry in {self._get_retry_in(time.monotonic()):.1f}s'
+        return text
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers by name (e.g. endpoint + method), created on first use with the same thresholds."""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.recovery_timeout)
+            self._breakers[name] = breaker
+        return breaker
+
+    def get_all(self) -> list[CircuitBreaker]:
+        return list(self._breakers.values())
+
+    def to_text(self) -> str:
+        if not self._breakers:
+            return 'No requests were made yet.'
+        return '\n'.join(f'- {breaker.to_text()}' for breaker in self._breakers.values())
@@ -9,6 +9,8 @@ from datetime import datetime
 
 from croniter import croniter
 
+from utils.metrics import Metrics
+
 
 logger = logging.getLogger(__name__)
 
@@ -24,8 +26,15 @@ async def _wait_until(dt: datetime):
     await asyncio.sleep(remaining)
 
 
-async def cron_task(cron_expression: str, coro: Callable[..., Coroutine[Any, Any, Any]], base: datetime = None):
+async def cron_task(
+        cron_expression: str,
+        coro: Callable[..., Coroutine[Any, Any, Any]],
+        base: datetime = None,
+        name: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+):
     """Simple double looped croniter (cron scheduler) to be register in running loop."""
+    metrics = metrics or Metrics()
 
     logger.info(f'Start task {coro}')
 
@@ -40,7 +49,8 @@ async def cron_task(cron_expression: str, coro: Callable[..., Coroutine[Any, Any
         await _wait_until(next)
         try:
             logger.info(f'Start executing {coro}...')
-            await coro()
+            with metrics.timer(metrics.cron_task_duration.labels(name or str(coro))):
+                await coro()
             logger.info(f'End executing {coro}.')
         except Exception as e:
             logger.exception(f'Could not proceed with {coro}: {e}. Pass it...')
@@ -54,13 +64,17 @@ class CronTaskBase:
             cron_expression: Optional[str] = None,
             coro: Optional[Callable[..., Coroutine[Any, Any, Any]]] = None,
             args: Optional[Tuple] = (),
+            name: Optional[str] = None,
+            metrics: Optional[Metrics] = None,
     ):
         self.cron_expression = cron_expression
         self.coro = coro if not args else functools.partial(coro, *args)
+        self.name = name
+        self.metrics = metrics
 
     def register(self):
         loop = asyncio.get_event_loop()
-        loop.create_task(cron_task(self.cron_expression, self.coro))
+        loop.create_task(cron_task(self.cron_expression, self.coro, name=self.name, metrics=self.metrics))
 
-    def run_once(self):
-        return asyncio.run(self.coro())
+    def run_once(self, **kwargs):
+        return asyncio.run(self.coro(**kwargs))
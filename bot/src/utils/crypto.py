@@ -1,12 +1,58 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Optional
+
 from fernet import Fernet
 
+from utils.ttl_cache import LRUTTLCache
+
 
 class Crypto:
-    def __init__(self, fernet_engine: Fernet):
+    """Note, fernet is pure python (e.g. ~0.2ms to decipher a token), thus batches are deciphered on a thread pool
+    with `decipher_many` not to stall the event loop. Deciphered values are cached by ciphered ones,
+    since the same values are deciphered again and again (e.g. on every token storage reload).
+
+    # Use-case
+    ```
+        crypto = Crypto(Fernet(key))
+        ciphered = crypto.cipher_to_str('token')
+        tokens = await crypto.decipher_many([ciphered, None])  # ['token', None]
+    ```
+    """
+
+    def __init__(self, fernet_engine: Fernet, executor: Optional[Executor] = None, cache_maxsize: int = 10000):
+        """:param executor: for `decipher_many`, None - the default executor of the loop."""
         self._fernet = fernet_engine
+        self._executor = executor
+        # Ciphered value to deciphered one, they never change, thus never expire.
+        self._deciphered_cache = LRUTTLCache(maxsize=cache_maxsize, ttl=float('inf'))
 
     def cipher_to_str(self, value: str) -> str:
         return self._fernet.encrypt(value).decode()
 
     def decipher_to_str(self, value: str) -> str:
-        return self._fernet.decrypt(value.encode()).decode()
+        deciphered = self._deciphered_cache.get(value)
+        if deciphered is LRUTTLCache.MISSING:
+            deciphered = self._fernet.decrypt(value.encode()).decode()
+            self._deciphered_cache.set(value, deciphered)
+        return deciphered
+
+    def _decipher_batch(self, values: list[str]) -> list[str]:
+        return [self._fernet.decrypt(value.encode()).decode() for value in values]
+
+    async def decipher_many(self, values: list[Optional[str]]) -> list[Optional[str]]:
+        """Empty values are kept as None, not cached values are deciphered in 1 job on the executor."""
+        result = [None if not value else self._deciphered_cache.get(value) for value in values]
+        to_decipher = list({value for value, deciphered in zip(values, result) if deciphered is LRUTTLCache.MISSING})
+        if to_decipher:
+            deciphered = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._decipher_batch, to_decipher,
+            )
+            value_to_deciphered = dict(zip(to_decipher, deciphered))
+            for value, deciphered_value in value_to_deciphered.items():
+                self._deciphered_cache.set(value, deciphered_value)
+            result = [
+                value_to_deciphered[value] if deciphered is LRUTTLCache.MISSING else deciphered
+                for value, deciphered in zip(values, result)
+            ]
+        return result
@@ -1,4 +1,21 @@
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, TypeVar
+
+T = TypeVar('T', bound=AsyncGenerator)
+
+
 def batch(iterable, size=100):
     iterable_len = len(iterable)
     for ndx in range(0, iterable_len, size):
         yield iterable[ndx:min(ndx + size, iterable_len)]
+
+
+@asynccontextmanager
+async def aclosing(generator: T) -> AsyncIterator[T]:
+    """`contextlib.aclosing` of python 3.10: the generator is closed on exit, thus its `finally` blocks (e.g. a held
+    admission slot) run right away when iteration stops early, not whenever the generator is garbage collected.
+    """
+    try:
+        yield generator
+    finally:
+        await generator.aclose()
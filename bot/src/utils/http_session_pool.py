@@ -0,0 +1,82 @@
+import logging
+from typing import Optional
+
+import aiohttp
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+
+
+class HttpSessionPool:
+    """Long-lived aiohttp sessions: 1 session (with its own keep-alive connector) per endpoint origin.
+
+    Thus, requests to the same API reuse opened TCP+TLS connections and cached DNS instead of
+    creating a fresh `aiohttp.ClientSession` per request.
+
+    Note, sessions are created lazily inside the running loop and should be closed with `close` on shutdown.
+
+    # Use-case
+    ```
+        pool = HttpSessionPool(limit=100, limit_per_host=20)
+        session = pool.get_session('https://api.openai.com/v1/chat/completions')
+        async with session.post(url, json=data) as response:
+            ...
+        await pool.close()
+    ```
+    """
+
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 0,
+            ttl_dns_cache: int = 300,
+            keepalive_timeout: float = 30.0,
+            request_timeout: Optional[float] = None,
+    ):
+        """
+        :param limit: total simultaneous connections per endpoint session (0 means unlimited).
+        :param limit_per_host: simultaneous connections to the same host (0 means unlimited).
+        :param ttl_dns_cache: seconds to cache DNS resolutions.
+        :param keepalive_timeout: seconds to keep idle connection opened for reuse.
+        :param request_timeout: total timeout for a request in seconds, None - aiohttp default.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def _get_origin(url: str) -> str:
+        return str(URL(url).origin())
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.ttl_dns_cache,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout) if self.request_timeout else None
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def get_session(self, url: str) -> aiohttp.ClientSession:
+        """Get (or create on the first call) the session for the origin of the url.
+        Note, it should be called from a coroutine, and there is no await inside, thus no lock is needed.
+        """
+        origin = self._get_origin(url)
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            logger.info('[HttpSessionPool] Create new session for %s...', origin)
+            session = self._create_session()
+            self._sessions[origin] = session
+        return session
+
+    async def close(self):
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.info('[HttpSessionPool] Closed %s sessions.', len(sessions))
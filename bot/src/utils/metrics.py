@@ -0,0 +1,179 @@
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class _NoopMetric:
+    """Stands for any prometheus metric (with any labels) when metrics are disabled."""
+
+    def labels(self, *args, **kwargs) -> '_NoopMetric':
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def set_function(self, *args, **kwargs):
+        pass
+
+
+_NOOP_METRIC = _NoopMetric()
+
+
+class Metrics:
+    """Prometheus metrics of the bot process, exposed via `start_server` on /metrics.
+
+    When disabled, prometheus_client is not imported, metrics are no-ops and decorators / instrumentation return
+    functions and objects as they are, thus there is no overhead on hot paths.
+
+    # Use-case
+    ```
+        metrics = Metrics(enabled=True)
+
+        @metrics.timed_handler('send_completion_response')
+        async def send_completion_response(message, *args, **kwargs):
+            ...
+
+        metrics.instrument_storage(bot_chats_storage)
+        metrics.token_events.labels('OpenAI', 'rotate').inc()
+        await metrics.start_server('0.0.0.0', 9100)
+    ```
+    """
+    PREFIX = 'phd_bot_'
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._runner: Optional[web.AppRunner] = None
+        if not enabled:
+            self.registry = None
+            self.handler_latency = self.provider_request_latency = self.token_events = _NOOP_METRIC
+            self.redis_latency = self.ai_requests_in_flight = self.ai_requests_queued = _NOOP_METRIC
+            self.cron_task_duration = self.ai_triggers = _NOOP_METRIC
+            return
+
+        import prometheus_client as prometheus
+
+        self._prometheus = prometheus
+        self.registry = prometheus.CollectorRegistry()
+        prometheus.ProcessCollector(registry=self.registry)
+        prometheus.GCCollector(registry=self.registry)
+
+        self.handler_latency = prometheus.Histogram(
+            f'{self.PREFIX}handler_seconds', 'Latency of update handlers.', ['handler'], registry=self.registry,
+        )
+        self.provider_request_latency = prometheus.Histogram(
+            f'{self.PREFIX}provider_request_seconds',
+            'Latency of AI provider requests (status is empty on connection errors).',
+            ['provider', 'status'],
+            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120),
+            registry=self.registry,
+        )
+        self.token_events = prometheus.Counter(
+            f'{self.PREFIX}token_events', 'Rotations, removals and cool downs of provider tokens.',
+            ['provider', 'event'], registry=self.registry,
+        )
+        self.redis_latency = prometheus.Histogram(
+            f'{self.PREFIX}redis_seconds', 'Latency of Redis calls of storages.', ['storage', 'method'],
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+            registry=self.registry,
+        )
+        self.ai_requests_in_flight = prometheus.Gauge(
+            f'{self.PREFIX}ai_requests_in_flight', 'AI requests being made.', ['provider'], registry=self.registry,
+        )
+        self.ai_requests_queued = prometheus.Gauge(
+            f'{self.PREFIX}ai_requests_queued', 'AI requests waiting for admission.', ['provider'],
+            registry=self.registry,
+        )
+        self.cron_task_duration = prometheus.Histogram(
+            f'{self.PREFIX}cron_task_seconds', 'Duration of cron task runs.', ['task'],
+            buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200), registry=self.registry,
+        )
+        self.ai_triggers = prometheus.Counter(
+            f'{self.PREFIX}ai_triggers', 'Messages that triggered an AI answer by the trigger.', ['trigger'],
+            registry=self.registry,
+        )
+
+    @contextmanager
+    def timer(self, metric) -> Iterator[None]:
+        """To observe the duration of the block (with labels already applied)."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            metric.observe(time.perf_counter() - started_at)
+
+    def timed_handler(self, name: str) -> Callable:
+        def decorator(func):
+            if not self.enabled:
+                return func
+            metric = self.handler_latency.labels(name)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(metric):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument_storage(self, storage: Any, exclude: tuple[str, ...] = ('listen_invalidations',)) -> Any:
+        """Public coroutine methods of the storage instance are timed (label is the class and the method name)."""
+        if not self.enabled:
+            return storage
+        storage_name = storage.__class__.__name__
+        for name, method in inspect.getmembers(storage, inspect.iscoroutinefunction):
+            if name.startswith('_') or name in exclude:
+                continue
+            setattr(storage, name, self._timed_method(method, self.redis_latency.labels(storage_name, name)))
+        return storage
+
+    def _timed_method(self, method: Callable, metric) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            with self.timer(metric):
+                return await method(*args, **kwargs)
+        return wrapper
+
+    def observe_admission_controller(self, admission_controller):
+        """Read on scrape, not on every request."""
+        self.ai_requests_in_flight.labels(admission_controller.name).set_function(
+            lambda: admission_controller.in_flight,
+        )
+        self.ai_requests_queued.labels(admission_controller.name).set_function(
+            lambda: admission_controller.queue_size,
+        )
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self._prometheus.generate_latest(self.registry),
+            headers={'Content-Type': self._prometheus.CONTENT_TYPE_LATEST},
+        )
+
+    async def start_server(self, host: str, port: int):
+        if not self.enabled:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info('[Metrics] Serve metrics on %s:%s/metrics...', host, port)
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucketRateLimiter:
+    """Token bucket: `rate` acquisitions per second on average with bursts up to `capacity`.
+
+    Each `acquire` reserves a token immediately (the bucket may go into debt) and then sleeps until
+    the reserved token is due, thus there is no await between reading and updating the state and
+    no lock is needed in asyncio.
+
+    # Use-case
+    ```
+        limiter = TokenBucketRateLimiter(rate=30)
+        for chat_id in chat_ids:
+            await limiter.acquire()
+            await bot.send_message(chat_id, 'hi')
+    ```
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: tokens per second.
+        :param capacity: max burst, by default equals to rate (i.e. 1 second of tokens).
+        """
+        assert rate > 0, 'Rate should be positive.'
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _reserve(self) -> float:
+        """Take 1 token and return seconds to wait for it."""
+        now = time.monotonic()
+        if self._paused_until > now:
+            # Tokens are not refilled while paused.
+            self._updated_at = max(self._updated_at, self._paused_until)
+        else:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+        self._tokens -= 1
+        delay = max(self._updated_at - now, 0.0)
+        if self._tokens < 0:
+            delay += -self._tokens / self.rate
+        return delay
+
+    async def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Block all acquisitions for seconds (e.g. on flood wait from the API)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = min(self._tokens, 0.0)
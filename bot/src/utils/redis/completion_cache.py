@@ -0,0 +1,141 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from utils.singleflight import make_request_key
+from utils.ttl_cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    """Strings are case folded with collapsed whitespaces, thus "What is a PhD?" == " what is a  PhD? "."""
+    if isinstance(value, str):
+        return ' '.join(value.casefold().split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+@dataclass
+class CompletionCacheStats:
+    memory_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+    stale: int = 0  # Found, but older than max_age of the request (counted as misses as well).
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.memory_hits + self.redis_hits + self.misses
+        return (self.memory_hits + self.redis_hits) / requests if requests else 0.0
+
+
+class CompletionCache:
+    """Completions (json serializable values) by normalized request (provider, method, model, goal, messages).
+    2 tiers: in process LRU and Redis, both expire after ttl, Redis tier is bounded by max_size
+    (the oldest values are evicted, see index sorted set by creation time).
+    Values are never changed for a key, thus no invalidation between processes is needed.
+    Redis errors are logged and treated as misses, since the cache is optional.
+
+    # Use-case
+    ```
+        cache = CompletionCache(bot_id, redis, ttl=24 * 60 * 60, max_size=10000)
+        key = cache.get_key('OpenAIClient', 'chat/completions', data)
+        text = await cache.get(key, max_age=60 * 60)
+        if text is None:
+            text = await make_request(data)
+            await cache.set(key, text)
+    ```
+    """
+
+    def __init__(
+            self,
+            bot_id: int,
+            redis_engine: Redis,
+            ttl: float = 24 * 60 * 60,
+            max_size: int = 10000,
+            memory_max_size: int = 1000,
+    ):
+        self.bot_id = bot_id
+        self.redis_engine = redis_engine
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = CompletionCacheStats()
+        # Key to (created_at, value).
+        self._memory_cache = LRUTTLCache(maxsize=memory_max_size, ttl=ttl)
+
+    def _get_redis_key(self, key: str) -> str:
+        return f'{self.bot_id}:{self.__class__.__name__}:{key}'
+
+    def _get_key_index(self) -> str:
+        """ZSET of keys by creation time, to evict the oldest over max_size."""
+        return f'{self.bot_id}:{self.__class__.__name__}Index'
+
+    @staticmethod
+    def get_key(*parts: Any) -> str:
+        return make_request_key(*_normalize(parts))
+
+    def _is_fresh(self, created_at: float, max_age: Optional[float]) -> bool:
+        age = time.time() - created_at
+        return age <= self.ttl and (max_age is None or age <= max_age)
+
+    async def get(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """:param max_age: seconds, to skip values older than that (e.g. answers based on web search)."""
+        item = self._memory_cache.get(key)
+        is_memory_hit = item is not LRUTTLCache.MISSING
+        if not is_memory_hit:
+            try:
+                raw_item = await self.redis_engine.get(self._get_redis_key(key))
+            except RedisError as e:
+                logger.warning('[%s] Could not get %s, got %s...', self.__class__.__name__, key, e)
+                raw_item = None
+            if raw_item is None:
+                self.stats.misses += 1
+                return None
+            item = json.loads(raw_item)
+            item = (item['t'], item['v'])
+            self._memory_cache.set(key, item)
+
+        created_at, value = item
+        if not self._is_fresh(created_at, max_age):
+            self.stats.stale += 1
+            self.stats.misses += 1
+            return None
+
+        if is_memory_hit:
+            self.stats.memory_hits += 1
+        else:
+            self.stats.redis_hits += 1
+        return value
+
+    async def set(self, key: str, value: Any):
+        created_at = time.time()
+        self._memory_cache.set(key, (created_at, value))
+        try:
+            async with self.redis_engine.pipeline(transaction=True) as pipe:
+                pipe = pipe.set(self._get_redis_key(key), json.dumps({'t': created_at, 'v': value}), ex=int(self.ttl))
+                pipe = pipe.zadd(self._get_key_index(), {key: created_at})
+                pipe = pipe.zremrangebyscore(self._get_key_index(), '-inf', created_at - self.ttl)
+                pipe = pipe.zcard(self._get_key_index())
+                *_, size = await pipe.execute()
+
+            if size > self.max_size:
+                evicted = await self.redis_engine.zpopmin(self._get_key_index(), size - self.max_size)
+                if evicted:
+                    await self.redis_engine.delete(*[self._get_redis_key(evicted_key) for evicted_key, _ in evicted])
+        except RedisError as e:
+            logger.warning('[%s] Could not set %s, got %s...', self.__class__.__name__, key, e)
+
+    def to_text(self) -> str:
+        return (
+            f'memory hits: {self.stats.memory_hits}, redis hits: {self.stats.redis_hits}, '
+            f'misses: {self.stats.misses} (stale: {self.stats.stale}), hit rate: {self.stats.hit_rate:.0%}, '
+            f'in memory: {len(self._memory_cache)}'
+        )
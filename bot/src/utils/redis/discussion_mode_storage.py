@@ -1,49 +1,154 @@
-from typing import Optional
+import json
+from typing import Optional, Union
 from redis.asyncio import Redis
 from bot.consts import AIDiscussionMode
+from utils.redis.event_channel import RedisEventChannel
+from utils.ttl_cache import LRUTTLCache
 
 
 class BotChatAIDiscussionModeStorage:
-    def __init__(self, bot_id: int, redis_engine: Redis):
+    """Modes are read on every message, thus raw values are cached in process (keyed by Redis key).
+    Setters write through the cache and notify other processes to invalidate their caches,
+    run `listen_invalidations` as a task for that.
+    Values read before an invalidation (but cached after it) could be stale, thus they are not cached:
+    invalidations bump the generation, pass the one got before the read to `cache_raw`.
+    """
+
+    def __init__(self, bot_id: int, redis_engine: Redis, cache_ttl: float = 60, cache_maxsize: int = 10000):
         self.bot_id = bot_id
         self.redis_engine = redis_engine
+        self._cache = LRUTTLCache(maxsize=cache_maxsize, ttl=cache_ttl)
+        # Bumped on every invalidation (of any key, thus it is bounded, an unrelated one only skips caching once).
+        self._generation = 0
+        self._invalidation_channel = RedisEventChannel(
+            redis_engine, f'{self.bot_id}:{self.__class__.__name__}:invalidate',
+        )
 
     def _get_key_discussion_mode(self, chat_id: int) -> str:
         return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:discussion_mode'
-    
+
     def _get_key_discussion_mode_by_contributor(self, chat_id: int, user_id: int) -> str:
         return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:{user_id}:discussion_mode'
-    
+
     def _get_key_is_mention_only_mode(self, chat_id: int) -> str:
         return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:is_mention_only_mode'
-    
+
     def _get_key_is_mention_only_mode_by_contributor(self, chat_id: int, user_id: int) -> str:
         return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:{user_id}:is_mention_only_mode'
-    
+
+    def get_key_is_completion_cache_disabled(self, chat_id: int) -> str:
+        """To fetch it outside (e.g. in 1 MGET with `get_keys`) and pass the value to `cache_raw`."""
+        return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:is_completion_cache_disabled'
+
+    def get_key_trigger_keywords(self, chat_id: int) -> str:
+        """To fetch it outside (e.g. in 1 MGET with `get_keys`) and pass the value to `cache_raw`."""
+        return f'{self.bot_id}:{self.__class__.__name__}:{chat_id}:trigger_keywords'
+
+    def get_keys(self, chat_id: int, user_id: Optional[int] = None) -> list[str]:
+        """Keys of discussion mode and mention only mode of the chat (and of the contributor in the chat if user_id).
+        To fetch them outside (e.g. in 1 MGET with other keys) and pass values to `cache_raw`.
+        """
+        keys = [self._get_key_discussion_mode(chat_id), self._get_key_is_mention_only_mode(chat_id)]
+        if user_id is not None:
+            keys += [
+                self._get_key_discussion_mode_by_contributor(chat_id, user_id),
+                self._get_key_is_mention_only_mode_by_contributor(chat_id, user_id),
+            ]
+        return keys
+
+    def get_cached_raw(self, key: str):
+        """:return: raw value or LRUTTLCache.MISSING."""
+        return self._cache.get(key)
+
+    def get_generation(self) -> int:
+        """To get before fetching values outside and pass to `cache_raw`."""
+        return self._generation
+
+    def cache_raw(self, key: str, value: Optional[str], generation: int):
+        """To cache a raw value fetched outside (e.g. in 1 MGET with other keys).
+        :param generation: got before the fetch, the value is not cached if an invalidation happened since.
+        """
+        if generation != self._generation:
+            return
+        self._cache.set(key, value)
+
+    @staticmethod
+    def to_discussion_mode(value: Optional[str]) -> Optional[AIDiscussionMode]:
+        return AIDiscussionMode(int(value)) if value else None
+
+    @staticmethod
+    def to_is_mention_only_mode(value: Optional[str]) -> bool:
+        return bool(int(value)) if value is not None else False
+
+    @staticmethod
+    def to_is_completion_cache_disabled(value: Optional[str]) -> bool:
+        return bool(int(value)) if value is not None else False
+
+    @staticmethod
+    def to_trigger_keywords(value: Optional[str]) -> tuple[str, ...]:
+        return tuple(json.loads(value)) if value else ()
+
+    async def _get(self, key: str) -> Optional[str]:
+        value = self.get_cached_raw(key)
+        if value is LRUTTLCache.MISSING:
+            generation = self.get_generation()
+            value = await self.redis_engine.get(key)
+            self.cache_raw(key, value, generation)
+        return value
+
+    async def _set(self, key: str, value: Union[int, str]):
+        await self.redis_engine.set(key, value)
+        # Reads in flight could have got the previous value.
+        self._generation += 1
+        self._cache.set(key, str(value))
+        await self._invalidation_channel.publish({'key': key})
+
+    def _on_invalidation_event(self, event: dict):
+        self._generation += 1
+        self._cache.invalidate(event['key'])
+
+    async def listen_invalidations(self):
+        """Long living loop to drop values changed by other processes from the cache."""
+        await self._invalidation_channel.listen(self._on_invalidation_event)
+
     async def set_discussion_mode(self, chat_id: int, discussion_mode: AIDiscussionMode):
-        await self.redis_engine.set(self._get_key_discussion_mode(chat_id), discussion_mode.value)
+        await self._set(self._get_key_discussion_mode(chat_id), discussion_mode.value)
 
     async def get_discussion_mode(self, chat_id: int) -> Optional[AIDiscussionMode]:
-        value = await self.redis_engine.get(self._get_key_discussion_mode(chat_id))
-        return AIDiscussionMode(int(value)) if value else None
+        value = await self._get(self._get_key_discussion_mode(chat_id))
+        return self.to_discussion_mode(value)
 
     async def set_discussion_mode_by_contributor(self, chat_id: int, user_id: int, discussion_mode: AIDiscussionMode):
-        await self.redis_engine.set(self._get_key_discussion_mode_by_contributor(chat_id, user_id), discussion_mode.value)
+        await self._set(self._get_key_discussion_mode_by_contributor(chat_id, user_id), discussion_mode.value)
 
     async def get_discussion_mode_by_contributor(self, chat_id: int, user_id: int) -> Optional[AIDiscussionMode]:
-        value = await self.redis_engine.get(self._get_key_discussion_mode_by_contributor(chat_id, user_id))
-        return AIDiscussionMode(int(value)) if value else None
-    
+        value = await self._get(self._get_key_discussion_mode_by_contributor(chat_id, user_id))
+        return self.to_discussion_mode(value)
+
     async def set_is_mention_only_mode(self, chat_id: int, is_mention_only_mode: bool):
-        await self.redis_engine.set(self._get_key_is_mention_only_mode(chat_id), int(is_mention_only_mode))
+        await self._set(self._get_key_is_mention_only_mode(chat_id), int(is_mention_only_mode))
 
     async def get_is_mention_only_mode_by_contributor(self, chat_id: int, user_id: int) -> bool:
-        value = await self.redis_engine.get(self._get_key_is_mention_only_mode_by_contributor(chat_id, user_id))
-        return bool(int(value)) if value is not None else False
-    
+        value = await self._get(self._get_key_is_mention_only_mode_by_contributor(chat_id, user_id))
+        return self.to_is_mention_only_mode(value)
+
     async def get_is_mention_only_mode(self, chat_id: int) -> bool:
-        value = await self.redis_engine.get(self._get_key_is_mention_only_mode(chat_id))
-        return bool(int(value)) if value is not None else False
-    
+        value = await self._get(self._get_key_is_mention_only_mode(chat_id))
+        return self.to_is_mention_only_mode(value)
+
     async def set_is_mention_only_mode_by_contributor(self, chat_id: int, user_id: int, is_mention_only_mode: bool):
-        await self.redis_engine.set(self._get_key_is_mention_only_mode_by_contributor(chat_id, user_id), int(is_mention_only_mode))
\ No newline at end of file
+        await self._set(self._get_key_is_mention_only_mode_by_contributor(chat_id, user_id), int(is_mention_only_mode))
+
+    async def set_is_completion_cache_disabled(self, chat_id: int, is_completion_cache_disabled: bool):
+        await self._set(self.get_key_is_completion_cache_disabled(chat_id), int(is_completion_cache_disabled))
+
+    async def get_is_completion_cache_disabled(self, chat_id: int) -> bool:
+        value = await self._get(self.get_key_is_completion_cache_disabled(chat_id))
+        return self.to_is_completion_cache_disabled(value)
+
+    async def set_trigger_keywords(self, chat_id: int, keywords: list[str]):
+        await self._set(self.get_key_trigger_keywords(chat_id), json.dumps(keywords, ensure_ascii=False))
+
+    async def get_trigger_keywords(self, chat_id: int) -> tuple[str, ...]:
+        value = await self._get(self.get_key_trigger_keywords(chat_id))
+        return self.to_trigger_keywords(value)
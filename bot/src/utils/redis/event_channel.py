@@ -0,0 +1,62 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class RedisEventChannel:
+    """Broadcasts events (json serializable dicts) between bot processes via Redis pub/sub.
+    Events published by the same instance are not delivered back to it.
+
+    Note, pub/sub is fire-and-forget: events sent while a listener is reconnecting are lost,
+    thus state synced with it should also expire (e.g. caches with ttl).
+
+    # Use-case
+    ```
+        channel = RedisEventChannel(redis, 'SomeStorage:invalidate')
+        asyncio.create_task(channel.listen(lambda event: cache.invalidate(event['key'])))
+        await channel.publish({'key': 'foo'})
+    ```
+    """
+    RECONNECT_DELAY = 5  # Seconds.
+
+    def __init__(self, redis_engine: Redis, channel: str):
+        self.redis_engine = redis_engine
+        self.channel = channel
+        self.instance_id = uuid.uuid4().hex
+
+    async def publish(self, event: dict):
+        try:
+            await self.redis_engine.publish(self.channel, json.dumps({'from': self.instance_id, 'event': event}))
+        except Exception as e:
+            logger.warning('[RedisEventChannel] Could not publish to %s: %s. Pass it...', self.channel, e)
+
+    async def listen(self, handler: Callable[[dict], None]):
+        """Long living loop (run it as a task) that calls handler for each event from other instances."""
+        while True:
+            pubsub = self.redis_engine.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                logger.info('[RedisEventChannel] Listen to %s...', self.channel)
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    data = json.loads(message['data'])
+                    if data.get('from') == self.instance_id:
+                        continue
+                    try:
+                        handler(data['event'])
+                    except Exception as e:
+                        logger.exception('[RedisEventChannel] Could not handle event %s: %s', data, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('[RedisEventChannel] Listening to %s failed: %s. Reconnect...', self.channel, e)
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                await pubsub.reset()
@@ -1,3 +1,5 @@
+from typing import Optional, Union
+
 from redis.asyncio import Redis
 
 
@@ -50,3 +52,66 @@ async def get_first_n_keys(
         if len(chat_keys_loaded) >= first_n:
             return chat_keys_loaded[:first_n]
     return chat_keys_loaded
+
+
+class RedisSetScanAsyncIterator:
+    """Iterates over members of 1 Redis SET with SSCAN (batches as lists).
+    E.g.
+    ```python
+    async for members in RedisSetScanAsyncIterator(redis, "someSetKey"):
+        print(f'{members = }')
+    ```
+    """
+
+    def __init__(self, redis: Redis, key: str, count: Optional[int] = None):
+        self.redis = redis
+        self.key = key
+        self.count = count
+        self._cursor = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> list[str]:
+        while self._cursor != 0:
+            new_cursor, members = await self.redis.sscan(
+                self.key, cursor=self._cursor or 0, count=self.count)
+            self._cursor = new_cursor
+            if members:
+                return members
+        raise StopAsyncIteration
+
+
+class RedisSortedSetByScoreAsyncIterator:
+    """Iterates over members of 1 Redis ZSET with score in [min_score, max_score]
+    via paginated ZRANGEBYSCORE (batches as lists).
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            key: str,
+            min_score: Union[float, str] = '-inf',
+            max_score: Union[float, str] = '+inf',
+            count: int = 100,
+    ):
+        self.redis = redis
+        self.key = key
+        self.min_score = min_score
+        self.max_score = max_score
+        self.count = count
+        self._offset = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> list[str]:
+        if self._offset is None:
+            raise StopAsyncIteration
+
+        members = await self.redis.zrangebyscore(
+            self.key, self.min_score, self.max_score, start=self._offset, num=self.count)
+        self._offset = self._offset + self.count if len(members) == self.count else None
+        if not members:
+            raise StopAsyncIteration
+        return members
@@ -2,14 +2,18 @@
 import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from redis.asyncio import Redis
 
 from utils.crypto import Crypto
 from utils.generators import batch
-from utils.redis.redis_scan_iterator import RedisScanIterAsyncIterator
+from utils.redis.event_channel import RedisEventChannel
+from utils.redis.redis_scan_iterator import (
+    RedisScanIterAsyncIterator, RedisSetScanAsyncIterator, RedisSortedSetByScoreAsyncIterator,
+)
 from utils.time import now_utc
+from utils.ttl_cache import LRUTTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +26,15 @@ class BotChatsStorageABC(ABC):
         self.redis_engine = redis_engine
 
     @abstractmethod
-    async def get_all_chats_iterator(self) -> RedisScanIterAsyncIterator:
+    async def get_all_chats_iterator(self) -> AsyncIterator[list[str]]:
+        """Iterator over batches of chat index members (see to_chat_id_from_index_member)."""
+        pass
+
+    @abstractmethod
+    async def backfill_index(self) -> int:
+        """One-off filling of the chat index from already stored keys (via full keyspace SCAN).
+        :return: number of indexed members.
+        """
         pass
 
     @classmethod
@@ -33,6 +45,14 @@ class BotChatsStorageABC(ABC):
             logger.warning(f'[{cls.__name__}.to_chat_id_from_key] Error: %s', e)
             return
 
+    @classmethod
+    def to_chat_id_from_index_member(cls, member: str) -> Optional[int]:
+        try:
+            return int(member)
+        except Exception as e:
+            logger.warning(f'[{cls.__name__}.to_chat_id_from_index_member] Error: %s', e)
+            return
+
 
 class BotChatsStorage(BotChatsStorageABC):
     """To store all chats ever used by the bot."""
@@ -50,15 +70,35 @@ class BotChatsStorage(BotChatsStorageABC):
     def _get_key(self, chat_id: int) -> str:
         return self._get_storage_prefix() + str(chat_id)
 
+    def _get_key_index(self) -> str:
+        """SET of all chat ids (out of the storage prefix)."""
+        return f'{self.bot_id}:BChatsSIndex'
+
     async def set_chat(self, chat_id: int):
-        return await self.redis_engine.set(self._get_key(chat_id), chat_id)
+        async with self.redis_engine.pipeline(transaction=True) as pipe:
+            pipe = pipe.set(self._get_key(chat_id), chat_id)
+            pipe = pipe.sadd(self._get_key_index(), chat_id)
+            return (await pipe.execute())[0]
 
     async def rm_chat(self, chat_id: int):
-        await self.redis_engine.delete(self._get_key(chat_id))
+        async with self.redis_engine.pipeline(transaction=True) as pipe:
+            pipe = pipe.delete(self._get_key(chat_id))
+            pipe = pipe.srem(self._get_key_index(), chat_id)
+            await pipe.execute()
 
     async def get_all_chats_iterator(self):
-        return RedisScanIterAsyncIterator(
-            redis=self.redis_engine, match=self._get_storage_prefix() + '*')
+        return RedisSetScanAsyncIterator(redis=self.redis_engine, key=self._get_key_index())
+
+    async def backfill_index(self) -> int:
+        indexed = 0
+        async for chat_keys in RedisScanIterAsyncIterator(
+                redis=self.redis_engine, match=self._get_storage_prefix() + '*'):
+            chat_ids = [chat_id for chat_id in map(self.to_chat_id_from_key, chat_keys) if chat_id is not None]
+            if chat_ids:
+                await self.redis_engine.sadd(self._get_key_index(), *chat_ids)
+                indexed += len(chat_ids)
+        logger.info(f'[{self.__class__.__name__}] Backfilled index with {indexed} chats.')
+        return indexed
 
 
 class BotChatMessagesCache(BotChatsStorageABC):
@@ -66,8 +106,46 @@ class BotChatMessagesCache(BotChatsStorageABC):
     # Scheme:
     message_id|{text,userId}|replay_to -> message_id|{text,userId}|replay_to -> ...
     message_id = chat_id + real_message-id.
+
+    Each message is stored as 1 hash record: {prefix}{chat_id}:{message_id} -> {t: text, s: sender, r: replay_to}.
+    Legacy records (3 string keys per message: `:message`, `:sender`, `:replay_to`) are still readable
+    and could be converted with `migrate_legacy_messages`.
     """
-    TTL_NOT_EXIST_CONSTS = [-1, -2]
+    # Short field names since small hashes are stored compactly by Redis.
+    FIELD_TEXT = 't'
+    FIELD_SENDER = 's'
+    FIELD_REPLAY_TO = 'r'
+    _LEGACY_SUFFIXES = (':message', ':sender', ':replay_to')
+
+    # Walks the reply chain on Redis side, thus the whole dialog context is fetched in 1 round-trip.
+    # Note, keys are composed inside the script, thus it is not compatible with Redis Cluster.
+    # KEYS[1] - chat storage prefix, ARGV[1] - message id to start from, ARGV[2] - depth.
+    # Returns flat list: [text, sender, replay_to, text, sender, replay_to, ...] from the last message to the first.
+    _GET_DIALOG_CHAIN_LUA = """
+local prefix = KEYS[1]
+local message_id = ARGV[1]
+local depth = tonumber(ARGV[2])
+local result = {}
+while message_id and message_id ~= '' and depth > 0 do
+    local record = redis.call('HMGET', prefix .. message_id, 't', 's', 'r')
+    if not record[1] then
+        record = {
+            redis.call('GET', prefix .. message_id .. ':message'),
+            redis.call('GET', prefix .. message_id .. ':sender'),
+            redis.call('GET', prefix .. message_id .. ':replay_to'),
+        }
+    end
+    if not record[1] then
+        break
+    end
+    table.insert(result, record[1])
+    table.insert(result, record[2] or '')
+    table.insert(result, record[3] or '')
+    message_id = record[3]
+    depth = depth - 1
+end
+return result
+"""
 
     @dataclass
     class MessageData:
@@ -83,6 +161,7 @@ class BotChatMessagesCache(BotChatsStorageABC):
     ):
         super().__init__(bot_id, redis_engine)
         self.ttl = ttl
+        self._get_dialog_chain_script = self.redis_engine.register_script(self._GET_DIALOG_CHAIN_LUA)
 
     def _get_storage_prefix(self):
         return f'{self.bot_id}:BCMC:'
@@ -90,73 +169,128 @@ class BotChatMessagesCache(BotChatsStorageABC):
     def _get_chat_storage_prefix(self, chat_id: int):
         return f'{self._get_storage_prefix()}{chat_id}:'
 
-    def _get_key_text(self, chat_id: int, message_id: int) -> str:
-        return self._get_chat_storage_prefix(chat_id) + f'{message_id}:message'
-
-    def _get_key_replay_to(self, chat_id: int, message_id: int) -> str:
-        return self._get_chat_storage_prefix(chat_id) + f'{message_id}:replay_to'
+    def _get_key_message(self, chat_id: int, message_id: int) -> str:
+        return self._get_chat_storage_prefix(chat_id) + f'{message_id}'
 
     def _get_key_updated_chat_ttl(self, chat_id: int) -> str:
+        """Deprecated: legacy per chat activity key, replaced with the index. Used only to backfill the index."""
         return self._get_chat_storage_prefix(chat_id) + f'{chat_id}:updated_chat_ttl'
 
-    def _get_key_sender(self, chat_id: int, message_id: int) -> str:
-        return self._get_chat_storage_prefix(chat_id) + f'{message_id}:sender'
+    def _get_key_index(self) -> str:
+        """ZSET of active chat ids scored by timestamp when cached messages of the chat expire."""
+        return f'{self.bot_id}:BCMCIndex'
 
-    # TODO: could be optimised: use json.dumps for messages.
     async def set_messages(self, chat_ids: list[int], message_ids: list[int], messages: list[MessageData]):
         async with self.redis_engine.pipeline(transaction=True) as pipe:
             now = now_utc().timestamp()
             for chat_id, message_id, message in zip(chat_ids, message_ids, messages):
-                pipe = pipe.set(self._get_key_text(chat_id, message_id), message.text, self.ttl)
-                pipe = pipe.set(self._get_key_sender(chat_id, message_id), message.sender, self.ttl)
-                pipe = pipe.set(self._get_key_updated_chat_ttl(chat_id), f'{now + self.ttl}', self.ttl)
+                key = self._get_key_message(chat_id, message_id)
+                record = {self.FIELD_TEXT: message.text, self.FIELD_SENDER: message.sender}
                 if message.replay_to is not None:
-                    pipe = pipe.set(self._get_key_replay_to(chat_id, message_id), message.replay_to)
+                    record[self.FIELD_REPLAY_TO] = message.replay_to
+                pipe = pipe.hset(key, mapping=record)
+                pipe = pipe.expire(key, self.ttl)
+                pipe = pipe.zadd(self._get_key_index(), {chat_id: now + self.ttl})
+            # Drop chats that are not active anymore.
+            pipe = pipe.zremrangebyscore(self._get_key_index(), '-inf', now)
             return await pipe.execute()
 
+    @classmethod
+    def _to_message_data(cls, text: str, sender: str, replay_to: str) -> MessageData:
+        return cls.MessageData(replay_to=int(replay_to) if replay_to else None, text=text, sender=sender)
+
+    async def get_dialog_chain(self, chat_id: int, message_id: int, depth: int) -> list[MessageData]:
+        """Fetch up to depth messages following replay_to links starting from message_id (in 1 round-trip).
+        :return: messages from message_id to the oldest one.
+        """
+        flat_records = await self._get_dialog_chain_script(
+            keys=[self._get_chat_storage_prefix(chat_id)], args=[message_id, depth],
+        )
+        logger.debug(f'[BotChatMessagesCache] Fetched dialog chain {flat_records}')
+        return [self._to_message_data(*record) for record in batch(flat_records, 3)]
+
     async def get_message(self, chat_id, message_id: int) -> Optional[MessageData]:
         logger.info(f'[BotChatMessagesCache] Getting message for {chat_id = }, {message_id = }...')
-        async with self.redis_engine.pipeline(transaction=True) as pipe:
-            pipe = pipe.get(self._get_key_text(chat_id, message_id))
-            pipe = pipe.get(self._get_key_sender(chat_id, message_id))
-            pipe = pipe.get(self._get_key_replay_to(chat_id, message_id))
-            executedPipe = await pipe.execute()
-
-        logger.debug(f'Executed pipe, got {executedPipe}')
-        if len(executedPipe) == 0:
-            return None
-        text = executedPipe.pop(0)
-        sender = executedPipe.pop(0)
-        replay_to = executedPipe.pop(0) if executedPipe else None
-        return BotChatMessagesCache.MessageData(replay_to=replay_to, text=text, sender=sender)
+        messages = await self.get_dialog_chain(chat_id, message_id, 1)
+        return messages[0] if messages else None
 
     async def get_text(self, chat_id: int, message_id: int) -> Optional[str]:
-        return await self.redis_engine.get(self._get_key_text(chat_id, message_id))
+        return await self.redis_engine.hget(self._get_key_message(chat_id, message_id), self.FIELD_TEXT)
 
     async def get_replay_to(self, chat_id: int, message_id: int) -> Optional[int]:
-        res = await self.redis_engine.get(self._get_key_replay_to(chat_id, message_id))
+        res = await self.redis_engine.hget(self._get_key_message(chat_id, message_id), self.FIELD_REPLAY_TO)
         return int(res) if res else None
 
-    async def get_all_chats_iterator(self):
-        """Fetch all cached chats (cached in terms of ttl of the class).
-        It goes through _get_key_updated_chat_ttl keys patters as via keys should be used to store only cached chats.
-        TODO: check that ttl for the keys is not in [-1, -2] E.g. Redis rm ttl on restart.
-         Thus, there should be service task somewhere.
+    async def migrate_legacy_messages(self) -> int:
+        """One-off conversion of legacy records into hash records (with the rest of their ttl).
+        It also deletes legacy orphan `:replay_to`/`:sender` keys (e.g. `:replay_to` used to be stored without ttl).
+        :return: number of converted messages.
         """
-        return RedisScanIterAsyncIterator(
-            redis=self.redis_engine, match=self._get_storage_prefix() + '*:updated_chat_ttl')
+        migrated = 0
+        legacy_text_suffix, legacy_sender_suffix, legacy_replay_to_suffix = self._LEGACY_SUFFIXES
+        async for text_keys in RedisScanIterAsyncIterator(
+                redis=self.redis_engine, match=self._get_storage_prefix() + '*' + legacy_text_suffix):
+            async with self.redis_engine.pipeline(transaction=False) as pipe:
+                for text_key in text_keys:
+                    key = text_key[:-len(legacy_text_suffix)]
+                    pipe = pipe.get(text_key)
+                    pipe = pipe.get(key + legacy_sender_suffix)
+                    pipe = pipe.get(key + legacy_replay_to_suffix)
+                    pipe = pipe.ttl(text_key)
+                legacy_records = await pipe.execute()
+
+            async with self.redis_engine.pipeline(transaction=False) as pipe:
+                for text_key, (text, sender, replay_to, ttl) in zip(text_keys, batch(legacy_records, 4)):
+                    key = text_key[:-len(legacy_text_suffix)]
+                    if text is not None:
+                        record = {self.FIELD_TEXT: text, self.FIELD_SENDER: sender or ''}
+                        if replay_to:
+                            record[self.FIELD_REPLAY_TO] = replay_to
+                        pipe = pipe.hset(key, mapping=record)
+                        pipe = pipe.expire(key, ttl if ttl > 0 else self.ttl)
+                        migrated += 1
+                    pipe = pipe.delete(*[key + suffix for suffix in self._LEGACY_SUFFIXES])
+                await pipe.execute()
+
+        for orphan_suffix in (legacy_sender_suffix, legacy_replay_to_suffix):
+            async for orphan_keys in RedisScanIterAsyncIterator(
+                    redis=self.redis_engine, match=self._get_storage_prefix() + '*' + orphan_suffix):
+                await self.redis_engine.delete(*orphan_keys)
+
+        logger.info(f'[BotChatMessagesCache] Migrated {migrated} legacy messages.')
+        return migrated
+
+    async def get_all_chats_iterator(self):
+        """Fetch all cached chats (cached in terms of ttl of the class) from the activity index."""
+        return RedisSortedSetByScoreAsyncIterator(
+            redis=self.redis_engine, key=self._get_key_index(), min_score=f'({now_utc().timestamp()}')
+
+    async def backfill_index(self) -> int:
+        indexed = 0
+        async for chat_ttl_keys in RedisScanIterAsyncIterator(
+                redis=self.redis_engine, match=self._get_storage_prefix() + '*:updated_chat_ttl'):
+            chat_ttl_ends = await self.redis_engine.mget(chat_ttl_keys)
+            chat_id_to_ttl_end = {
+                chat_id: float(chat_ttl_end)
+                for chat_id, chat_ttl_end in zip(map(self.to_chat_id_from_key, chat_ttl_keys), chat_ttl_ends)
+                if chat_id is not None and chat_ttl_end
+            }
+            if chat_id_to_ttl_end:
+                async with self.redis_engine.pipeline(transaction=True) as pipe:
+                    pipe = pipe.zadd(self._get_key_index(), chat_id_to_ttl_end)
+                    pipe = pipe.delete(*chat_ttl_keys)
+                    await pipe.execute()
+                indexed += len(chat_id_to_ttl_end)
+        logger.info(f'[{self.__class__.__name__}] Backfilled index with {indexed} chats.')
+        return indexed
 
     async def has_any_cached_messages(self, chat_ids: list[int]) -> list[bool]:
-        async with self.redis_engine.pipeline(transaction=True) as pipe:
+        now = now_utc().timestamp()
+        async with self.redis_engine.pipeline(transaction=False) as pipe:
             for chat_id in chat_ids:
-                _key = self._get_key_updated_chat_ttl(chat_id)
-                pipe = pipe.get(_key)
-                pipe = pipe.ttl(_key)
+                pipe = pipe.zscore(self._get_key_index(), chat_id)
             executed_pipe = await pipe.execute()
-            return [
-                bool(chat_ttl_end and ttl_response not in self.TTL_NOT_EXIST_CONSTS)
-                for chat_ttl_end, ttl_response in batch(executed_pipe, 2)
-            ]
+            return [bool(chat_ttl_end and chat_ttl_end > now) for chat_ttl_end in executed_pipe]
 
 
 class BotAIContributorChatStorage(BotChatsStorageABC):
@@ -165,6 +299,9 @@ class BotAIContributorChatStorage(BotChatsStorageABC):
     - get all saved tokens as well with mask of the storage.
 
     Note, it stores ciphered tokens.
+    Deciphered tokens are cached in process per (user, chat), including absence of tokens (the most common case).
+    Setters and deleters invalidate the cache and notify other processes, run `listen_invalidations` as a task for that.
+    Tokens read before an invalidation are not cached (see `get_generation`).
     """
     CHAT_ID_POSITION_IN_KEY = -2
 
@@ -173,54 +310,159 @@ class BotAIContributorChatStorage(BotChatsStorageABC):
         openai_token: Optional[str]
         perplexity_token: Optional[str]
 
-    def __init__(self, bot_id: int, redis_engine: Redis, crypto: Crypto, *args, **kwargs):
+    def __init__(
+            self,
+            bot_id: int,
+            redis_engine: Redis,
+            crypto: Crypto,
+            *args,
+            cache_ttl: float = 60,
+            cache_maxsize: int = 10000,
+            **kwargs,
+    ):
         super().__init__(bot_id, redis_engine, *args, **kwargs)
         self._crypto = crypto
+        self._cache = LRUTTLCache(maxsize=cache_maxsize, ttl=cache_ttl)
+        # Bumped on every invalidation, as in BotChatAIDiscussionModeStorage.
+        self._generation = 0
+        self._invalidation_channel = RedisEventChannel(
+            redis_engine, f'{self.bot_id}:{self.__class__.__name__}:invalidate',
+        )
 
     def _get_storage_prefix(self):
         return f'{self.bot_id}:BAICCS:'  # Bot AI Contributor Chat Storage
 
+    def _get_key_index(self) -> str:
+        """SET of contributed (user, chat, service) members, i.e. key suffixes of stored tokens."""
+        return f'{self.bot_id}:BAICCSIndex'
+
+    @staticmethod
+    def _get_index_member_openai_token(user_id: int, chat_id: int) -> str:
+        return f'{user_id}:{chat_id}:contribute_openai'
+
+    @staticmethod
+    def _get_index_member_perplexity_token(user_id: int, chat_id: int) -> str:
+        return f'{user_id}:{chat_id}:contribute_perplexity'
+
     def _get_key_openai_token(self, user_id: int, chat_id: int) -> str:
-        return f'{self._get_storage_prefix()}:{user_id}:{chat_id}:contribute_openai'
-    
+        return f'{self._get_storage_prefix()}:{self._get_index_member_openai_token(user_id, chat_id)}'
+
     def _get_key_perplexity_token(self, user_id: int, chat_id: int) -> str:
-        return f'{self._get_storage_prefix()}:{user_id}:{chat_id}:contribute_perplexity'
+        return f'{self._get_storage_prefix()}:{self._get_index_member_perplexity_token(user_id, chat_id)}'
+
+    @classmethod
+    def to_chat_id_from_index_member(cls, member: str) -> Optional[int]:
+        # Members are key suffixes, thus chat id is at the same position.
+        return cls.to_chat_id_from_key(member)
+
+    @staticmethod
+    def _get_cache_key(user_id: int, chat_id: int) -> str:
+        return f'{user_id}:{chat_id}'
+
+    async def _invalidate(self, user_id: int, chat_id: int):
+        cache_key = self._get_cache_key(user_id, chat_id)
+        self._generation += 1
+        self._cache.invalidate(cache_key)
+        await self._invalidation_channel.publish({'key': cache_key})
+
+    def _on_invalidation_event(self, event: dict):
+        self._generation += 1
+        self._cache.invalidate(event['key'])
+
+    async def listen_invalidations(self):
+        """Long living loop to drop tokens changed by other processes from the cache."""
+        await self._invalidation_channel.listen(self._on_invalidation_event)
+
+    def get_keys(self, user_id: int, chat_id: int) -> list[str]:
+        """Keys to fetch (e.g. in 1 MGET with other keys) and pass values to `cache_from_raw`."""
+        return [self._get_key_openai_token(user_id, chat_id), self._get_key_perplexity_token(user_id, chat_id)]
+
+    def get_generation(self) -> int:
+        """To get before fetching values outside and pass to `cache_from_raw`."""
+        return self._generation
+
+    def get_cached(self, user_id: int, chat_id: int):
+        """:return: ContributorTokensOut or LRUTTLCache.MISSING."""
+        return self._cache.get(self._get_cache_key(user_id, chat_id))
+
+    async def cache_from_raw(
+            self,
+            user_id: int,
+            chat_id: int,
+            openai_value: Optional[str],
+            perplexity_value: Optional[str],
+            generation: int,
+    ) -> ContributorTokensOut:
+        """Decipher values fetched by `get_keys` (off the event loop) and cache them.
+        :param generation: got before the fetch, tokens are not cached if an invalidation happened since.
+        """
+        openai_token, perplexity_token = await self._crypto.decipher_many([openai_value, perplexity_value])
+        tokens = self.ContributorTokensOut(openai_token=openai_token, perplexity_token=perplexity_token)
+        if generation == self._generation:
+            self._cache.set(self._get_cache_key(user_id, chat_id), tokens)
+        return tokens
 
     async def get(self, user_id: int, chat_id: int) -> ContributorTokensOut:
         """Get both OpenAI and Perplexity tokens for a user in a chat."""
-        openai_value = await self.redis_engine.get(self._get_key_openai_token(user_id, chat_id))
-        perplexity_value = await self.redis_engine.get(self._get_key_perplexity_token(user_id, chat_id))
-        return self.ContributorTokensOut(
-            openai_token=self._crypto.decipher_to_str(openai_value) if openai_value else None,
-            perplexity_token=self._crypto.decipher_to_str(perplexity_value) if perplexity_value else None,
-        )
+        tokens = self.get_cached(user_id, chat_id)
+        if tokens is not LRUTTLCache.MISSING:
+            return tokens
+
+        generation = self.get_generation()
+        openai_value, perplexity_value = await self.redis_engine.mget(self.get_keys(user_id, chat_id))
+        return await self.cache_from_raw(user_id, chat_id, openai_value, perplexity_value, generation)
 
     async def set_openai_token(self, user_id: int, chat_id: int, token: str) -> Optional[str]:
         """Store OpenAI token for a user in a chat."""
         token_ciphered = self._crypto.cipher_to_str(token)
         async with self.redis_engine.pipeline(transaction=True) as pipe:
             pipe = pipe.set(self._get_key_openai_token(user_id, chat_id), token_ciphered)
-            return await pipe.execute()
+            pipe = pipe.sadd(self._get_key_index(), self._get_index_member_openai_token(user_id, chat_id))
+            result = await pipe.execute()
+        await self._invalidate(user_id, chat_id)
+        return result
 
     async def set_perplexity_token(self, user_id: int, chat_id: int, token: str) -> Optional[str]:
         """Store Perplexity token for a user in a chat."""
         token_ciphered = self._crypto.cipher_to_str(token)
         async with self.redis_engine.pipeline(transaction=True) as pipe:
             pipe = pipe.set(self._get_key_perplexity_token(user_id, chat_id), token_ciphered)
-            return await pipe.execute()
+            pipe = pipe.sadd(self._get_key_index(), self._get_index_member_perplexity_token(user_id, chat_id))
+            result = await pipe.execute()
+        await self._invalidate(user_id, chat_id)
+        return result
 
     async def delete_openai_token(self, user_id: int, chat_id: int) -> Optional[str]:
         """Delete OpenAI token for a user in a chat."""
-        return await self.redis_engine.delete(self._get_key_openai_token(user_id, chat_id))
+        async with self.redis_engine.pipeline(transaction=True) as pipe:
+            pipe = pipe.delete(self._get_key_openai_token(user_id, chat_id))
+            pipe = pipe.srem(self._get_key_index(), self._get_index_member_openai_token(user_id, chat_id))
+            result = (await pipe.execute())[0]
+        await self._invalidate(user_id, chat_id)
+        return result
 
     async def delete_perplexity_token(self, user_id: int, chat_id: int) -> Optional[str]:
         """Delete Perplexity token for a user in a chat."""
-        return await self.redis_engine.delete(self._get_key_perplexity_token(user_id, chat_id))
+        async with self.redis_engine.pipeline(transaction=True) as pipe:
+            pipe = pipe.delete(self._get_key_perplexity_token(user_id, chat_id))
+            pipe = pipe.srem(self._get_key_index(), self._get_index_member_perplexity_token(user_id, chat_id))
+            result = (await pipe.execute())[0]
+        await self._invalidate(user_id, chat_id)
+        return result
 
     async def get_all_chats_iterator(self):
         """Get iterator over all chats that have either OpenAI or Perplexity tokens."""
-        return RedisScanIterAsyncIterator(redis=self.redis_engine, match=self._get_storage_prefix() + '*')
+        return RedisSetScanAsyncIterator(redis=self.redis_engine, key=self._get_key_index())
 
+    async def backfill_index(self) -> int:
+        indexed = 0
+        key_prefix = f'{self._get_storage_prefix()}:'
+        async for token_keys in RedisScanIterAsyncIterator(redis=self.redis_engine, match=key_prefix + '*'):
+            members = [key[len(key_prefix):] for key in token_keys]
+            await self.redis_engine.sadd(self._get_key_index(), *members)
+            indexed += len(members)
+        logger.info(f'[{self.__class__.__name__}] Backfilled index with {indexed} members.')
+        return indexed
 
 
 async def get_unique_chat_ids_from_storage(
@@ -231,10 +473,12 @@ async def get_unique_chat_ids_from_storage(
     :return: all unique chat_ids.
     """
     unique_chat_ids = set()
-    async for chat_keys in await bot_chats_storage_object.get_all_chats_iterator():
-        logger.info(f'[get_unique_chat_ids_from_storage] Get for this batch {chat_keys = }')
-        # Convert all keys to chat ids.
-        fetched_chat_ids = [bot_chats_storage_object.to_chat_id_from_key(x) for x in chat_keys if x is not None]
+    async for index_members in await bot_chats_storage_object.get_all_chats_iterator():
+        logger.info(f'[get_unique_chat_ids_from_storage] Get for this batch {index_members = }')
+        # Convert all index members to chat ids.
+        fetched_chat_ids = [
+            bot_chats_storage_object.to_chat_id_from_index_member(x) for x in index_members if x is not None
+        ]
         unique_chat_ids.update(fetched_chat_ids)
         logger.info(f'[get_unique_chat_ids_from_storage] Convert to {fetched_chat_ids =}')
     return unique_chat_ids
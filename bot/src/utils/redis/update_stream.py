@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateStream:
+    """Queue of raw Telegram updates (dicts) between the ingress process and worker processes via Redis Streams.
+
+    Updates are partitioned by chat id (1 stream per partition), each partition is consumed by exactly 1 worker
+    (partition % workers == worker index), thus updates of a chat are handled in order.
+    Within a worker, chats are handled concurrently (up to max_concurrency updates), but each chat in order.
+
+    Delivery is at-least-once: an update is acknowledged (XACK) after it is handled (even if a handler failed,
+    errors are logged and reported by error handlers), updates read but not acknowledged before a worker died
+    are pending in the consumer group and re-read by the next owner of the partition on start.
+    Consumer names are per partition (not per worker), thus it works even if the number of workers changes.
+
+    Entries are trimmed by consumers only once acknowledged (never by length), max_len is a soft limit of the backlog:
+    `add` reports the length, thus the ingress could slow down until workers catch up.
+
+    # Use-case
+    ```
+        update_stream = UpdateStream(bot_id, redis, partitions=16)
+        # Ingress process.
+        await update_stream.add(update.model_dump(mode='json', exclude_unset=True, by_alias=True))
+        # Worker process.
+        await update_stream.consume(update_stream.get_worker_partitions(worker_idx, workers), handle_update)
+    ```
+    """
+    GROUP = 'workers'
+    RECONNECT_DELAY = 5  # Seconds.
+    TRIM_INTERVAL = 10  # Seconds between trims of acknowledged entries of a partition.
+
+    def __init__(
+            self,
+            bot_id: int,
+            redis_engine: Redis,
+            partitions: int = 16,
+            max_len: int = 100000,
+            batch_size: int = 100,
+            block: float = 5,
+    ):
+        """
+        :param max_len: max backlog of a partition, over it the ingress should wait (see `add`).
+        :param block: seconds to wait for new updates in 1 read.
+        """
+        self.bot_id = bot_id
+        self.redis_engine = redis_engine
+        self.partitions = partitions
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.block = block
+
+    def _get_key(self, partition: int) -> str:
+        return f'{self.bot_id}:{self.__class__.__name__}:{partition}'
+
+    @staticmethod
+    def _get_consumer(partition: int) -> str:
+        return f'partition-{partition}'
+
+    @staticmethod
+    def get_chat_id(update: dict) -> Optional[int]:
+        """Chat of the update (or user for updates without chat, e.g. inline queries), None if there is no such."""
+        for event in update.values():
+            if not isinstance(event, dict):
+                continue
+            chat = event.get('chat') or (event.get('message') or {}).get('chat')
+            if chat:
+                return chat['id']
+            user = event.get('from') or event.get('user')
+            if user:
+                return user['id']
+        return None
+
+    def get_partition(self, update: dict) -> int:
+        chat_id = self.get_chat_id(update)
+        return chat_id % self.partitions if chat_id is not None else 0
+
+    def get_worker_partitions(self, worker_idx: int, workers: int) -> list[int]:
+        return [partition for partition in range(self.partitions) if partition % workers == worker_idx]
+
+    async def add(self, update: dict) -> int:
+        """:return: length of the partition stream (in the same round trip), it is over max_len if workers are
+            behind (or dead), then the caller should wait rather than add more.
+        """
+        key = self._get_key(self.get_partition(update))
+        pipeline = self.redis_engine.pipeline(transaction=False)
+        pipeline.xadd(key, {'update': json.dumps(update)})
+        pipeline.xlen(key)
+        _, length = await pipeline.execute()
+        return length
+
+    def is_full(self, length: int) -> bool:
+        return length > self.max_len
+
+    async def trim_acknowledged(self, partition: int, last_read_id: str):
+        """Entries before the oldest pending one (or before the last read one if none pending) are acknowledged.
+        Note, XTRIM MINID needs Redis 6.2+.
+        """
+        key = self._get_key(partition)
+        pending = await self.redis_engine.xpending(key, self.GROUP)
+        min_id = pending['min'] if pending['pending'] else last_read_id
+        await self.redis_engine.xtrim(key, minid=min_id, approximate=True)
+
+    async def ensure_group(self, partition: int):
+        try:
+            await self.redis_engine.xgroup_create(self._get_key(partition), self.GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _handle_entry(
+            self,
+            partition: int,
+            entry_id: str,
+            update: dict,
+            previous: Optional[asyncio.Task],
+            handler: Callable[[dict], Awaitable[Any]],
+    ):
+        if previous is not None:
+            # Only to keep the order within the chat, result of the previous update is not relevant.
+            await asyncio.wait([previous])
+        try:
+            await handler(update)
+        except Exception as e:
+            logger.exception('[%s] Could not handle update %s: %s', self.__class__.__name__, update.get('update_id'), e)
+        try:
+            await self.redis_engine.xack(self._get_key(partition), self.GROUP, entry_id)
+        except RedisError as e:
+            # It stays pending, thus it is handled again by the next owner of the partition.
+            logger.warning('[%s] Could not acknowledge %s: %s...', self.__class__.__name__, entry_id, e)
+
+    async def _consume_partition(
+            self,
+            partition: int,
+            handler: Callable[[dict], Awaitable[Any]],
+            semaphore: asyncio.Semaphore,
+            chat_tails: dict[int, asyncio.Task],
+    ):
+        key = self._get_key(partition)
+        # Pending entries (read, but not acknowledged by the previous owner) first, then new ones.
+        last_id = '0'
+        last_read_id = None
+        trimmed_at = time.monotonic()
+        is_group_ensured = False
+        while True:
+            try:
+                if not is_group_ensured:
+                    await self.ensure_group(partition)
+                    is_group_ensured = True
+                response = await self.redis_engine.xreadgroup(
+                    self.GROUP,
+                    self._get_consumer(partition),
+                    {key: last_id},
+                    count=self.batch_size,
+                    block=int(self.block * 1000),
+                )
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning('[%s] Reading %s failed: %s. Reconnect...', self.__class__.__name__, key, e)
+                is_group_ensured = False
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+
+            entries = response[0][1] if response else []
+            if last_id != '>':
+                if not entries:
+                    last_id = '>'
+                    continue
+                logger.info('[%s] Handle %s pending updates of %s...', self.__class__.__name__, len(entries), key)
+                last_id = entries[-1][0]
+
+            for entry_id, fields in entries:
+                last_read_id = entry_id
+                update = json.loads(fields['update'])
+                chat_id = self.get_chat_id(update)
+                await semaphore.acquire()
+                task = asyncio.create_task(
+                    self._handle_entry(partition, entry_id, update, chat_tails.get(chat_id), handler)
+                )
+                chat_tails[chat_id] = task
+                task.add_done_callback(partial(self._on_entry_done, semaphore, chat_tails, chat_id))
+
+            # After the read entries are dispatched, thus a failed trim does not lose them.
+            if last_read_id is not None and time.monotonic() - trimmed_at > self.TRIM_INTERVAL:
+                trimmed_at = time.monotonic()
+                try:
+                    await self.trim_acknowledged(partition, last_read_id)
+                except RedisError as e:
+                    logger.warning('[%s] Trimming %s failed: %s', self.__class__.__name__, key, e)
+
+    @staticmethod
+    def _on_entry_done(
+            semaphore: asyncio.Semaphore,
+            chat_tails: dict[int, asyncio.Task],
+            chat_id: Optional[int],
+            task: asyncio.Task,
+    ):
+        semaphore.release()
+        # Forget the chat if no updates of it were queued after.
+        if chat_tails.get(chat_id) is task:
+            del chat_tails[chat_id]
+
+    async def consume(
+            self, partitions: list[int], handler: Callable[[dict], Awaitable[Any]], max_concurrency: int = 100,
+    ):
+        """Long living loop (run it as a task) that calls handler for each update of the partitions."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # Chat id to the task of its last update.
+        chat_tails: dict[int, asyncio.Task] = {}
+        logger.info('[%s] Consume partitions %s...', self.__class__.__name__, partitions)
+        await asyncio.gather(*[
+            self._consume_partition(partition, handler, semaphore, chat_tails) for partition in partitions
+        ])
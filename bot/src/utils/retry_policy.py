@@ -0,0 +1,108 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import aiohttp
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """:return: seconds to wait from `Retry-After` header (seconds or http date), None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """The deadline of retries is over before the next attempt."""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How to retry a request: exponential backoff with full jitter, `Retry-After` is honoured.
+    Attempts are capped by max_attempts and by deadline (seconds for all attempts and waits).
+
+    # Use-case
+    ```
+        attempts = RetryPolicy(max_attempts=3).start()
+        while True:
+            # Raises DeadlineExceededError if the deadline is over.
+            response = await send(timeout=attempts.get_timeout())
+            delay = attempts.get_delay(response.status, retry_after=...)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+    ```
+    """
+    max_attempts: int = 3
+    deadline: float = 60.0
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+    multiplier: float = 2.0
+    retry_statuses: frozenset[int] = field(default_factory=lambda: frozenset({429, 500, 502, 503, 504}))
+    retry_exceptions: tuple[type[BaseException], ...] = (aiohttp.ClientError, asyncio.TimeoutError)
+
+    def start(self) -> 'RetryAttempts':
+        return RetryAttempts(self)
+
+
+class RetryAttempts:
+    """State of retries of 1 request."""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempt = 1
+        self.deadline_at = time.monotonic() + policy.deadline
+
+    def get_remaining(self) -> float:
+        return max(self.deadline_at - time.monotonic(), 0.0)
+
+    def get_timeout(self, stream: bool = False) -> aiohttp.ClientTimeout:
+        """To not let a single attempt exceed the deadline, call it before each attempt.
+        :param stream: only connection and waits between chunks are limited, not the whole (long) response.
+        :raise DeadlineExceededError: if no time remains (aiohttp does not arm 0 timeouts, the attempt would be
+            unbounded).
+        """
+        remaining = self.get_remaining()
+        if remaining <= 0:
+            raise DeadlineExceededError(f'Deadline of {self.policy.deadline}s is exceeded.')
+        if stream:
+            return aiohttp.ClientTimeout(total=None, connect=remaining, sock_read=remaining)
+        return aiohttp.ClientTimeout(total=remaining)
+
+    def _get_next_delay(self, retry_after: Optional[float] = None) -> Optional[float]:
+        if self.attempt >= self.policy.max_attempts:
+            return None
+        backoff = min(self.policy.base_delay * self.policy.multiplier ** (self.attempt - 1), self.policy.max_delay)
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if delay >= self.get_remaining():
+            return None
+        self.attempt += 1
+        return delay
+
+    def get_delay(self, status: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """:return: seconds to wait before the next attempt, None - do not retry (e.g. success or out of attempts)."""
+        if status not in self.policy.retry_statuses:
+            return None
+        return self._get_next_delay(retry_after)
+
+    def get_delay_on_exception(self, e: BaseException) -> Optional[float]:
+        """:return: seconds to wait before the next attempt, None - do not retry (reraise)."""
+        if not isinstance(e, self.policy.retry_exceptions):
+            return None
+        return self._get_next_delay()
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+from utils.generators import aclosing
+
+logger = logging.getLogger(__name__)
+
+
+def make_request_key(*parts: Any) -> str:
+    """Hash of json serializable parts, e.g. (provider, url, token fingerprint, request data)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class _SharedStream:
+    """Items of a stream consumed once in a task and replayed to every subscriber (also to late ones)."""
+
+    def __init__(self):
+        self.items: list = []
+        self.error: Optional[BaseException] = None
+        self.is_done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    async def consume(self, source: AsyncGenerator):
+        try:
+            async with aclosing(source):
+                async for item in source:
+                    self.items.append(item)
+                    self._notify()
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.is_done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator:
+        idx = 0
+        while True:
+            if idx < len(self.items):
+                idx += 1
+                yield self.items[idx - 1]
+                continue
+            if self.is_done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share 1 call and its result (or exception), like Go singleflight.
+    Only in flight calls are shared, the result is not cached after the call is done.
+
+    The shared call runs as a task, thus cancellation of a caller does not cancel it for others.
+
+    # Use-case
+    ```
+        singleflight = SingleFlight()
+        key = make_request_key('openai', url, data)
+        response = await singleflight.do(key, lambda: make_request(url, data))
+        async for chunk in singleflight.stream(key, lambda: make_stream_request(url, data)):
+            ...
+    ```
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self._streams: dict[Hashable, _SharedStream] = {}
+        self.shared_calls = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._forget_call(key, call))
+        else:
+            self.shared_calls += 1
+            logger.info('[SingleFlight] Share in flight call %s...', key)
+        return await asyncio.shield(call)
+
+    def _forget_call(self, key: Hashable, call: asyncio.Future):
+        self._calls.pop(key, None)
+        if not call.cancelled():
+            # Mark the exception as retrieved, since all callers could be cancelled before the call is done.
+            call.exception()
+
+    async def stream(self, key: Hashable, func: Callable[[], AsyncGenerator]) -> AsyncIterator:
+        """Items of the shared stream are kept in memory till the stream ends.
+        When the last subscriber leaves before the end (e.g. closes the iterator), the shared stream is cancelled,
+        thus its source is closed (e.g. an admission slot is released) instead of being consumed for nobody.
+        """
+        shared_stream = self._streams.get(key)
+        if shared_stream is None:
+            shared_stream = _SharedStream()
+            self._streams[key] = shared_stream
+            shared_stream.task = asyncio.ensure_future(shared_stream.consume(func()))
+            shared_stream.task.add_done_callback(lambda _: self._forget_stream(key, shared_stream))
+        else:
+            self.shared_calls += 1
+            logger.info('[SingleFlight] Share in flight stream %s...', key)
+
+        shared_stream.subscribers += 1
+        try:
+            async for item in shared_stream.subscribe():
+                yield item
+        finally:
+            shared_stream.subscribers -= 1
+            if not shared_stream.subscribers and not shared_stream.is_done:
+                logger.info('[SingleFlight] No subscribers left, cancel stream %s...', key)
+                # Forgotten right away, thus a new request with the key starts a new stream.
+                self._forget_stream(key, shared_stream)
+                shared_stream.task.cancel()
+
+    def _forget_stream(self, key: Hashable, shared_stream: _SharedStream):
+        if self._streams.get(key) is shared_stream:
+            del self._streams[key]
+
+    def to_text(self) -> str:
+        return (
+            f'in flight calls: {len(self._calls)}, in flight streams: {len(self._streams)}, '
+            f'shared calls: {self.shared_calls}'
+        )
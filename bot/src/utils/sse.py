@@ -0,0 +1,31 @@
+import json
+import logging
+from typing import AsyncIterator
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+SSE_DATA_PREFIX = 'data:'
+SSE_DONE = '[DONE]'
+
+
+async def iter_sse_data(response: aiohttp.ClientResponse) -> AsyncIterator[dict]:
+    """Yields json payloads of `data:` events of server sent events response (OpenAI like API) till `[DONE]`.
+    The response is released at the end (or when the iterator is closed).
+    """
+    try:
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith(SSE_DATA_PREFIX):
+                # Empty lines separate events, others are comments or not used fields (event:, id:, retry:).
+                continue
+            data = line[len(SSE_DATA_PREFIX):].strip()
+            if data == SSE_DONE:
+                return
+            try:
+                yield json.loads(data)
+            except json.JSONDecodeError:
+                logger.warning('[iter_sse_data] Could not decode event data %s, pass...', data)
+    finally:
+        response.release()
@@ -1,15 +1,21 @@
+import asyncio
 import json
-import random
 import time
 from dataclasses import dataclass
 import logging
-from typing import Optional
+from typing import Collection, Optional, Union
 
 import aiohttp
 from redis.asyncio import Redis
 
 from utils.crypto import Crypto
+from utils.http_session_pool import HttpSessionPool
+from utils.metrics import Metrics
+from utils.redis.event_channel import RedisEventChannel
 from utils.redis.redis_scan_iterator import get_first_n_keys
+from utils.retry_policy import RetryPolicy, parse_retry_after
+from utils.token_health import TokenHealthSelector
+from utils.ttl_cache import LRUTTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -27,25 +33,75 @@ class TokenRequestResponse:
     json: any
     status: int
     failed_tokens: list[str]
+    # Not read response of successful stream request, the caller should read & release it (e.g. via iter_sse_data).
+    stream: Optional[aiohttp.ClientResponse] = None
+
+    @classmethod
+    def from_payload(
+            cls, status: int, payload: Union[str, aiohttp.ClientResponse], failed_tokens: list[str],
+    ) -> 'TokenRequestResponse':
+        if isinstance(payload, aiohttp.ClientResponse):
+            return cls(json=None, status=status, failed_tokens=failed_tokens, stream=payload)
+        return cls(json=json.loads(payload), status=status, failed_tokens=failed_tokens)
 
 
 class TokenApiManagerABC:
+    DEFAULT_RETRY_POLICY = RetryPolicy()
+
     def __init__(
             self,
             main_token: Optional[str],
             *args,
+            http_session_pool: Optional[HttpSessionPool] = None,
             **kwargs,
     ):
+        """
+        :param http_session_pool: shared pool of keep-alive sessions (closed by its owner),
+         if not provided - own pool is used, it is closed by `close`.
+        """
         self.main_token = main_token
+        self._owns_http_session_pool = http_session_pool is None
+        self.http_session_pool = http_session_pool or HttpSessionPool()
+
+    async def close(self):
+        """Closes own sessions, a shared pool is left opened."""
+        if self._owns_http_session_pool:
+            await self.http_session_pool.close()
+
+    async def _post(
+            self,
+            url: str,
+            data: dict,
+            headers: dict,
+            timeout: aiohttp.ClientTimeout,
+            stream: bool = False,
+    ) -> tuple[int, Union[str, aiohttp.ClientResponse], Optional[float]]:
+        """:return: status, text (or not read response if stream and status is 200) and seconds from Retry-After."""
+        session = self.http_session_pool.get_session(url)
+        response = await session.post(
+            url=url,
+            json=data,
+            headers=headers,
+            timeout=timeout,
+        )
+        if stream and response.status == 200:
+            return response.status, response, None
+        try:
+            return response.status, await response.text(), parse_retry_after(response.headers.get('Retry-After'))
+        finally:
+            response.release()
 
     async def make_request(
             self,
             url,
             data,
-            headers={},
+            headers: Optional[dict] = None,
             *args,
+            retry_policy: Optional[RetryPolicy] = None,
+            stream: bool = False,
             **kwargs,
     ) -> TokenRequestResponse:
+        """:param stream: do not read successful response, but return it as `stream` (e.g. for SSE)."""
         raise NotImplementedError
 
 
@@ -55,39 +111,50 @@ class TokenApiRequestPureManager(TokenApiManagerABC):
             self,
             url,
             data,
-            headers={},
+            headers: Optional[dict] = None,
             *args,
+            retry_policy: Optional[RetryPolicy] = None,
+            stream: bool = False,
             **kwargs,
     ) -> TokenRequestResponse:
-        current_token = self.main_token
-        headers['Authorization'] = f'Bearer {current_token}'
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=url,
-                json=data,
-                headers=headers,
-            ) as response:
-                status = response.status
-                _json = await response.json()
-                logger.info('[TokenApiRequestPureManager] Send %s, on %s got status = %s, json = %s',
-                            data, url, status, _json)
-
-                return TokenRequestResponse(
-                    status=status,
-                    json=_json,
-                    failed_tokens=[],
-                )
+        headers = {**(headers or {}), 'Authorization': f'Bearer {self.main_token}'}
+        attempts = (retry_policy or self.DEFAULT_RETRY_POLICY).start()
+        while True:
+            # Out of the try, the deadline is not retried.
+            timeout = attempts.get_timeout(stream)
+            try:
+                status, payload, retry_after = await self._post(url, data, headers, timeout, stream)
+            except Exception as e:
+                delay = attempts.get_delay_on_exception(e)
+                if delay is None:
+                    raise
+                logger.warning('[TokenApiRequestPureManager] Request to %s failed: %r, retry in %.2fs...', url, e, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            logger.info('[TokenApiRequestPureManager] Send %s, on %s got status = %s, text = %s',
+                        data, url, status, payload)
+            delay = attempts.get_delay(status, retry_after)
+            if delay is None:
+                return TokenRequestResponse.from_payload(status, payload, failed_tokens=[])
+            logger.warning('[TokenApiRequestPureManager] Got status %s, retry in %.2fs...', status, delay)
+            await asyncio.sleep(delay)
 
 
 class TokenApiRequestManager(TokenApiManagerABC):
-    """It uses randomly main_token or one of the stored tokens (main token could not be deleted).
+    """It uses main_token or one of the stored tokens (main token could not be deleted).
+    A token is picked by its health (latency, 429 and error rates, in flight requests) of 2 random ones,
+    a token got 429 cools down for a while and loses to any other sampled token which is not cooling down,
+    thus it is still picked if both sampled tokens are cooling down (or it is the only token).
     Stored tokens could be deleted when request failed.
-    Main token could only be flagged and never used after (instead of deletion).
+    Main token could only be flagged and never used after (instead of deletion), by other processes as well
+    only if the provider confirmed it is revoked (see MAIN_TOKEN_REVOKED_ERROR_CODES).
 
     It stores ciphered tokens if Crypto is provided.
 
-    Note, the class is adopted to run in 1 process mode, since it uses shared thread storage.
+    Added and removed tokens are broadcast to managers (with the same salt) of other processes,
+    run `listen_token_events` as a task for that. Since events could be lost, the storage is still reloaded
+    every `storage_reload_ttl` seconds.
     Note, that this manager and openai_contributor_token class storage uses different storage layers.
      When this class may remove the token from its scope, but in openai_contributor_token the token may still persist.
 
@@ -104,12 +171,19 @@ class TokenApiRequestManager(TokenApiManagerABC):
         await manager.add_token("foo1")
         await manager.add_token("foo2")
         res = await manager.make_request(url, {'data': 'foo'}, rotate_statuses=rotate_statuses)
+        await manager.close()  # Own sessions, since http_session_pool is not provided.
     ```
     """
-    _token_to_external_key = {}  # Token to external storage key.
     # To separate key from others.
     _REDIS_PREFIX_KEY = 'TokenApiRequestManager:'
+    # Not under _REDIS_PREFIX_KEY, since keys by the prefix are loaded as tokens.
+    _REDIS_HEALTH_PREFIX_KEY = 'TokenApiRequestManagerHealth:'
+    _REDIS_EVENTS_CHANNEL_PREFIX = 'TokenApiRequestManagerEvents:'
+    HEALTH_TTL = 3600 * 24
     DEFAULT_NEW_TOKEN_TTL = 3600 * 24 * 30 * 2  # 2 months.
+    # Error codes (OpenAI style {"error": {"code": ...}}) of responses on which the main token is flagged
+    # in all processes, on other rotate statuses it is flagged only in this process (e.g. an occasional 401).
+    MAIN_TOKEN_REVOKED_ERROR_CODES = frozenset({'invalid_api_key', 'account_deactivated'})
 
     def __init__(
         self,
@@ -119,15 +193,27 @@ class TokenApiRequestManager(TokenApiManagerABC):
         salt: str = 'TokenApiRequestManager',
         max_tokens_to_load: int = 100,
         storage_reload_ttl: int = 500,
+        http_session_pool: Optional[HttpSessionPool] = None,
+        cooldown_on_429: float = TokenHealthSelector.DEFAULT_COOLDOWN,
+        health_persist_interval: Optional[float] = None,
+        metrics: Optional[Metrics] = None,
     ):
         """
         :param salt: do differ tokens in external storage from other ones and differ keys from other ones.
-        :param storage_reload_ttl: to solve multi processing sync.
+        :param storage_reload_ttl: to sync with other processes if their token events were lost.
         :param main_token: main token, e.g. from env.
         :param redis_storage:
         :param max_tokens_to_load: max tokens to load from storage (aka batch)
+        :param http_session_pool: shared pool of keep-alive sessions.
+        :param cooldown_on_429: seconds to not use a token after 429 (doubled on each consecutive 429).
+        :param health_persist_interval: seconds between storing token health stats to redis (to share them between
+         processes, they are loaded on storage reload), None - stats are kept only in memory.
+        :param metrics: to observe requests (by the salt as the provider) and token events.
         """
-        super().__init__(main_token, redis_storage, salt, max_tokens_to_load, storage_reload_ttl)
+        super().__init__(
+            main_token, redis_storage, salt, max_tokens_to_load, storage_reload_ttl,
+            http_session_pool=http_session_pool,
+        )
         self._main_token_failed = False
 
         self.current_token = self.main_token
@@ -137,38 +223,103 @@ class TokenApiRequestManager(TokenApiManagerABC):
         self.max_tokens_to_load = max_tokens_to_load
 
         self._last_storage_reload = 0.0
+        # Token to external storage key.
+        self._token_to_external_key: dict[str, str] = {}
         self._token_to_external_key[self.main_token] = 'foo'  # Main token is not stored in external storage.
+        # External keys removed by this process, not to add their tokens back on late add events.
+        self._removed_keys = LRUTTLCache(maxsize=10000, ttl=storage_reload_ttl)
+        self._token_events_channel = RedisEventChannel(
+            redis_storage, f'{self._REDIS_EVENTS_CHANNEL_PREFIX}{self.salt}',
+        )
 
         self._crypto_engine = crypto_engine
 
+        self._token_selector = TokenHealthSelector(cooldown=cooldown_on_429)
+        self._token_selector.add(self.main_token)
+        self.health_persist_interval = health_persist_interval
+        self._last_health_persist = time.time()
+        self.metrics = metrics or Metrics()
+
     def _get_external_storage_key_prefix(self):
         return self._REDIS_PREFIX_KEY + f'{self.salt}:'
 
+    def _get_external_storage_health_key(self):
+        return self._REDIS_HEALTH_PREFIX_KEY + f'{self.salt}'
+
     async def add_token(self, token: str, key_salt: str, ttl: int = DEFAULT_NEW_TOKEN_TTL):
         """
         :param token: token to store for use of this manager.
         :param ttl: ttl for the token
         """
         key = self._get_external_storage_key_prefix() + f'{key_salt}'
+        self._removed_keys.invalidate(key)
         self._token_to_external_key[token] = key
+        self._token_selector.add(token)
         to_store = self._crypto_engine.cipher_to_str(token) if self._crypto_engine else token
         await self.external_storage.set(key, to_store, ttl)
+        # Stored (i.e. ciphered) value is sent, not to broadcast raw tokens.
+        await self._token_events_channel.publish({'action': 'add', 'key': key, 'value': to_store})
 
-    async def remove_token(self, token: str):
+    async def remove_token(self, token: str, is_revoked: bool = False):
+        """:param is_revoked: confirmed by the provider, only then the main token is flagged in other processes."""
         logger.info(f'[TokenApiRequestManager] Remove {token = }.')
+        self.metrics.token_events.labels(self.salt, 'remove').inc()
+        self._token_selector.remove(token)
         if token == self.main_token:
             self._main_token_failed = True
             # Check if token is still in the dict, and if yes - remove it:
             if self.main_token in self._token_to_external_key:
                 self._token_to_external_key.pop(self.main_token)
+            if is_revoked:
+                await self._token_events_channel.publish({'action': 'remove_main'})
 
         if token in self._token_to_external_key:
             external_key = self._token_to_external_key.pop(token)
+            self._removed_keys.set(external_key, True)
             try:
                 await self.external_storage.delete(external_key)
             except Exception:
                 logger.warning(
                     '[TokenApiRequestManager] Could not delete from external, already not exists? nvm&pass...')
+            await self._token_events_channel.publish({'action': 'remove', 'key': external_key})
+
+    def _on_token_event(self, event: dict):
+        action = event['action']
+        if action == 'add':
+            if self._removed_keys.get(event['key']) is not LRUTTLCache.MISSING:
+                # The event is late, the token was already removed by this process.
+                logger.info('[TokenApiRequestManager] Ignore token %s removed by this process...', event['key'])
+                return
+            token = self._crypto_engine.decipher_to_str(event['value']) if self._crypto_engine else event['value']
+            logger.info('[TokenApiRequestManager] Add token %s added by other process...', event['key'])
+            self._token_to_external_key[token] = event['key']
+            self._token_selector.add(token)
+        elif action == 'remove':
+            # There are at most max_tokens_to_load tokens, thus no reversed map is kept.
+            token = next((t for t, key in self._token_to_external_key.items() if key == event['key']), None)
+            self._removed_keys.set(event['key'], True)
+            if token is not None:
+                logger.info('[TokenApiRequestManager] Remove token %s removed by other process...', event['key'])
+                self._token_to_external_key.pop(token)
+                self._token_selector.remove(token)
+        elif action == 'remove_main':
+            logger.info('[TokenApiRequestManager] Main token is revoked (got in other process), do not use it...')
+            self._main_token_failed = True
+            self._token_to_external_key.pop(self.main_token, None)
+            self._token_selector.remove(self.main_token)
+
+    def _is_revoked(self, payload: Union[str, aiohttp.ClientResponse]) -> bool:
+        if not isinstance(payload, str):
+            return False
+        try:
+            error = json.loads(payload).get('error')
+        except (ValueError, AttributeError):
+            return False
+        return isinstance(error, dict) and error.get('code') in self.MAIN_TOKEN_REVOKED_ERROR_CODES
+
+    async def listen_token_events(self):
+        """Long living loop to apply tokens added and removed by other processes."""
+        await self._token_events_channel.listen(self._on_token_event)
 
     async def reload_storage(self):
         self._last_storage_reload = time.time()
@@ -197,9 +348,55 @@ class TokenApiRequestManager(TokenApiManagerABC):
 
         assert len(loaded_token_keys) == len(loaded_tokens), 'Impossible.'
 
-        loaded_tokens = [self._crypto_engine.decipher_to_str(value) if value else None for value in loaded_tokens]
+        # Deciphered on a thread pool (and cached), not to stall the event loop on reloads.
+        started_at = time.perf_counter()
+        loaded_tokens = await self._crypto_engine.decipher_many(loaded_tokens)
+        logger.info(
+            '[TokenApiRequestManager] Deciphered %s tokens in %.3fs...',
+            len(loaded_tokens), time.perf_counter() - started_at,
+        )
         to_update_with = {token: loaded_token_keys[idx] for idx, token in enumerate(loaded_tokens) if token is not None}
         self._token_to_external_key.update(to_update_with)
+        for token in to_update_with:
+            self._token_selector.add(token)
+
+        if self.health_persist_interval is not None:
+            await self.load_health()
+
+    async def load_health(self):
+        """Stats of other processes overwrite the local ones, since they are merged only on rare storage reloads."""
+        try:
+            dumped = await self.external_storage.hgetall(self._get_external_storage_health_key())
+        except Exception as e:
+            logger.warning('[TokenApiRequestManager] Could not load health stats: %s. Pass...', e)
+            return
+        self._token_selector.load({fingerprint: json.loads(stats) for fingerprint, stats in dumped.items()})
+
+    async def persist_health(self):
+        self._last_health_persist = time.time()
+        dumped = self._token_selector.dump()
+        if not dumped:
+            return
+        key = self._get_external_storage_health_key()
+        try:
+            async with self.external_storage.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={fingerprint: json.dumps(stats) for fingerprint, stats in dumped.items()})
+                pipe.expire(key, self.HEALTH_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning('[TokenApiRequestManager] Could not persist health stats: %s. Pass...', e)
+
+    async def _on_request_end(self, token: str, started_at: float, status: Optional[int]):
+        self._token_selector.on_request_end(token, started_at, status)
+        self.metrics.provider_request_latency.labels(self.salt, status or '').observe(time.monotonic() - started_at)
+        if status == 429:
+            logger.info('[TokenApiRequestManager] Got 429, cool down the token %s...', token)
+            self.metrics.token_events.labels(self.salt, 'cooldown').inc()
+        if (
+                self.health_persist_interval is not None
+                and time.time() > self._last_health_persist + self.health_persist_interval
+        ):
+            await self.persist_health()
 
     async def get_current_token(self) -> str:
         # Check if no tokens left or if time & token capacity is not full.
@@ -211,79 +408,85 @@ class TokenApiRequestManager(TokenApiManagerABC):
         ):
             await self.reload_storage()
 
-        if len(self._token_to_external_key) == 0:
+        if len(self._token_to_external_key) == 0 or len(self._token_selector) == 0:
             return self.main_token
 
-        current_choice = random.choice(list(self._token_to_external_key.keys()))
-        return current_choice
+        return self._token_selector.choose()
 
     async def make_request(
             self,
             url,
             data,
-            headers={},
-            rotate_statuses={},
-            removed_tokens=[],
-            max_rotations=100,
-            force_main_token_statuses={},
-            force_main_token=False,
+            headers: Optional[dict] = None,
+            rotate_statuses: Collection[int] = frozenset(),
+            removed_tokens: Optional[list[str]] = None,
+            max_rotations: int = 100,
+            force_main_token_statuses: Collection[int] = frozenset(),
+            force_main_token: bool = False,
+            retry_policy: Optional[RetryPolicy] = None,
+            stream: bool = False,
     ) -> TokenRequestResponse:
-        """TODO: what if some tokens removed but with one of them error happened.
+        """Iterative loop: on rotate statuses the token is removed and the next one is used at once,
+        on force main token statuses the main token is used at once (only 1 time),
+        on retry statuses of the policy (e.g. 429 - the token cools down) the request is retried after backoff.
+        All attempts (including rotations) are bounded by the deadline of the policy, DeadlineExceededError
+        (asyncio.TimeoutError) is raised when it is over.
+
+        TODO: what if some tokens removed but with one of them error happened.
          user should be notified about removed/deleted ones anyway.
-         """
-        current_token = await self.get_current_token() if not force_main_token else self.main_token
-        headers['Authorization'] = f'Bearer {current_token}'
-        if max_rotations == 0:
-            raise MaxRotationException
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=url,
-                json=data,
-                headers=headers,
-            ) as response:
-                status = response.status
-                _text = await response.text()
-                logger.info('[TokenApiRequestManager] Send %s, on %s got status = %s, text = %s',
-                            data, url, status, _text)
-                if status in rotate_statuses:
-                    logger.info(
-                        f' [TokenApiRequestManager] Rotate token before the new request '
-                        f'& remove token from the manager cache {current_token}...'
-                    )
-                    # TODO: possibly notify admins about deletion.
-                    await self.remove_token(
-                        current_token,
-                    )
-                    removed_tokens.append(current_token)
-                    return await self.make_request(
-                        url=url,
-                        data=data,
-                        headers=headers,
-                        rotate_statuses=rotate_statuses,
-                        removed_tokens=removed_tokens,
-                        max_rotations=max_rotations - 1,
-                        force_main_token_statuses=force_main_token_statuses,
-                    )
-
-                if status in force_main_token_statuses:
-                    logger.info(
-                        '[TokenApiRequestManager] Use main token before the new request. Do anything with the '
-                        'current token.'
-                    )
-                    return await self.make_request(
-                        url=url,
-                        data=data,
-                        headers=headers,
-                        rotate_statuses=rotate_statuses,
-                        removed_tokens=removed_tokens,
-                        max_rotations=max_rotations - 1,
-                        force_main_token_statuses=force_main_token_statuses,
-                        force_main_token=True,
-                    )
-
-                return TokenRequestResponse(
-                    status=response.status,
-                    json=json.loads(_text),
-                    failed_tokens=removed_tokens,
+        """
+        removed_tokens = [] if removed_tokens is None else removed_tokens
+        attempts = (retry_policy or self.DEFAULT_RETRY_POLICY).start()
+        rotations = 0
+        while True:
+            if rotations >= max_rotations:
+                raise MaxRotationException
+            # Also bounds rotations and forcing of the main token, out of the try, the deadline is not retried.
+            timeout = attempts.get_timeout(stream)
+            current_token = await self.get_current_token() if not force_main_token else self.main_token
+            request_headers = {**(headers or {}), 'Authorization': f'Bearer {current_token}'}
+
+            started_at = self._token_selector.on_request_start(current_token)
+            try:
+                status, payload, retry_after = await self._post(url, data, request_headers, timeout, stream)
+            except Exception as e:
+                await self._on_request_end(current_token, started_at, None)
+                delay = attempts.get_delay_on_exception(e)
+                if delay is None:
+                    raise
+                logger.warning('[TokenApiRequestManager] Request to %s failed: %r, retry in %.2fs...', url, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            await self._on_request_end(current_token, started_at, status)
+            logger.info('[TokenApiRequestManager] Send %s, on %s got status = %s, text = %s',
+                        data, url, status, payload)
+
+            if status in rotate_statuses:
+                logger.info(
+                    f' [TokenApiRequestManager] Rotate token before the new request '
+                    f'& remove token from the manager cache {current_token}...'
                 )
+                # TODO: possibly notify admins about deletion.
+                self.metrics.token_events.labels(self.salt, 'rotate').inc()
+                await self.remove_token(current_token, is_revoked=self._is_revoked(payload))
+                removed_tokens.append(current_token)
+                rotations += 1
+                force_main_token = False
+                continue
+
+            if status in force_main_token_statuses and not force_main_token:
+                logger.info(
+                    '[TokenApiRequestManager] Use main token before the new request. Do anything with the '
+                    'current token.'
+                )
+                rotations += 1
+                force_main_token = True
+                continue
+
+            delay = attempts.get_delay(status, retry_after)
+            if delay is not None:
+                logger.warning('[TokenApiRequestManager] Got status %s, retry in %.2fs...', status, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            return TokenRequestResponse.from_payload(status, payload, failed_tokens=removed_tokens)
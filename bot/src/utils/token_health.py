@@ -0,0 +1,152 @@
+import hashlib
+import random
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+
+def get_token_fingerprint(token: str) -> str:
+    """Not to keep raw tokens in external storage (e.g. in persisted stats)."""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+@dataclass
+class TokenHealth:
+    """EWMA based stats of a token, the lower `score` - the healthier the token."""
+    latency_ewma: float = 0.0  # Seconds.
+    rate_429_ewma: float = 0.0
+    error_rate_ewma: float = 0.0
+    last_used_at: float = 0.0
+    cooldown_until: float = 0.0
+    consecutive_429: int = 0
+    in_flight: int = 0  # Local to the process, not persisted.
+
+    def to_persist(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if k != 'in_flight'}
+
+    def is_cooling_down(self, now: float) -> bool:
+        return self.cooldown_until > now
+
+    def score(self, now: float) -> float:
+        if self.is_cooling_down(now):
+            return float('inf')
+        # Latency is multiplied by load (least loaded), failures make the token look "slower".
+        return (
+            (self.latency_ewma or 1.0) * (1 + self.in_flight)
+            * (1 + 10 * self.rate_429_ewma + 5 * self.error_rate_ewma)
+        )
+
+
+class TokenHealthSelector:
+    """Keeps health of tokens and picks a token with "power of two choices":
+    2 distinct random tokens are sampled and the healthier is used, thus selection and updates are O(1)
+    (tokens are kept in a list with index map, removal swaps with the last one).
+
+    # Use-case
+    ```
+        selector = TokenHealthSelector()
+        selector.add('foo')
+        token = selector.choose()
+        started_at = selector.on_request_start(token)
+        selector.on_request_end(token, started_at, status=429)  # The token cools down for a while.
+    ```
+    """
+    EWMA_ALPHA = 0.2
+    DEFAULT_COOLDOWN = 30  # Seconds, doubled on each consecutive 429.
+    MAX_COOLDOWN = 60 * 10
+    ERROR_STATUS_MIN = 500
+
+    def __init__(self, cooldown: float = DEFAULT_COOLDOWN, max_cooldown: float = MAX_COOLDOWN):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._tokens: list[str] = []
+        self._token_to_idx: dict[str, int] = {}
+        self._health: dict[str, TokenHealth] = {}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._token_to_idx
+
+    def add(self, token: str):
+        if token in self._token_to_idx:
+            return
+        self._token_to_idx[token] = len(self._tokens)
+        self._tokens.append(token)
+        self._health.setdefault(token, TokenHealth())
+
+    def remove(self, token: str):
+        idx = self._token_to_idx.pop(token, None)
+        if idx is None:
+            return
+        last_token = self._tokens.pop()
+        if last_token != token:
+            self._tokens[idx] = last_token
+            self._token_to_idx[last_token] = idx
+        self._health.pop(token, None)
+
+    def get_health(self, token: str) -> Optional[TokenHealth]:
+        return self._health.get(token)
+
+    def choose(self) -> Optional[str]:
+        """:return: healthier token of 2 random ones, None if there are no tokens."""
+        if not self._tokens:
+            return None
+        size = len(self._tokens)
+        first_idx = random.randrange(size)
+        if size == 1:
+            return self._tokens[first_idx]
+        # Distinct second index.
+        second_idx = random.randrange(size - 1)
+        if second_idx >= first_idx:
+            second_idx += 1
+        first, second = self._tokens[first_idx], self._tokens[second_idx]
+        now = time.time()
+        if self._health[second].score(now) < self._health[first].score(now):
+            return second
+        return first
+
+    def on_request_start(self, token: str) -> float:
+        health = self._health.get(token)
+        if health:
+            health.in_flight += 1
+        return time.monotonic()
+
+    def on_request_end(self, token: str, started_at: float, status: Optional[int]):
+        """:param status: None if request failed without a response (e.g. connection error)."""
+        health = self._health.get(token)
+        if not health:
+            # E.g. the token was removed during the request.
+            return
+        health.in_flight = max(health.in_flight - 1, 0)
+        health.last_used_at = time.time()
+        alpha = self.EWMA_ALPHA
+        latency = time.monotonic() - started_at
+        health.latency_ewma = latency if not health.latency_ewma else (
+            alpha * latency + (1 - alpha) * health.latency_ewma
+        )
+        is_429 = status == 429
+        is_error = status is None or status >= self.ERROR_STATUS_MIN
+        health.rate_429_ewma = alpha * is_429 + (1 - alpha) * health.rate_429_ewma
+        health.error_rate_ewma = alpha * is_error + (1 - alpha) * health.error_rate_ewma
+        if is_429:
+            cooldown = min(self.cooldown * 2 ** health.consecutive_429, self.max_cooldown)
+            health.consecutive_429 += 1
+            health.cooldown_until = health.last_used_at + cooldown
+        else:
+            health.consecutive_429 = 0
+
+    def dump(self) -> dict[str, dict]:
+        """:return: persistable stats by token fingerprint."""
+        return {get_token_fingerprint(token): health.to_persist() for token, health in self._health.items()}
+
+    def load(self, dumped: dict[str, dict]):
+        """To restore stats (e.g. shared by other processes) of known tokens, local in flight counters are kept."""
+        for token, health in self._health.items():
+            stats = dumped.get(get_token_fingerprint(token))
+            if not stats:
+                continue
+            for key, value in stats.items():
+                if hasattr(health, key) and key != 'in_flight':
+                    setattr(health, key, value)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer:
+    """Counts tokens as OpenAI models do (BPE of tiktoken), to compose requests within the model context length.
+
+    The vocabulary is loaded once from TIKTOKEN_CACHE_DIR (it is downloaded there on docker build, otherwise it is
+    downloaded on load), load it on start with `load_tokenizers` not to block the event loop on the first message.
+    If it could not be loaded (e.g. no cache and no internet), utf-8 bytes are counted instead:
+    it is an upper bound of BPE tokens, thus budgets are still not exceeded, but texts are trimmed much more
+    (e.g. ~2x for cyrillic), thus it is logged as an error.
+
+    # Use-case
+    ```
+        tokenizer = get_tokenizer('gpt-3.5-turbo')
+        prompt_tokens = tokenizer.count_chat_messages([{'role': 'user', 'content': 'What is a PhD?'}])
+        max_tokens = context_length - prompt_tokens
+        prompt = tokenizer.truncate(prompt, max_prompt_tokens)
+    ```
+    """
+    # See https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    TOKENS_PER_CHAT_MESSAGE = 3
+    TOKENS_PER_CHAT_MESSAGE_NAME = 1
+    TOKENS_PER_CHAT_REPLY = 3  # Every reply is primed with <|start|>assistant<|message|>.
+
+    def __init__(self, encoding_name: str = 'cl100k_base'):
+        self.encoding_name = encoding_name
+        self._encoding: Optional[tiktoken.Encoding] = None
+        self._is_loaded = False
+
+    def load(self):
+        """Blocking (could download the vocabulary), only the first call loads it."""
+        if self._is_loaded:
+            return
+        try:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logger.error('[Tokenizer] Could not load %s, count utf-8 bytes instead, got %s...', self.encoding_name, e)
+        self._is_loaded = True
+
+    @property
+    def encoding(self) -> Optional[tiktoken.Encoding]:
+        if not self._is_loaded:
+            self.load()
+        return self._encoding
+
+    @property
+    def is_exact(self) -> bool:
+        return self.encoding is not None
+
+    def encode(self, text: str) -> list[int]:
+        if self.encoding is None:
+            return list(text.encode())
+        # Special tokens are counted as plain text, since they are plain text in user messages.
+        return self.encoding.encode(text, disallowed_special=())
+
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return len(text.encode())
+        return len(self.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """:return: the beginning of the text within max_tokens."""
+        tokens = self.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        if self.encoding is None:
+            return bytes(tokens[:max(max_tokens, 0)]).decode(errors='ignore')
+        return self.encoding.decode(tokens[:max(max_tokens, 0)])
+
+    def count_chat_message(self, role: str, content: Optional[str], name: Optional[str] = None) -> int:
+        tokens = self.TOKENS_PER_CHAT_MESSAGE + self.count(role) + self.count(content or '')
+        if name:
+            tokens += self.TOKENS_PER_CHAT_MESSAGE_NAME + self.count(name)
+        return tokens
+
+    def count_chat_messages(self, messages: list[dict]) -> int:
+        """Prompt tokens of the chat completion request with the messages."""
+        return sum(
+            self.count_chat_message(message['role'], message['content'], message.get('name')) for message in messages
+        ) + self.TOKENS_PER_CHAT_REPLY
+
+
+@lru_cache(maxsize=None)
+def _get_tokenizer_by_encoding(encoding_name: str) -> Tokenizer:
+    return Tokenizer(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str) -> Tokenizer:
+    """Tokenizers are shared per encoding (models could share it), thus the vocabulary is loaded once."""
+    try:
+        encoding_name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        logger.warning('[get_tokenizer] Unknown model %s, use cl100k_base...', model)
+        encoding_name = 'cl100k_base'
+    return _get_tokenizer_by_encoding(encoding_name)
+
+
+async def load_tokenizers(models: Iterable[str]):
+    """Loads vocabularies of tokenizers of the models on the default executor (e.g. on start)."""
+    loop = asyncio.get_running_loop()
+    for tokenizer in {get_tokenizer(model) for model in models}:
+        await loop.run_in_executor(None, tokenizer.load)
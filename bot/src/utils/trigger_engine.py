@@ -0,0 +1,121 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+
+@dataclass(frozen=True)
+class TriggerRule:
+    """Fires if the text contains one of literals (matched as is, not as patterns)."""
+    name: str
+    literals: tuple[str, ...]
+    ignore_case: bool = False
+    at_start: bool = False
+    at_end: bool = False
+
+
+def question_rule() -> TriggerRule:
+    return TriggerRule('question', ('?',))
+
+
+def endings_rule(endings: Iterable[str]) -> TriggerRule:
+    """Text ends with one of endings (as is, without stripping)."""
+    return TriggerRule('ending', tuple(endings), at_end=True)
+
+
+def mention_rule(username: str) -> TriggerRule:
+    """Case insensitive, thus the text is not lowercased (copied) to be searched."""
+    return TriggerRule('mention', ('@' + username,), ignore_case=True)
+
+
+def keywords_rule(keywords: Iterable[str], ignore_case: bool = True, at_start: bool = False) -> TriggerRule:
+    """:param at_start: only at the start of the text (as `re.match` does)."""
+    return TriggerRule('keyword', tuple(keywords), ignore_case=ignore_case, at_start=at_start)
+
+
+def _get_first_char_variants(char: str) -> Optional[list[str]]:
+    """Chars matching the char ignoring case, None if it can not be expressed by single chars (e.g. 'ß')."""
+    variants = {char, char.lower(), char.upper(), char.swapcase(), char.casefold()}
+    if any(len(variant) != 1 for variant in variants):
+        return None
+    return sorted(variants)
+
+
+def _get_alternatives(rule: TriggerRule, literal: str) -> list[tuple[str, str]]:
+    """:return: (first char, rest of the pattern) of alternatives matching the literal, the first char is empty
+        if the alternative can not start with a literal char (then the rest is the whole pattern).
+    """
+    rest = re.escape(literal[1:])
+    first_chars = [literal[0]]
+    if rule.ignore_case:
+        first_chars = _get_first_char_variants(literal[0])
+        if first_chars is None:
+            first_chars, rest = [''], re.escape(literal)
+        if rest:
+            rest = f'(?i:{rest})'
+    if rule.at_end:
+        rest += r'\Z'
+    if rule.at_start:
+        return [('', r'\A' + re.escape(first_char) + rest) for first_char in first_chars]
+    return [(first_char, rest) for first_char in first_chars]
+
+
+class TriggerEngine:
+    """Evaluates all trigger rules of a text in 1 pass: literals of rules are compiled once into 1 regex
+    and the text is scanned once without being copied (e.g. lowercased).
+
+    Alternatives of the regex are grouped by their first literal char (case insensitive literals are expanded by
+    cases of the first char), thus `re` skips the text to the next possible first char in C and tries only
+    alternatives of that char, instead of trying each alternative at each position (what happens with named groups
+    or `(?i:...)` at the start of alternatives, see `python -m benchmarks.triggers`).
+    The rule of an alternative is found by the empty group ending the alternative (the last matched group).
+
+    Note, the trigger found first in the text wins (by the order of rules at the same position),
+    e.g. for '@bot why?' it is 'mention'.
+
+    # Use-case
+    ```
+        engine = TriggerEngine(
+            [question_rule(), mention_rule('phd_bot'), keywords_rule(['phd', 'thesis'])],
+            min_length=350,
+        )
+        engine.match('Is it a PhD?')  # 'keyword'
+        engine.match('Hi')  # None
+    ```
+    """
+    LENGTH = 'length'
+
+    def __init__(self, rules: Iterable[TriggerRule], min_length: Optional[int] = None):
+        """:param min_length: texts longer than that trigger (reported as LENGTH) without being scanned, None - off."""
+        self.rules = tuple(rules)
+        self.min_length = min_length
+        # First char to the rest of patterns of alternatives and names of their rules,
+        # alternatives which do not start with a literal char are not grouped (keyed by the empty char and pattern).
+        branches: dict[tuple[str, str], list[tuple[str, str]]] = {}
+        for rule in self.rules:
+            # The longest first, thus a literal is not shadowed by its prefix (e.g. '..' by '...').
+            for literal in sorted({literal for literal in rule.literals if literal}, key=len, reverse=True):
+                for first_char, rest in _get_alternatives(rule, literal):
+                    branches.setdefault((first_char, '' if first_char else rest), []).append((rest, rule.name))
+
+        branch_patterns = []
+        # Group index to the name of the rule, groups are numbered from 1 in order of the pattern.
+        self._group_rules: dict[int, str] = {}
+        for (first_char, _), alternatives in branches.items():
+            for _, rule_name in alternatives:
+                self._group_rules[len(self._group_rules) + 1] = rule_name
+            rests = [rest + '()' for rest, _ in alternatives]
+            branch_pattern = rests[0] if len(rests) == 1 else '(?:' + '|'.join(rests) + ')'
+            branch_patterns.append(re.escape(first_char) + branch_pattern)
+        # Rules without literals are dropped (an empty alternation would match any text).
+        self._pattern = re.compile('|'.join(branch_patterns)) if branch_patterns else None
+
+    def match(self, text: Optional[str]) -> Optional[str]:
+        """:return: name of the trigger that fired, None if none."""
+        if not text:
+            return None
+        if self.min_length is not None and len(text) > self.min_length:
+            return self.LENGTH
+        if self._pattern is None:
+            return None
+        found = self._pattern.search(text)
+        return self._group_rules[found.lastindex] if found else None
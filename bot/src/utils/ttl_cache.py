@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUTTLCache:
+    """Small in-process cache: bounded by maxsize (least recently used are evicted) and each value expires after ttl.
+    Note, None values are cached as well, use MISSING to check for a miss.
+
+    # Use-case
+    ```
+        cache = LRUTTLCache(maxsize=1000, ttl=60)
+        value = cache.get(key)
+        if value is LRUTTLCache.MISSING:
+            value = await load(key)
+            cache.set(key, value)
+    ```
+    """
+    MISSING = object()
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)